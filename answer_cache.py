@@ -0,0 +1,159 @@
+import os
+import time
+import threading
+
+import numpy as np
+
+# Cached answers per database, each a dict of entry id -> entry, oldest first
+_entries = {}
+# Next entry id
+_next_id = 0
+_lock = threading.Lock()
+# Hit and miss counters, see get_answer_cache_stats
+_stats = {"hits": 0, "misses": 0, "expired": 0, "invalidated": 0, "evicted": 0}
+
+
+def _max_entries():
+    return int(os.getenv("ANSWER_CACHE_SIZE", "256"))
+
+def answer_cache_enabled():
+    """
+    Return whether answers are cached, ANSWER_CACHE_SIZE=0 disables the cache.
+    """
+    return _max_entries() > 0
+
+def _similarities(entries, embedding):
+    """
+    Return the cosine similarity of each entry's prompt embedding to an embedding.
+    OpenAI embeddings are unit length, so this is their dot product.
+    """
+    matrix = np.stack([entry["embedding"] for entry in entries.values()])
+    return matrix @ np.asarray(embedding, dtype='float32')
+
+def lookup_answer(embedding, k, min_score, db_path="memories.db"):
+    """
+    Return the cached answer to the most similar earlier prompt, if it is similar enough.
+
+    Only answers built with the same k and min_score are considered, and answers
+    older than ANSWER_CACHE_TTL seconds are dropped.
+
+    Args:
+        embedding (list): The embedding of the prompt.
+        k (int): The number of memories used as context.
+        min_score (float, optional): The minimum similarity of memories used as context.
+        db_path (str): The path to the SQLite database file.
+
+    Returns:
+        str: The cached answer, or None on a miss.
+    """
+    threshold = float(os.getenv("ANSWER_CACHE_SIMILARITY", "0.95"))
+    expires_before = time.monotonic() - float(os.getenv("ANSWER_CACHE_TTL", "3600"))
+    with _lock:
+        entries = _entries.get(db_path)
+        if entries:
+            expired = [entry_id for entry_id, entry in entries.items() if entry["created"] < expires_before]
+            for entry_id in expired:
+                del entries[entry_id]
+            _stats["expired"] += len(expired)
+        if not entries:
+            _stats["misses"] += 1
+            return None
+
+        similarities = _similarities(entries, embedding)
+        best, best_similarity = None, threshold
+        for entry, similarity in zip(entries.values(), similarities):
+            if entry["k"] == k and entry["min_score"] == min_score and similarity >= best_similarity:
+                best, best_similarity = entry, similarity
+        if best is None:
+            _stats["misses"] += 1
+            return None
+        _stats["hits"] += 1
+        return best["answer"]
+
+def store_answer(embedding, memory_ids, answer, k, min_score, db_path="memories.db"):
+    """
+    Cache an answer, evicting the oldest entries beyond ANSWER_CACHE_SIZE.
+
+    Args:
+        embedding (list): The embedding of the prompt.
+        memory_ids (list): The ids of the memories the answer was built from.
+        answer (str): The assistant's answer.
+        k (int): The number of memories used as context.
+        min_score (float, optional): The minimum similarity of memories used as context.
+        db_path (str): The path to the SQLite database file.
+    """
+    global _next_id
+    if not answer or not answer_cache_enabled():
+        return
+    with _lock:
+        entries = _entries.setdefault(db_path, {})
+        entries[_next_id] = {
+            "embedding": np.asarray(embedding, dtype='float32'),
+            "memory_ids": set(memory_ids),
+            "answer": answer,
+            "k": k,
+            "min_score": min_score,
+            "created": time.monotonic()
+        }
+        _next_id += 1
+        while len(entries) > _max_entries():
+            del entries[next(iter(entries))]
+            _stats["evicted"] += 1
+
+def invalidate_memories(memory_ids, db_path="memories.db"):
+    """
+    Drop the cached answers that used any of the given memories.
+
+    Args:
+        memory_ids (list): Ids of memories that were changed or deleted.
+        db_path (str): The path to the SQLite database file.
+    """
+    memory_ids = set(memory_ids)
+    with _lock:
+        entries = _entries.get(db_path)
+        if not entries:
+            return
+        stale = [entry_id for entry_id, entry in entries.items() if entry["memory_ids"] & memory_ids]
+        for entry_id in stale:
+            del entries[entry_id]
+        _stats["invalidated"] += len(stale)
+
+def invalidate_near(embeddings, db_path="memories.db"):
+    """
+    Drop the cached answers whose prompt is close to a new memory, which the
+    answer would likely have used. Closeness is a cosine similarity of at least
+    ANSWER_CACHE_INVALIDATE_SIMILARITY.
+
+    Args:
+        embeddings (list): The embeddings of new or changed memories.
+        db_path (str): The path to the SQLite database file.
+    """
+    threshold = float(os.getenv("ANSWER_CACHE_INVALIDATE_SIMILARITY", "0.4"))
+    with _lock:
+        entries = _entries.get(db_path)
+        if not entries or len(embeddings) == 0:
+            return
+        matrix = np.stack([entry["embedding"] for entry in entries.values()])
+        closest = (matrix @ np.asarray(embeddings, dtype='float32').T).max(axis=1)
+        stale = [entry_id for entry_id, similarity in zip(list(entries), closest) if similarity >= threshold]
+        for entry_id in stale:
+            del entries[entry_id]
+        _stats["invalidated"] += len(stale)
+
+def release_answers(db_path="memories.db"):
+    """
+    Drop every cached answer of a database to free memory.
+    """
+    with _lock:
+        _entries.pop(db_path, None)
+
+def get_answer_cache_stats():
+    """
+    Return the answer cache counters, the hit rate and the number of cached answers.
+    """
+    with _lock:
+        stats = dict(_stats)
+        stats["entries"] = sum(len(entries) for entries in _entries.values())
+    lookups = stats["hits"] + stats["misses"]
+    stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+    return stats
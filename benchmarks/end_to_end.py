@@ -0,0 +1,287 @@
+"""
+End-to-end benchmark of MemoryMaker against the local fake OpenAI server.
+
+For each size a database is seeded with that many synthetic memories, then a fresh
+process copies it and measures:
+- startup: main() with no snapshot (a full rebuild_faiss_index) and with one
+- search: search_similar_entries latency in vector, lexical and hybrid mode
+- chat: /chat throughput and latency with concurrent clients
+- graph: /graph-data time with the graph cache cold and warm
+- ingest: memories per second through add_memories_batch
+
+    python -m benchmarks.end_to_end --sizes 1000,100000 --latency-ms 50 --json bench.json
+    python -m benchmarks.end_to_end --compare old.json bench.json
+
+Seeded databases are kept in --workdir and reused. A million rows take about 6 GB
+on disk and as much memory for a flat index.
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import logging
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from database import initialize_db, add_many_to_db, close_connections
+from graph_cache import invalidate_graph
+from benchmarks.fake_openai import start_fake_server, DEFAULT_DIMENSION
+
+DEFAULT_SIZES = "1000,100000,1000000"
+
+
+def _vocabulary(seed=0, size=5000):
+    """
+    Return a fixed list of made-up words, so seeded texts can be searched lexically.
+    """
+    rng = random.Random(seed)
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    return [''.join(rng.choice(letters) for _ in range(rng.randint(3, 10))) for _ in range(size)]
+
+def _sentence(rng, words, length=20):
+    return ' '.join(rng.choice(words) for _ in range(length))
+
+def seed_database(db_path, size, dimension=DEFAULT_DIMENSION, batch_size=10000, seed=0):
+    """
+    Fill a new database with size synthetic memories and random unit-length embeddings.
+    """
+    initialize_db(db_path)
+    words = _vocabulary(seed)
+    keywords = words[:500]
+    rng = random.Random(seed)
+    vectors_rng = np.random.default_rng(seed)
+    for start in range(0, size, batch_size):
+        count = min(batch_size, size - start)
+        vectors = vectors_rng.standard_normal((count, dimension), dtype='float32')
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        add_many_to_db([
+            (f"memory-{start + i}", _sentence(rng, words), rng.sample(keywords, 3), vectors[i].tobytes())
+            for i in range(count)
+        ], db_path)
+    close_connections()
+
+def seeded_database(workdir, size):
+    """
+    Return the path of the seeded database for a size, seeding it on first use.
+    """
+    db_path = os.path.join(workdir, f"seed-{size}.db")
+    if not os.path.exists(db_path):
+        print(f"Seeding {size} memories into {db_path}", file=sys.stderr)
+        start = time.perf_counter()
+        seed_database(db_path + ".tmp", size)
+        os.replace(db_path + ".tmp", db_path)
+        print(f"Seeded in {time.perf_counter() - start:.1f} s", file=sys.stderr)
+    return db_path
+
+def _latencies(latencies_ms):
+    return {
+        "count": len(latencies_ms),
+        "mean_ms": float(np.mean(latencies_ms)),
+        "p50_ms": float(np.percentile(latencies_ms, 50)),
+        "p95_ms": float(np.percentile(latencies_ms, 95)),
+        "p99_ms": float(np.percentile(latencies_ms, 99)),
+    }
+
+def _timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, (time.perf_counter() - start) * 1000
+
+def run_size(args):
+    """
+    Measure one seeded database, in a fresh process whose working directory is a copy of it.
+    """
+    logging.basicConfig(level=logging.WARNING)
+    os.chdir(args.run_dir)
+    # Imported here so it picks up the fake server's environment
+    import main as app_main
+
+    result = {"size": args.size}
+
+    # Startup without a snapshot rebuilds the index from the stored embeddings
+    _, result["startup_rebuild_ms"] = _timed(app_main.main)
+    app_main.save_all_snapshots()
+    app_main.stores.clear()
+    _, result["startup_snapshot_ms"] = _timed(app_main.get_store)
+
+    words = _vocabulary()
+    rng = random.Random(1)
+    queries = [_sentence(rng, words, 6) for _ in range(args.queries)]
+    result["search"] = {}
+    for mode in ("vector", "lexical", "hybrid"):
+        latencies = [_timed(app_main.search_similar_entries, query, 5, None, mode=mode)[1] for query in queries]
+        result["search"][mode] = _latencies(latencies)
+
+    def chat(prompt):
+        client = app_main.app.test_client()
+        response, elapsed = _timed(client.post, '/chat', json={"prompt": prompt})
+        return response.status_code, elapsed
+
+    prompts = [f"Question {i}: {_sentence(rng, words, 8)}" for i in range(args.requests)]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        responses = list(executor.map(chat, prompts))
+    elapsed = time.perf_counter() - start
+    result["chat"] = dict(
+        _latencies([latency for _, latency in responses]),
+        concurrency=args.concurrency,
+        errors=sum(status != 200 for status, _ in responses),
+        requests_per_second=len(prompts) / elapsed
+    )
+
+    client = app_main.app.test_client()
+    invalidate_graph()
+    response, cold_ms = _timed(client.get, '/graph-data')
+    _, warm_ms = _timed(client.get, '/graph-data')
+    result["graph"] = {"cold_ms": cold_ms, "warm_ms": warm_ms, "elements": len(response.get_json())}
+
+    entries = [(f"ingest-{i}", f"Ingested note {i}: {_sentence(rng, words)}", rng.sample(words[:500], 3))
+               for i in range(args.ingest)]
+    start = time.perf_counter()
+    stored = 0
+    for offset in range(0, len(entries), args.ingest_batch):
+        memory_ids = app_main.add_memories_batch(entries[offset:offset + args.ingest_batch])
+        stored += sum(memory_id is not None for memory_id in memory_ids)
+    elapsed = time.perf_counter() - start
+    result["ingest"] = {"memories": stored, "seconds": elapsed, "memories_per_second": stored / elapsed}
+
+    with open(args.result, "w") as f:
+        json.dump(result, f)
+
+def run_benchmarks(sizes, workdir, latency_ms, options):
+    """
+    Seed and measure every size, each in its own process.
+
+    Args:
+        sizes (list): The numbers of memories to benchmark.
+        workdir (str): Where seeded databases and run copies are kept.
+        latency_ms (float): The fake server's delay per request.
+        options (list): Extra command-line options passed to each run.
+
+    Returns:
+        list: One result dictionary per size.
+    """
+    os.makedirs(workdir, exist_ok=True)
+    server = start_fake_server(latency_ms=latency_ms)
+    env = dict(
+        os.environ,
+        OPENAI_BASE_URL=f"http://127.0.0.1:{server.server_port}/v1",
+        OPENAI_API_KEY="fake",
+        EMBEDDING_CACHE_DB="",
+        PYTHONPATH=os.pathsep.join([os.getcwd()] + sys.path)
+    )
+    results = []
+    try:
+        for size in sizes:
+            seed_path = seeded_database(workdir, size)
+            run_dir = os.path.abspath(os.path.join(workdir, f"run-{size}"))
+            shutil.rmtree(run_dir, ignore_errors=True)
+            os.makedirs(run_dir)
+            shutil.copy(seed_path, os.path.join(run_dir, "memories.db"))
+            result_path = os.path.join(run_dir, "result.json")
+            print(f"Benchmarking {size} memories", file=sys.stderr)
+            subprocess.run(
+                [sys.executable, "-m", "benchmarks.end_to_end", "--run-dir", run_dir, "--size", str(size),
+                 "--result", result_path] + options,
+                env=env, check=True
+            )
+            with open(result_path) as f:
+                results.append(json.load(f))
+    finally:
+        server.shutdown()
+    return results
+
+def git_revision():
+    """
+    Return the current git commit, or None outside a git checkout.
+    """
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def _flatten(result, prefix=""):
+    flat = {}
+    for key, value in result.items():
+        if isinstance(value, dict):
+            flat.update(_flatten(value, f"{prefix}{key}."))
+        elif isinstance(value, (int, float)):
+            flat[prefix + key] = value
+    return flat
+
+def compare_reports(old, new):
+    """
+    Print the relative change of every measurement between two reports, by size.
+    """
+    old_results = {result["size"]: _flatten(result) for result in old["results"]}
+    print(f"{old.get('revision') or 'old'} -> {new.get('revision') or 'new'}")
+    for result in new["results"]:
+        before = old_results.get(result["size"])
+        if before is None:
+            continue
+        print(f"size {result['size']}")
+        for key, value in _flatten(result).items():
+            if key == "size" or key not in before or not before[key]:
+                continue
+            change = (value - before[key]) / before[key] * 100
+            print(f"  {key:<36} {before[key]:>12.2f} {value:>12.2f} {change:>+8.1f}%")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help="Comma-separated numbers of memories")
+    parser.add_argument("--workdir", default="bench-data", help="Where seeded databases are kept")
+    parser.add_argument("--latency-ms", type=float, default=0, help="Fake server delay per request")
+    parser.add_argument("--queries", type=int, default=200, help="Searches per mode")
+    parser.add_argument("--requests", type=int, default=200, help="/chat requests")
+    parser.add_argument("--concurrency", type=int, default=8, help="Concurrent /chat clients")
+    parser.add_argument("--ingest", type=int, default=1000, help="Memories ingested")
+    parser.add_argument("--ingest-batch", type=int, default=100, help="Memories per add_memories_batch call")
+    parser.add_argument("--json", help="Write the report to this JSON file")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="Compare two JSON reports")
+    # Used internally to run one size in a fresh process
+    parser.add_argument("--run-dir", help=argparse.SUPPRESS)
+    parser.add_argument("--size", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--result", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.compare:
+        with open(args.compare[0]) as f_old, open(args.compare[1]) as f_new:
+            compare_reports(json.load(f_old), json.load(f_new))
+        return
+    if args.run_dir:
+        run_size(args)
+        return
+
+    options = [
+        "--queries", str(args.queries), "--requests", str(args.requests), "--concurrency", str(args.concurrency),
+        "--ingest", str(args.ingest), "--ingest-batch", str(args.ingest_batch)
+    ]
+    sizes = [int(size) for size in args.sizes.split(',')]
+    report = {
+        "revision": git_revision(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": {
+            "sizes": sizes,
+            "latency_ms": args.latency_ms,
+            "queries": args.queries,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "ingest": args.ingest,
+            "faiss_backend": os.getenv("FAISS_BACKEND", "flat"),
+            "search_mode": os.getenv("SEARCH_MODE", "hybrid"),
+        },
+        "results": run_benchmarks(sizes, args.workdir, args.latency_ms, options),
+    }
+    output = json.dumps(report, indent=2)
+    if args.json:
+        with open(args.json, "w") as f:
+            f.write(output)
+    print(output)
+
+if __name__ == "__main__":
+    main()
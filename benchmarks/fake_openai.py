@@ -0,0 +1,203 @@
+"""
+Local stand-in for the OpenAI embeddings and chat completions endpoints.
+
+Embeddings are deterministic unit vectors derived from a hash of each input, so the
+same text always gets the same vector. Point the app at it with OPENAI_BASE_URL:
+
+    python -m benchmarks.fake_openai --port 8001 --latency-ms 50
+    OPENAI_BASE_URL=http://localhost:8001/v1 OPENAI_API_KEY=fake python main.py
+"""
+import json
+import time
+import hashlib
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import numpy as np
+
+DEFAULT_DIMENSION = 1536
+
+# Request counters, served on GET /stats
+stats = {"embedding_requests": 0, "embedding_inputs": 0, "chat_requests": 0}
+_stats_lock = threading.Lock()
+
+
+def fake_embedding(text, dimension=DEFAULT_DIMENSION):
+    """
+    Return the deterministic unit vector for a text.
+    """
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+    vector = np.random.default_rng(seed).standard_normal(dimension).astype('float32')
+    return (vector / np.linalg.norm(vector)).tolist()
+
+def fake_completion(messages):
+    """
+    Return a reply for a chat: analyzer prompts get a memory JSON, anything else an echo.
+    """
+    system = next((m["content"] for m in messages if m["role"] == "system"), "")
+    user = messages[-1]["content"] if messages else ""
+    if "Adaptive Learning Analyzer" in system:
+        slug = hashlib.sha256(user.encode("utf-8")).hexdigest()[:12]
+        words = [word.strip(".,!?").lower() for word in user.split()][:5]
+        return json.dumps({
+            "_thoughts": "Fake analysis",
+            "keywords": [word for word in words if word],
+            "content": user,
+            "title": f"memory-{slug}"
+        })
+    return f"Fake answer to: {user}"
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    latency = 0.0
+    token_latency = 0.0
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, payload, status=200):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/stats"):
+            with _stats_lock:
+                self._send_json(dict(stats))
+        else:
+            self._send_json({"error": "not found"}, 404)
+
+    def _send_stream(self, reply, model, usage=None):
+        """
+        Send a reply as chat.completion.chunk Server-Sent Events, one word per chunk,
+        followed by a usage chunk when usage is given.
+        """
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        words = reply.split(" ")
+        for i, word in enumerate(words):
+            chunk = {
+                "id": "chatcmpl-fake",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "delta": {"content": word if i == 0 else " " + word},
+                    "finish_reason": None
+                }]
+            }
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+            time.sleep(self.token_latency)
+        final = {
+            "id": "chatcmpl-fake",
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]
+        }
+        self.wfile.write(f"data: {json.dumps(final)}\n\n".encode("utf-8"))
+        if usage is not None:
+            final.update(choices=[], usage=usage)
+            self.wfile.write(f"data: {json.dumps(final)}\n\n".encode("utf-8"))
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+        time.sleep(self.latency)
+
+        if self.path.endswith("/embeddings"):
+            inputs = request["input"]
+            if isinstance(inputs, str):
+                inputs = [inputs]
+            dimension = request.get("dimensions") or DEFAULT_DIMENSION
+            with _stats_lock:
+                stats["embedding_requests"] += 1
+                stats["embedding_inputs"] += len(inputs)
+            tokens = sum(len(text) // 4 + 1 for text in inputs)
+            self._send_json({
+                "object": "list",
+                "model": request.get("model"),
+                "data": [
+                    {"object": "embedding", "index": i, "embedding": fake_embedding(text, dimension)}
+                    for i, text in enumerate(inputs)
+                ],
+                "usage": {"prompt_tokens": tokens, "total_tokens": tokens}
+            })
+        elif self.path.endswith("/chat/completions"):
+            with _stats_lock:
+                stats["chat_requests"] += 1
+            reply = fake_completion(request["messages"])
+            prompt_tokens = sum(len(m["content"]) // 4 + 1 for m in request["messages"])
+            completion_tokens = len(reply) // 4 + 1
+            usage = {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens
+            }
+            if request.get("stream"):
+                include_usage = (request.get("stream_options") or {}).get("include_usage")
+                self._send_stream(reply, request.get("model"), usage if include_usage else None)
+                return
+            self._send_json({
+                "id": "chatcmpl-fake",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": request.get("model"),
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": reply},
+                    "finish_reason": "stop"
+                }],
+                "usage": usage
+            })
+        else:
+            self._send_json({"error": "not found"}, 404)
+
+
+def start_fake_server(port=0, latency_ms=0, token_latency_ms=0):
+    """
+    Start the fake server on a background thread.
+
+    Args:
+        port (int): The port to listen on, 0 picks a free one.
+        latency_ms (float): Delay added to every request.
+        token_latency_ms (float): Delay between the chunks of a streamed reply.
+
+    Returns:
+        ThreadingHTTPServer: The running server, its base URL is
+        f"http://127.0.0.1:{server.server_port}/v1".
+    """
+    handler = type("Handler", (FakeOpenAIHandler,), {
+        "latency": latency_ms / 1000,
+        "token_latency": token_latency_ms / 1000
+    })
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--latency-ms", type=float, default=0, help="Delay added to every request")
+    parser.add_argument("--token-latency-ms", type=float, default=0,
+                        help="Delay between the chunks of a streamed reply")
+    args = parser.parse_args()
+    server = start_fake_server(args.port, args.latency_ms, args.token_latency_ms)
+    print(f"Fake OpenAI server on http://127.0.0.1:{server.server_port}/v1")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()
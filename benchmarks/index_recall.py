@@ -0,0 +1,170 @@
+"""
+Recall-vs-latency report for the FAISS index backends.
+
+Every backend is compared against the exact flat index on the same vectors, either
+the embeddings stored in a MemoryMaker database or a synthetic clustered sample.
+Compressed backends are measured with and without exact re-ranking of their
+candidates, and every backend reports the memory it saves against flat:
+
+    python -m benchmarks.index_recall --db memories.db
+    python -m benchmarks.index_recall --synthetic 100000 --json report.json
+"""
+import os
+import json
+import time
+import argparse
+import sqlite3
+
+import numpy as np
+import faiss
+
+from vector_index import BACKENDS, create_index, min_training_vectors, train_index, is_compressed
+
+# Search-time settings swept for each backend
+SWEEPS = {
+    "flat": [{}],
+    "ivf_flat": [{"nprobe": n} for n in (1, 4, 16, 64)],
+    "hnsw": [{"efSearch": n} for n in (16, 64, 256)],
+    "ivf_pq": [{"nprobe": n} for n in (1, 4, 16, 64)],
+    "fp16": [{}],
+    "sq8": [{}],
+}
+# Candidates fetched per result before exact re-ranking, tried for compressed backends
+RERANK_FACTORS = (1, 4, 16)
+
+
+def load_vectors(db_path):
+    """
+    Load the stored embeddings of a database as a (n, dimension) float32 matrix.
+    """
+    conn = sqlite3.connect(db_path)
+    rows = conn.execute('SELECT embedding FROM memories WHERE embedding IS NOT NULL').fetchall()
+    conn.close()
+    vectors = np.frombuffer(b''.join(row[0] for row in rows), dtype='float32')
+    return vectors.reshape(len(rows), -1)
+
+def synthetic_vectors(count, dimension, clusters=256, seed=0):
+    """
+    Generate unit-length vectors grouped around random centroids, like text embeddings.
+    """
+    rng = np.random.default_rng(seed)
+    centroids = rng.standard_normal((clusters, dimension)).astype('float32')
+    vectors = centroids[rng.integers(0, clusters, count)]
+    vectors += 0.5 * rng.standard_normal((count, dimension)).astype('float32')
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors
+
+def measure(index, queries, k, ground_truth, vectors=None, rerank=1):
+    """
+    Run the queries one at a time, as /chat does, and return recall and latency.
+    With rerank above 1, rerank * k candidates are re-ranked by their exact distance
+    to the query using the full-precision vectors, as main.rerank_exact does.
+    """
+    latencies = []
+    hits = 0
+    for query, expected in zip(queries, ground_truth):
+        start = time.perf_counter()
+        _, ids = index.search(query.reshape(1, -1), k * rerank)
+        ids = ids[0][ids[0] != -1]
+        if rerank > 1:
+            distances = ((vectors[ids] - query) ** 2).sum(axis=1)
+            ids = ids[np.argsort(distances, kind='stable')]
+        ids = ids[:k]
+        latencies.append((time.perf_counter() - start) * 1000)
+        hits += len(set(ids) & set(expected))
+    return {
+        "recall": hits / (len(queries) * k),
+        "latency_ms_p50": float(np.percentile(latencies, 50)),
+        "latency_ms_p95": float(np.percentile(latencies, 95)),
+    }
+
+def run_report(vectors, backends, queries_count, k):
+    """
+    Build every backend over the vectors and measure it against the flat baseline.
+
+    Returns:
+        list: One result dictionary per backend and search setting.
+    """
+    rng = np.random.default_rng(1)
+    picked = rng.choice(len(vectors), min(queries_count, len(vectors)), replace=False)
+    noise = 0.05 * rng.standard_normal((len(picked), vectors.shape[1])).astype('float32')
+    queries = vectors[picked] + noise
+
+    baseline = faiss.IndexFlatL2(vectors.shape[1])
+    baseline.add(vectors)
+    _, ground_truth = baseline.search(queries, k)
+    flat_bytes = len(faiss.serialize_index(baseline))
+
+    results = []
+    for backend in backends:
+        index = create_index(vectors.shape[1], backend)
+        start = time.perf_counter()
+        required = min_training_vectors(index)
+        if required > len(vectors):
+            print(f"Skipping {backend}: needs {required} vectors to train, have {len(vectors)}")
+            continue
+        if required:
+            train_index(index, vectors)
+        # Backends are IDMap2-wrapped, key each vector by its row so ids match the ground truth
+        index.add_with_ids(vectors, np.arange(len(vectors), dtype='int64'))
+        build_seconds = time.perf_counter() - start
+        size_bytes = len(faiss.serialize_index(index))
+
+        factors = RERANK_FACTORS if is_compressed(index) else (1,)
+        for setting in SWEEPS[backend]:
+            params = faiss.ParameterSpace()
+            for name, value in setting.items():
+                params.set_index_parameter(index, name, value)
+            for rerank in factors:
+                result = {
+                    "backend": backend,
+                    "params": setting,
+                    "rerank": rerank,
+                    "vectors": len(vectors),
+                    "build_seconds": build_seconds,
+                    "index_bytes": size_bytes,
+                    "memory_saved": 1 - size_bytes / flat_bytes,
+                }
+                result.update(measure(index, queries, k, ground_truth, vectors, rerank))
+                results.append(result)
+    return results
+
+def print_report(results, k):
+    """
+    Print the results as a table.
+    """
+    print(
+        f"{'backend':<10} {'params':<16} {'rerank':>6} {'recall@' + str(k):>9} {'p50 ms':>8} {'p95 ms':>8} "
+        f"{'build s':>8} {'MB':>8} {'saved':>6}"
+    )
+    for r in results:
+        params = ','.join(f"{name}={value}" for name, value in r["params"].items()) or '-'
+        print(
+            f"{r['backend']:<10} {params:<16} {r['rerank']:>6} {r['recall']:>9.3f} {r['latency_ms_p50']:>8.3f} "
+            f"{r['latency_ms_p95']:>8.3f} {r['build_seconds']:>8.2f} {r['index_bytes'] / 2**20:>8.1f} "
+            f"{r['memory_saved']:>6.0%}"
+        )
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", help="Use the embeddings stored in this database")
+    parser.add_argument("--synthetic", type=int, default=50000, help="Number of synthetic vectors")
+    parser.add_argument("--dimension", type=int, default=1536, help="Dimension of synthetic vectors")
+    parser.add_argument("--backends", default=','.join(BACKENDS), help="Comma-separated backends")
+    parser.add_argument("--queries", type=int, default=200, help="Number of queries")
+    parser.add_argument("-k", type=int, default=5, help="Neighbours per query")
+    parser.add_argument("--nlist", type=int, help="Override FAISS_NLIST")
+    parser.add_argument("--json", help="Also write the results to this JSON file")
+    args = parser.parse_args()
+
+    if args.nlist:
+        os.environ["FAISS_NLIST"] = str(args.nlist)
+    vectors = load_vectors(args.db) if args.db else synthetic_vectors(args.synthetic, args.dimension)
+    results = run_report(vectors, args.backends.split(','), args.queries, args.k)
+    print_report(results, args.k)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,274 @@
+"""
+Bulk import and export of memories.
+
+    python bulk.py import memories.jsonl
+    python bulk.py import memories.csv
+    python bulk.py import notes.txt --format text
+    python bulk.py export backup.jsonl
+
+JSONL and CSV records have a title, content and keywords (a list, or a comma-separated
+string). JSONL records may also carry an embedding, as written by export, which is then
+used instead of calling the embeddings API. Text documents are split into chunks of
+about --chunk-tokens tokens. Input is streamed, so files larger than memory work.
+"""
+import os
+import csv
+import sys
+import json
+import time
+import hashlib
+import argparse
+
+import numpy as np
+
+from dotenv import load_dotenv
+
+from database import initialize_db, iter_memories, get_keywords_for_memories
+from tokenizer import count_tokens
+from tenants import tenant_db_path
+
+
+def _parse_keywords(keywords):
+    if isinstance(keywords, str):
+        return [keyword.strip() for keyword in keywords.split(',') if keyword.strip()]
+    if keywords is None:
+        return []
+    if not isinstance(keywords, list) or not all(isinstance(keyword, str) for keyword in keywords):
+        raise ValueError("keywords must be a list of strings or a comma-separated string")
+    return keywords
+
+def _record(fields, line):
+    """
+    Validate the fields of one input record.
+
+    Raises:
+        ValueError: If a field has the wrong type.
+    """
+    for name in ("title", "content"):
+        if fields.get(name) is not None and not isinstance(fields[name], str):
+            raise ValueError(f"{name} must be a string")
+    embedding = fields.get("embedding")
+    if embedding is not None and not (
+        isinstance(embedding, list) and all(isinstance(value, (int, float)) for value in embedding)
+    ):
+        raise ValueError("embedding must be a list of numbers")
+    return {
+        "title": fields.get("title"),
+        "content": fields.get("content"),
+        "keywords": _parse_keywords(fields.get("keywords")),
+        "embedding": embedding,
+        "line": line
+    }
+
+def iter_jsonl(lines):
+    """
+    Yield records from JSON lines, skipping blank lines. A line that cannot be
+    parsed yields {"line", "error"} instead, see import_records.
+    """
+    for number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            fields = json.loads(line)
+            if not isinstance(fields, dict):
+                raise ValueError("expected a JSON object")
+            record = _record(fields, number)
+        except ValueError as e:
+            record = {"line": number, "error": str(e)}
+        yield record
+
+def iter_csv(lines):
+    """
+    Yield records from CSV with title, content and keywords columns. A row that
+    cannot be parsed yields {"line", "error"} instead, see import_records.
+    """
+    reader = csv.DictReader(lines)
+    while True:
+        try:
+            row = next(reader)
+        except StopIteration:
+            return
+        except csv.Error as e:
+            yield {"line": reader.line_num, "error": str(e)}
+            continue
+        yield _record({name: row.get(name) for name in ("title", "content", "keywords")}, reader.line_num)
+
+def iter_text_chunks(lines, name, chunk_tokens=300):
+    """
+    Yield records from a raw text document, split on blank lines into chunks of about
+    chunk_tokens tokens. Paragraphs longer than that are split on word boundaries.
+
+    Titles are unique, so each chunk's title ends with a hash of its content: chunks
+    of another document imported under the same name are stored too, while importing
+    the same document again skips its chunks as duplicates.
+    """
+    def record(number, chunk):
+        content = '\n\n'.join(chunk)
+        digest = hashlib.sha256(content.encode('utf-8')).hexdigest()[:12]
+        return {"title": f"{name}-{number}-{digest}", "content": content, "keywords": [], "embedding": None}
+
+    def paragraphs():
+        paragraph = []
+        for line in lines:
+            if line.strip():
+                paragraph.append(line.strip())
+            elif paragraph:
+                yield ' '.join(paragraph)
+                paragraph = []
+        if paragraph:
+            yield ' '.join(paragraph)
+
+    def pieces():
+        for paragraph in paragraphs():
+            if count_tokens(paragraph) <= chunk_tokens:
+                yield paragraph
+                continue
+            words, piece = paragraph.split(), []
+            for word in words:
+                piece.append(word)
+                if count_tokens(' '.join(piece)) >= chunk_tokens:
+                    yield ' '.join(piece)
+                    piece = []
+            if piece:
+                yield ' '.join(piece)
+
+    chunk, tokens, number = [], 0, 0
+    for piece in pieces():
+        piece_tokens = count_tokens(piece)
+        if chunk and tokens + piece_tokens > chunk_tokens:
+            number += 1
+            yield record(number, chunk)
+            chunk, tokens = [], 0
+        chunk.append(piece)
+        tokens += piece_tokens
+    if chunk:
+        number += 1
+        yield record(number, chunk)
+
+def iter_records(lines, fmt, name="document", chunk_tokens=300):
+    """
+    Yield records from an input in the given format: jsonl, csv or text.
+    """
+    if fmt == "jsonl":
+        return iter_jsonl(lines)
+    if fmt == "csv":
+        return iter_csv(lines)
+    if fmt == "text":
+        return iter_text_chunks(lines, name, chunk_tokens)
+    raise ValueError(f"Unknown import format '{fmt}', expected jsonl, csv or text")
+
+def import_records(records, add_batch, batch_size=1000):
+    """
+    Store records in batches, yielding progress after each batch.
+
+    Args:
+        records (iterable): Record dictionaries from iter_records.
+        add_batch (callable): Called as add_batch(entries, embeddings) and returning
+            the id of each stored entry or None, like main.add_memories_batch.
+        batch_size (int): The number of records per batch.
+
+    Yields:
+        dict: Counts of imported and skipped records and of malformed records
+        (errors), elapsed seconds, records per second and, when the batch had
+        any, the line number and message of each malformed record.
+    """
+    start = time.perf_counter()
+    progress = {"imported": 0, "skipped": 0, "errors": 0}
+    # Malformed records since the last progress report
+    errors = []
+
+    def flush(batch):
+        if batch:
+            entries = [(record["title"], record["content"], record["keywords"]) for record in batch]
+            embeddings = [record["embedding"] for record in batch]
+            memory_ids = add_batch(entries, embeddings)
+            stored = sum(memory_id is not None for memory_id in memory_ids)
+            progress["imported"] += stored
+            progress["skipped"] += len(batch) - stored
+        elapsed = time.perf_counter() - start
+        result = dict(progress, elapsed_seconds=round(elapsed, 2),
+                      records_per_second=round((progress["imported"] + progress["skipped"]) / elapsed, 1))
+        if errors:
+            result["errors_in_batch"] = list(errors)
+            errors.clear()
+        return result
+
+    batch = []
+    for record in records:
+        if "error" in record:
+            progress["errors"] += 1
+            errors.append({"line": record["line"], "error": record["error"]})
+            continue
+        if not record["content"]:
+            progress["skipped"] += 1
+            continue
+        batch.append(record)
+        if len(batch) >= batch_size:
+            yield flush(batch)
+            batch = []
+    if batch or errors:
+        yield flush(batch)
+
+def export_records(db_path="memories.db", include_embeddings=True, batch_size=1000):
+    """
+    Yield every memory as a JSON line, in id order, without loading them all at once.
+    """
+    batch = []
+
+    def lines(batch):
+        keywords = get_keywords_for_memories([row[0] for row in batch], db_path)
+        for memory_id, title, content, embedding in batch:
+            record = {"id": memory_id, "title": title, "content": content, "keywords": keywords.get(memory_id, [])}
+            if include_embeddings and embedding is not None:
+                record["embedding"] = np.frombuffer(embedding, dtype='float32').tolist()
+            yield json.dumps(record) + "\n"
+
+    for row in iter_memories(db_path, batch_size):
+        batch.append(row)
+        if len(batch) >= batch_size:
+            yield from lines(batch)
+            batch = []
+    yield from lines(batch)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    import_parser = subparsers.add_parser("import", help="Import memories from a file")
+    import_parser.add_argument("path")
+    import_parser.add_argument("--format", choices=("jsonl", "csv", "text"), help="Defaults to the file extension")
+    import_parser.add_argument("--batch-size", type=int, default=1000)
+    import_parser.add_argument("--chunk-tokens", type=int, default=300)
+    export_parser = subparsers.add_parser("export", help="Export memories to a JSONL file")
+    export_parser.add_argument("path")
+    export_parser.add_argument("--no-embeddings", action="store_true")
+    for subparser in (import_parser, export_parser):
+        subparser.add_argument("--tenant", help="The tenant's memory store, memories.db by default")
+    args = parser.parse_args()
+
+    # Imported here so the parsing helpers above stay usable without the app
+    import main as app_main
+    app_main.setup_logger()
+    if args.command == "import":
+        app_main.main(workers=False)
+    else:
+        # Export only reads the database
+        load_dotenv()
+    db_path = tenant_db_path(args.tenant, create=args.command == "import")
+    initialize_db(db_path)
+
+    if args.command == "import":
+        fmt = args.format or {".csv": "csv", ".txt": "text", ".md": "text"}.get(os.path.splitext(args.path)[1], "jsonl")
+        name = os.path.splitext(os.path.basename(args.path))[0]
+        with open(args.path, newline='', encoding='utf-8') as f:
+            records = iter_records(f, fmt, name, args.chunk_tokens)
+            add_batch = lambda entries, embeddings: app_main.add_memories_batch(entries, db_path, embeddings=embeddings)
+            for progress in import_records(records, add_batch, args.batch_size):
+                print(json.dumps(progress), file=sys.stderr)
+        app_main.save_faiss_snapshot(db_path)
+    else:
+        with open(args.path, "w", encoding='utf-8') as f:
+            for line in export_records(db_path, not args.no_embeddings):
+                f.write(line)
+
+if __name__ == "__main__":
+    main()
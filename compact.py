@@ -0,0 +1,129 @@
+"""
+Offline compaction of near-duplicate memories.
+
+    python compact.py
+    python compact.py --policy merge --batch-size 500
+    python compact.py --dry-run
+
+Memories are scanned in id order, batch by batch. Each memory's nearest neighbours
+with a cosine similarity of at least DEDUP_SIMILARITY form a cluster with it, and
+the cluster is consolidated into its oldest memory according to the policy
+(DEDUP_POLICY by default): skip deletes the duplicates, merge folds their contents
+in with the merger prompt, version archives them in memory_versions.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+
+import numpy as np
+
+from dotenv import load_dotenv
+
+from database import open_read_only, iter_memories
+from tenants import tenant_path, tenant_db_path
+
+
+def compact_memories(memories, find_duplicates, consolidate, batch_size=1000):
+    """
+    Consolidate clusters of near-duplicate memories, yielding progress after each batch.
+
+    Args:
+        memories (iterable): (id, title, content, embedding) rows in id order, as
+            yielded by database.iter_memories.
+        find_duplicates (callable): Called with a batch of embeddings, one per row,
+            and returning (memory_id, similarity) pairs for each, like
+            main.find_near_duplicates.
+        consolidate (callable): Called as consolidate(memory_id, duplicate_ids) and
+            returning the ids of the duplicates it removed. None only reports the
+            clusters.
+        batch_size (int): The number of memories searched at once.
+
+    Yields:
+        dict: Counts of scanned memories, clusters found and memories removed,
+        elapsed seconds and, without consolidate, the clusters of the batch.
+    """
+    start = time.perf_counter()
+    progress = {"scanned": 0, "clusters": 0, "removed": 0}
+    # Memories already folded into an earlier one, skipped when they come up
+    removed = set()
+
+    def flush(batch):
+        clusters = []
+        embeddings_np = np.stack([np.frombuffer(row[3], dtype='float32') for row in batch])
+        for row, matches in zip(batch, find_duplicates(embeddings_np)):
+            memory_id = row[0]
+            if memory_id in removed:
+                continue
+            # Earlier memories were scanned first, so only later ones are duplicates here
+            duplicate_ids = [match_id for match_id, _ in matches
+                             if match_id > memory_id and match_id not in removed]
+            if not duplicate_ids:
+                continue
+            progress["clusters"] += 1
+            if consolidate is None:
+                clusters.append([memory_id] + duplicate_ids)
+                removed.update(duplicate_ids)
+            else:
+                folded = consolidate(memory_id, duplicate_ids)
+                removed.update(folded)
+                progress["removed"] += len(folded)
+        progress["scanned"] += len(batch)
+        result = dict(progress, elapsed_seconds=round(time.perf_counter() - start, 2))
+        if consolidate is None:
+            result["clusters_in_batch"] = clusters
+        return result
+
+    batch = []
+    for row in memories:
+        if row[3] is None or row[0] in removed:
+            continue
+        batch.append(row)
+        if len(batch) >= batch_size:
+            yield flush(batch)
+            batch = []
+    if batch:
+        yield flush(batch)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--policy", choices=("skip", "merge", "version"), help="Defaults to DEDUP_POLICY")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--neighbours", type=int, default=10, help="Nearest memories checked per memory")
+    parser.add_argument("--tenant", help="The tenant's memory store, memories.db by default")
+    parser.add_argument("--dry-run", action="store_true", help="Report the clusters without changing anything")
+    args = parser.parse_args()
+
+    # Imported here so compact_memories stays usable without the app
+    import main as app_main
+    app_main.setup_logger()
+    if args.dry_run:
+        # Only read the database and its index: no migrations, embedding calls, snapshot
+        # saves or job workers, and SQLite refuses any write
+        load_dotenv()
+        db_path = tenant_path(args.tenant)
+        if not os.path.exists(db_path):
+            parser.error(f"{db_path} does not exist")
+        open_read_only(db_path)
+        app_main.get_store(db_path, backfill=False, read_only=True)
+    else:
+        app_main.main(workers=False)
+        db_path = tenant_db_path(args.tenant)
+
+    policy = args.policy or os.getenv('DEDUP_POLICY', 'skip')
+    if policy not in ("skip", "merge", "version"):
+        policy = "skip"
+    # Each memory finds itself too, so ask for one more neighbour
+    find_duplicates = lambda embeddings_np: app_main.find_near_duplicates(embeddings_np, args.neighbours + 1, db_path)
+    consolidate = None if args.dry_run else (
+        lambda memory_id, duplicate_ids: app_main.consolidate_duplicates(memory_id, duplicate_ids, policy, db_path)
+    )
+    for progress in compact_memories(iter_memories(db_path, args.batch_size), find_duplicates,
+                                     consolidate, args.batch_size):
+        print(json.dumps(progress), file=sys.stderr)
+    if not args.dry_run:
+        app_main.save_faiss_snapshot(db_path)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+import os
+
+import numpy as np
+
+from tokenizer import count_tokens
+
+
+def pack_context(entries, query_embedding, embeddings, k, token_budget=None, min_score=None):
+    """
+    Choose the memories to use as context for a prompt.
+
+    Entries without a stored embedding or less similar to the prompt than min_score
+    are dropped. The rest are picked by maximal marginal relevance, which trades
+    similarity to the prompt against similarity to the entries already picked, and
+    entries nearly identical to a picked one are skipped. Picked entries are kept
+    while their contents fit in the token budget.
+
+    Args:
+        entries (list): Search results with "id" and "content", best first.
+        query_embedding (list): The embedding of the prompt.
+        embeddings (dict): A mapping of memory id to its stored embedding BLOB.
+        k (int): The maximum number of entries to pick.
+        token_budget (int, optional): The maximum number of context tokens,
+            CONTEXT_TOKEN_BUDGET by default.
+        min_score (float, optional): The minimum cosine similarity to the prompt,
+            CONTEXT_MIN_SCORE by default.
+
+    Returns:
+        tuple: (entries, tokens) with the picked entries, most relevant first, and
+        the number of tokens of their contents.
+    """
+    token_budget = token_budget if token_budget is not None else int(os.getenv("CONTEXT_TOKEN_BUDGET", "1500"))
+    min_score = min_score if min_score is not None else float(os.getenv("CONTEXT_MIN_SCORE", "0.25"))
+    mmr_lambda = float(os.getenv("CONTEXT_MMR_LAMBDA", "0.7"))
+    duplicate_similarity = float(os.getenv("CONTEXT_DUPLICATE_SIMILARITY", "0.92"))
+
+    query = np.asarray(query_embedding, dtype='float32')
+    candidates, vectors, relevance = [], [], []
+    for entry in entries:
+        blob = embeddings.get(entry["id"])
+        if blob is None:
+            continue
+        vector = np.frombuffer(blob, dtype='float32')
+        # OpenAI embeddings are unit length, so the dot product is the cosine similarity
+        score = float(vector @ query)
+        if score < min_score:
+            continue
+        candidates.append(entry)
+        vectors.append(vector)
+        relevance.append(score)
+    if not candidates:
+        return [], 0
+
+    vectors = np.stack(vectors)
+    similarity = vectors @ vectors.T
+    relevance = np.array(relevance)
+    remaining = list(range(len(candidates)))
+    picked, tokens = [], 0
+    while remaining and len(picked) < k:
+        if picked:
+            redundancy = similarity[np.ix_(remaining, picked)].max(axis=1)
+        else:
+            redundancy = np.zeros(len(remaining))
+        scores = mmr_lambda * relevance[remaining] - (1 - mmr_lambda) * redundancy
+        best = int(np.argmax(scores))
+        i = remaining.pop(best)
+        if redundancy[best] >= duplicate_similarity:
+            continue
+        entry_tokens = count_tokens(candidates[i]["content"])
+        if tokens + entry_tokens > token_budget:
+            continue
+        picked.append(i)
+        tokens += entry_tokens
+
+    picked.sort(key=lambda i: relevance[i], reverse=True)
+    return [candidates[i] for i in picked], tokens
+
+def pack_lexical_context(entries, k, token_budget=None):
+    """
+    Choose the memories to use as context for a prompt answered from the lexical index.
+
+    Without a prompt embedding there is nothing to compare entries with, so they
+    are kept in BM25 order while their contents fit in the token budget.
+
+    Args:
+        entries (list): Lexical search results with "id" and "content", best first.
+        k (int): The maximum number of entries to pick.
+        token_budget (int, optional): The maximum number of context tokens,
+            CONTEXT_TOKEN_BUDGET by default.
+
+    Returns:
+        tuple: (entries, tokens) with the picked entries, best first, and the
+        number of tokens of their contents.
+    """
+    token_budget = token_budget if token_budget is not None else int(os.getenv("CONTEXT_TOKEN_BUDGET", "1500"))
+    picked, tokens = [], 0
+    for entry in entries:
+        if len(picked) == k:
+            break
+        entry_tokens = count_tokens(entry["content"])
+        if tokens + entry_tokens > token_budget:
+            continue
+        picked.append(entry)
+        tokens += entry_tokens
+    return picked, tokens
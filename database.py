@@ -1,95 +1,766 @@
+import os
+import re
+import heapq
 import sqlite3
+import logging
+import weakref
+import threading
+from collections import Counter, OrderedDict
+
+# Connections held by the calling thread, keyed by database path, see get_connection
+_local = threading.local()
+# Idle connections shared by all threads, as (db_path, connection), oldest first
+_pool = []
+_pool_lock = threading.Lock()
+# Databases whose connections in this process refuse writes, see open_read_only
+_read_only = set()
+# In-memory keyword vocabulary per database path, counting the memories using each
+# keyword, least recently used first, see _load_vocabulary and sync_vocabulary
+_vocabularies = OrderedDict()
+_vocabulary_lock = threading.Lock()
+
+
+def get_connection(db_path="memories.db"):
+    """
+    Return the calling thread's connection to a database.
+
+    A thread takes a connection from a pool shared by all threads on first use and
+    holds it until the thread ends, when it goes back to the pool. Flask serves every
+    request on a new thread, so requests reuse open connections, their pragma setup
+    and SQLite's per-connection statement cache instead of connecting again.
+    SQLITE_MMAP_SIZE and SQLITE_CACHE_SIZE_KB tune the memory-mapped I/O window and
+    the page cache. A thread holds at most SQLITE_MAX_CONNECTIONS connections
+    (default 64), handing the least recently used back, and the pool keeps at most
+    SQLITE_POOL_SIZE idle connections (default 64) across all databases, closing the
+    oldest, so serving many tenant databases does not exhaust file descriptors.
+
+    Args:
+        db_path (str): The path to the SQLite database file.
+
+    Returns:
+        sqlite3.Connection: The connection.
+    """
+    connections = getattr(_local, 'connections', None)
+    if connections is None:
+        connections = _local.connections = OrderedDict()
+        # Only this thread's local storage refers to the marker, which is dropped when
+        # the thread ends and hands the thread's connections back to the pool
+        _local.marker = threading.Event()
+        weakref.finalize(_local.marker, _release_connections, connections).atexit = False
+    conn = connections.get(db_path)
+    if conn is not None:
+        connections.move_to_end(db_path)
+        return conn
+    while len(connections) >= int(os.getenv('SQLITE_MAX_CONNECTIONS', '64')):
+        _return_connection(*connections.popitem(last=False))
+    with _pool_lock:
+        # Take the most recently returned connection, its pages are the likeliest to be cached
+        for i in range(len(_pool) - 1, -1, -1):
+            if _pool[i][0] == db_path:
+                conn = _pool.pop(i)[1]
+                break
+    if conn is None:
+        conn = _connect(db_path)
+    connections[db_path] = conn
+    return conn
+
+def _connect(db_path):
+    # Pooled connections move between threads, but only one thread uses each at a time
+    conn = sqlite3.connect(db_path, timeout=30, cached_statements=256, check_same_thread=False)
+    # With WAL, NORMAL only syncs at checkpoints and stays safe against corruption
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute(f"PRAGMA mmap_size={int(os.getenv('SQLITE_MMAP_SIZE', str(256 * 2**20)))}")
+    conn.execute(f"PRAGMA cache_size=-{int(os.getenv('SQLITE_CACHE_SIZE_KB', '65536'))}")
+    conn.execute('PRAGMA temp_store=MEMORY')
+    if db_path in _read_only:
+        conn.execute('PRAGMA query_only=ON')
+    return conn
+
+def open_read_only(db_path="memories.db"):
+    """
+    Make this process's connections to a database refuse writes, for tools that
+    promise to leave it unchanged. Call it before the database is first used.
+    """
+    _read_only.add(db_path)
+
+def _return_connection(db_path, conn):
+    """
+    Put a connection back in the pool, closing the oldest idle one beyond SQLITE_POOL_SIZE.
+    """
+    if conn.in_transaction:
+        conn.rollback()
+    with _pool_lock:
+        _pool.append((db_path, conn))
+        closed = _pool[:max(0, len(_pool) - int(os.getenv('SQLITE_POOL_SIZE', '64')))]
+        del _pool[:len(closed)]
+    for _, idle in closed:
+        idle.close()
+
+def _release_connections(connections):
+    for db_path, conn in connections.items():
+        _return_connection(db_path, conn)
+    connections.clear()
+
+def close_connections():
+    """
+    Close the calling thread's database connections and the idle pooled ones.
+    """
+    connections = getattr(_local, 'connections', {})
+    for conn in connections.values():
+        conn.close()
+    connections.clear()
+    with _pool_lock:
+        idle = [conn for _, conn in _pool]
+        _pool.clear()
+    for conn in idle:
+        conn.close()
 
 def initialize_db(db_path="memories.db"):
     """
     Initialize the SQLite database and create the memories table if it doesn't exist.
+    Databases created before embeddings were persisted get the embedding column added.
     """
 
-    conn = sqlite3.connect(db_path)
+    conn = get_connection(db_path)
     cursor = conn.cursor()
+    # WAL lets readers proceed while a write is in progress, the mode persists in the file
+    cursor.execute('PRAGMA journal_mode=WAL')
     # Create table if it doesn't exist
     cursor.execute('''CREATE TABLE IF NOT EXISTS memories (
                         id INTEGER PRIMARY KEY AUTOINCREMENT,
                         title TEXT UNIQUE,
                         content TEXT,
                         keywords TEXT,
-                        faiss_index INTEGER
+                        faiss_index INTEGER,
+                        embedding BLOB
+                     )''')
+    # Migrate older databases that do not store embeddings yet
+    cursor.execute('PRAGMA table_info(memories)')
+    columns = [row[1] for row in cursor.fetchall()]
+    if 'embedding' not in columns:
+        cursor.execute('ALTER TABLE memories ADD COLUMN embedding BLOB')
+    # Vectors are keyed by the row id, keep the legacy faiss_index column in step
+    cursor.execute('UPDATE memories SET faiss_index = id WHERE faiss_index IS NOT id')
+    # Generation counters used to validate on-disk FAISS snapshots
+    cursor.execute('''CREATE TABLE IF NOT EXISTS metadata (
+                        key TEXT PRIMARY KEY,
+                        value INTEGER
+                     )''')
+    cursor.execute("INSERT OR IGNORE INTO metadata (key, value) VALUES ('generation', 0)")
+    cursor.execute("INSERT OR IGNORE INTO metadata (key, value) VALUES ('rewrite_generation', 0)")
+    cursor.execute("INSERT OR IGNORE INTO metadata (key, value) VALUES ('pruned_generation', 0)")
+    # Memories changed or deleted in each generation, so every process can update its
+    # FAISS index and graph in place, see get_changes_since
+    cursor.execute('''CREATE TABLE IF NOT EXISTS memory_changes (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        generation INTEGER,
+                        memory_id INTEGER
+                     )''')
+    # Normalized keywords, linked to memories through memory_keywords
+    cursor.execute('''CREATE TABLE IF NOT EXISTS keywords (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        name TEXT UNIQUE
+                     )''')
+    cursor.execute('''CREATE TABLE IF NOT EXISTS memory_keywords (
+                        memory_id INTEGER,
+                        keyword_id INTEGER,
+                        PRIMARY KEY (memory_id, keyword_id)
+                     )''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_memory_keywords_keyword ON memory_keywords (keyword_id)')
+    # Earlier contents of memories, kept when a near-duplicate replaces or joins them
+    cursor.execute('''CREATE TABLE IF NOT EXISTS memory_versions (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        memory_id INTEGER,
+                        title TEXT,
+                        content TEXT,
+                        keywords TEXT,
+                        embedding BLOB,
+                        archived_at INTEGER
+                     )''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_memory_versions_memory ON memory_versions (memory_id)')
+    # Migrate the comma-separated keywords column of older databases once
+    cursor.execute("SELECT value FROM metadata WHERE key = 'keywords_migrated'")
+    if cursor.fetchone() is None:
+        cursor.execute('SELECT id, keywords FROM memories')
+        for memory_id, keywords_str in cursor.fetchall():
+            _link_keywords(cursor, memory_id, (keywords_str or '').split(','))
+        cursor.execute("INSERT INTO metadata (key, value) VALUES ('keywords_migrated', 1)")
+    # Full-text index over title, content and keywords, kept in sync by triggers
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'memories_fts'")
+    fts_exists = cursor.fetchone() is not None
+    cursor.execute('''CREATE VIRTUAL TABLE IF NOT EXISTS memories_fts USING fts5(
+                        title, content, keywords, content='memories', content_rowid='id'
                      )''')
+    cursor.execute('''CREATE TRIGGER IF NOT EXISTS memories_fts_insert AFTER INSERT ON memories BEGIN
+                        INSERT INTO memories_fts (rowid, title, content, keywords)
+                        VALUES (new.id, new.title, new.content, new.keywords);
+                      END''')
+    cursor.execute('''CREATE TRIGGER IF NOT EXISTS memories_fts_delete AFTER DELETE ON memories BEGIN
+                        INSERT INTO memories_fts (memories_fts, rowid, title, content, keywords)
+                        VALUES ('delete', old.id, old.title, old.content, old.keywords);
+                      END''')
+    cursor.execute('''CREATE TRIGGER IF NOT EXISTS memories_fts_update AFTER UPDATE OF title, content, keywords ON memories BEGIN
+                        INSERT INTO memories_fts (memories_fts, rowid, title, content, keywords)
+                        VALUES ('delete', old.id, old.title, old.content, old.keywords);
+                        INSERT INTO memories_fts (rowid, title, content, keywords)
+                        VALUES (new.id, new.title, new.content, new.keywords);
+                      END''')
+    if not fts_exists:
+        # Index the memories stored before the full-text index existed
+        cursor.execute("INSERT INTO memories_fts (memories_fts) VALUES ('rebuild')")
     conn.commit()
-    conn.close()   
 
-def add_to_db(title, content, keywords, faiss_index, db_path="memories.db"):
+def add_to_db(title, content, keywords, db_path="memories.db", embedding=None):
     """
     Add a new memory to the database.
+
+    Args:
+        embedding (bytes, optional): The raw float32 bytes of the content embedding.
+
+    Returns:
+        int: The id of the new memory, which is also its FAISS id, or None if the insert failed.
     """
+    return add_many_to_db([(title, content, keywords, embedding)], db_path)[0]
 
-    conn = sqlite3.connect(db_path)
+def add_many_to_db(entries, db_path="memories.db"):
+    """
+    Add several memories to the database in a single transaction.
+    A failing row, such as a duplicate title, is skipped without affecting the others.
+
+    Args:
+        entries (list): Tuples of (title, content, keywords, embedding bytes or None).
+        db_path (str): The path to the SQLite database file.
+
+    Returns:
+        list: The id of each new memory, or None for rows that could not be inserted.
+    """
+
+    conn = get_connection(db_path)
+    cursor = conn.cursor()
+    memory_ids = []
+    with conn:
+        # Without an open transaction each savepoint would commit its row on release
+        cursor.execute('BEGIN')
+        for title, content, keywords, embedding in entries:
+            cursor.execute('SAVEPOINT add_memory')
+            try:
+                cursor.execute('''INSERT INTO memories (title, content, keywords, embedding)
+                                  VALUES (?, ?, ?, ?)''', (title, content, ','.join(keywords), embedding))
+                memory_id = cursor.lastrowid
+                cursor.execute('UPDATE memories SET faiss_index = id WHERE id = ?', (memory_id,))
+                _link_keywords(cursor, memory_id, keywords)
+                cursor.execute('RELEASE add_memory')
+                memory_ids.append(memory_id)
+                logging.debug(f"Added to database: {title}")
+            except Exception as e:
+                cursor.execute('ROLLBACK TO add_memory')
+                cursor.execute('RELEASE add_memory')
+                memory_ids.append(None)
+                logging.warning(f"Error inserting into database: {e}")
+        if any(memory_id is not None for memory_id in memory_ids):
+            _bump_generation(cursor)
+    return memory_ids
+
+def get_memory(memory_id, db_path="memories.db"):
+    """
+    Retrieve a memory by its id.
+
+    Returns:
+        tuple: (title, content, keywords), or None if the memory does not exist.
+    """
+    conn = get_connection(db_path)
+    cursor = conn.cursor()
+    cursor.execute('SELECT title, content, keywords FROM memories WHERE id = ?', (memory_id,))
+    result = cursor.fetchone()
+    return result
+
+def update_in_db(memory_id, title, content, keywords, db_path="memories.db", embedding=None, keep_version=False):
+    """
+    Replace the title, content and keywords of a memory.
+
+    Args:
+        embedding (bytes, optional): The new embedding, if the content changed.
+        keep_version (bool): Archive the current row in memory_versions first.
+
+    Returns:
+        bool: True if the memory was updated.
+    """
+    conn = get_connection(db_path)
     cursor = conn.cursor()
     try:
-        cursor.execute('''INSERT INTO memories (title, content, keywords, faiss_index)
-                          VALUES (?, ?, ?, ?)''', (title, content, ','.join(keywords), faiss_index))
-        conn.commit()
-        print(f"Added to database: {title}")
+        with conn:
+            if keep_version:
+                _archive_version(cursor, memory_id, memory_id)
+            cursor.execute('''UPDATE memories SET title = ?, content = ?, keywords = ?
+                              WHERE id = ?''', (title, content, ','.join(keywords), memory_id))
+            updated = cursor.rowcount > 0
+            if updated:
+                _unlink_keywords(cursor, memory_id)
+                _link_keywords(cursor, memory_id, keywords)
+            if updated and embedding is not None:
+                cursor.execute('UPDATE memories SET embedding = ? WHERE id = ?', (embedding, memory_id))
+            if updated:
+                _bump_generation(cursor, [memory_id])
+        _reset_vocabulary(db_path)
+        return updated
     except Exception as e:
-        print(f"Error inserting into database: {e}")
-    finally:
-        conn.close()
+        logging.warning(f"Error updating database: {e}")
+        return False
+
+def delete_from_db(memory_id, db_path="memories.db", version_of=None):
+    """
+    Delete a memory from the database.
+
+    Args:
+        version_of (int, optional): Archive the row as a version of this memory first.
+
+    Returns:
+        bool: True if the memory existed and was deleted.
+    """
+    conn = get_connection(db_path)
+    cursor = conn.cursor()
+    with conn:
+        if version_of is not None:
+            _archive_version(cursor, version_of, memory_id)
+        cursor.execute('DELETE FROM memories WHERE id = ?', (memory_id,))
+        deleted = cursor.rowcount > 0
+        if deleted:
+            _unlink_keywords(cursor, memory_id)
+            _bump_generation(cursor, [memory_id])
+    _reset_vocabulary(db_path)
+    return deleted
+
+def _archive_version(cursor, memory_id, source_id):
+    """
+    Copy the row of source_id into memory_versions as a version of memory_id,
+    inside the caller's transaction.
+    """
+    cursor.execute('''INSERT INTO memory_versions (memory_id, title, content, keywords, embedding, archived_at)
+                      SELECT ?, title, content, keywords, embedding, CAST(strftime('%s', 'now') AS INTEGER)
+                      FROM memories WHERE id = ?''', (memory_id, source_id))
+
+def _normalize_keywords(keywords):
+    """
+    Lowercase and strip keywords, dropping empty ones and duplicates while keeping order.
+    """
+    normalized = []
+    for keyword in keywords:
+        keyword = keyword.strip().lower()
+        if keyword and keyword not in normalized:
+            normalized.append(keyword)
+    return normalized
+
+def _link_keywords(cursor, memory_id, keywords):
+    """
+    Link a memory to its keywords inside the caller's transaction, creating new keywords.
+
+    Returns:
+        list: The normalized keywords.
+    """
+    keywords = _normalize_keywords(keywords)
+    for keyword in keywords:
+        cursor.execute('INSERT OR IGNORE INTO keywords (name) VALUES (?)', (keyword,))
+        cursor.execute('''INSERT OR IGNORE INTO memory_keywords (memory_id, keyword_id)
+                          SELECT ?, id FROM keywords WHERE name = ?''', (memory_id, keyword))
+    return keywords
+
+def _unlink_keywords(cursor, memory_id):
+    """
+    Remove a memory's keyword links and any keywords no other memory uses.
+    """
+    cursor.execute('SELECT keyword_id FROM memory_keywords WHERE memory_id = ?', (memory_id,))
+    keyword_ids = [row[0] for row in cursor.fetchall()]
+    cursor.execute('DELETE FROM memory_keywords WHERE memory_id = ?', (memory_id,))
+    for keyword_id in keyword_ids:
+        cursor.execute('''DELETE FROM keywords WHERE id = ?
+                          AND NOT EXISTS (SELECT 1 FROM memory_keywords WHERE keyword_id = ?)''', (keyword_id, keyword_id))
+
+
+def get_entries_by_ids(memory_ids, db_path="memories.db"):
+    """
+    Retrieve several memories by id in a single query.
+
+    Args:
+        memory_ids (list): The ids of the memories, as returned by a FAISS search.
+        db_path (str): The path to the SQLite database file.
+
+    Returns:
+        dict: A mapping of id to (title, content, keywords) for the memories that exist.
+    """
+    if not memory_ids:
+        return {}
+    conn = get_connection(db_path)
+    cursor = conn.cursor()
+    placeholders = ','.join('?' * len(memory_ids))
+    # id is the INTEGER PRIMARY KEY, so this is a rowid lookup per hit
+    cursor.execute(f'SELECT id, title, content, keywords FROM memories WHERE id IN ({placeholders})',
+                   [int(memory_id) for memory_id in memory_ids])
+    rows = cursor.fetchall()
+    return {row[0]: row[1:] for row in rows}
+
+def get_embeddings_by_ids(memory_ids, db_path="memories.db"):
+    """
+    Retrieve the stored embeddings of several memories in a single query.
+
+    Args:
+        memory_ids (list): The ids of the memories.
+        db_path (str): The path to the SQLite database file.
+
+    Returns:
+        dict: A mapping of id to embedding BLOB for the memories that have one.
+    """
+    if not memory_ids:
+        return {}
+    conn = get_connection(db_path)
+    cursor = conn.cursor()
+    placeholders = ','.join('?' * len(memory_ids))
+    cursor.execute(f'SELECT id, embedding FROM memories WHERE id IN ({placeholders}) AND embedding IS NOT NULL',
+                   [int(memory_id) for memory_id in memory_ids])
+    return dict(cursor.fetchall())
+
+def lexical_search(query_text, k=5, db_path="memories.db"):
+    """
+    Search memories with the FTS5 index, ranked by BM25.
 
+    Every word of the query is matched as a separate term, any of them may match.
+    Title and keyword matches weigh more than content matches.
 
-def get_entry_by_faiss_index(faiss_index, db_path="memories.db"):
+    Args:
+        query_text (str): The text to search for.
+        k (int): The maximum number of memories to return.
+        db_path (str): The path to the SQLite database file.
+
+    Returns:
+        list: Tuples of (id, title, content, keywords, bm25), best match first.
+        Lower BM25 values are better matches.
     """
-    Retrieve a memory from the database by its FAISS index.
+    terms = re.findall(r'\w+', query_text.lower())
+    if not terms:
+        return []
+    # Quote every term so FTS5 operators in the query are taken literally
+    match = ' OR '.join(f'"{term}"' for term in dict.fromkeys(terms))
+    cursor = get_connection(db_path).cursor()
+    cursor.execute('''SELECT m.id, m.title, m.content, m.keywords, bm25(memories_fts, 5.0, 1.0, 3.0) AS rank
+                      FROM memories_fts JOIN memories m ON m.id = memories_fts.rowid
+                      WHERE memories_fts MATCH ? ORDER BY rank LIMIT ?''', (match, k))
+    return cursor.fetchall()
+
+def has_title(title, db_path="memories.db"):
     """
-        # Embed the content
-    content_embedding = get_embedding(content)  # Use OpenAI embedding API
-    content_embedding_np = np.array([content_embedding]).astype('float32')  # Convert to NumPy array
+    Check whether a memory has exactly this title, ignoring case.
+
+    The title column of the FTS5 index narrows the memories down to those whose title
+    contains the words as a phrase, so this does not scan the memories table.
 
-    # Add embedding to Faiss
-    faiss_index_position = index.ntotal  # The next index position in Faiss
-    index.add(content_embedding_np)
+    Args:
+        title (str): The lowercase title to look for.
+        db_path (str): The path to the SQLite database file.
 
-    # Store in SQLite
-    add_to_db(title, content, keywords, faiss_index_position, db_path)
+    Returns:
+        bool: True if a memory has the title.
+    """
+    terms = re.findall(r'\w+', title)
+    if not terms:
+        return False
+    cursor = get_connection(db_path).cursor()
+    cursor.execute('''SELECT 1 FROM memories_fts JOIN memories m ON m.id = memories_fts.rowid
+                      WHERE memories_fts MATCH ? AND lower(m.title) = ? LIMIT 1''',
+                   (f'title : "{" ".join(terms)}"', title))
+    return cursor.fetchone() is not None
 
-def get_graph_info(db_path="memories.db"):
+def get_graph_info(db_path="memories.db", after_id=0):
     """
     Retrieve all notes and their associated keywords from the database.
 
     Args:
         db_path (str): The path to the SQLite database file.
+        after_id (int): Only return memories with an id greater than this.
 
     Returns:
-        list: A list of tuples containing titles and keywords.
+        list: A list of tuples (id, title, list of keywords), ordered by id.
     """
-    conn = sqlite3.connect(db_path)
+    conn = get_connection(db_path)
     cursor = conn.cursor()
-    cursor.execute('SELECT title, keywords FROM memories')
+    cursor.execute('''SELECT m.id, m.title, k.name FROM memories m
+                      LEFT JOIN memory_keywords mk ON mk.memory_id = m.id
+                      LEFT JOIN keywords k ON k.id = mk.keyword_id
+                      WHERE m.id > ?
+                      ORDER BY m.id''', (after_id,))
+    notes = {}
+    for memory_id, title, keyword in cursor.fetchall():
+        note = notes.setdefault(memory_id, (memory_id, title, []))
+        if keyword is not None:
+            note[2].append(keyword)
+    return list(notes.values())
+
+def has_keyword(keyword, db_path="memories.db"):
+    """
+    Check whether a keyword is in the in-memory vocabulary, without querying the database.
+    """
+    with _vocabulary_lock:
+        return keyword in _load_vocabulary(db_path)["counts"]
+
+def get_top_keywords(limit, db_path="memories.db"):
+    """
+    Retrieve the keywords used by the most memories, from the in-memory vocabulary.
+
+    Args:
+        limit (int): The maximum number of keywords to return.
+        db_path (str): The path to the SQLite database file.
+
+    Returns:
+        list: Tuples of (keyword, memory count), most used first.
+    """
+    with _vocabulary_lock:
+        vocabulary = _load_vocabulary(db_path)["counts"]
+        return heapq.nlargest(limit, vocabulary.items(), key=lambda item: item[1])
+
+def get_keywords_for_memories(memory_ids, db_path="memories.db"):
+    """
+    Retrieve the keywords of several memories in a single query.
+
+    Returns:
+        dict: A mapping of memory id to its list of keywords.
+    """
+    if not memory_ids:
+        return {}
+    cursor = get_connection(db_path).cursor()
+    placeholders = ','.join('?' * len(memory_ids))
+    cursor.execute(f'''SELECT mk.memory_id, k.name FROM memory_keywords mk
+                       JOIN keywords k ON k.id = mk.keyword_id
+                       WHERE mk.memory_id IN ({placeholders})''', [int(memory_id) for memory_id in memory_ids])
+    keywords = {}
+    for memory_id, name in cursor.fetchall():
+        keywords.setdefault(memory_id, []).append(name)
+    return keywords
+
+def _load_vocabulary(db_path):
+    """
+    Return the vocabulary of a database, loading it on first use. Callers hold _vocabulary_lock.
+    At most MAX_LOADED_STORES vocabularies are kept, like FAISS indexes.
+
+    Returns:
+        dict: The keyword counts, and the generation and last memory id they cover.
+    """
+    vocabulary = _vocabularies.get(db_path)
+    if vocabulary is None:
+        # Read the generation before the rows, so writes racing with this are picked up by sync_vocabulary
+        generation, _ = get_index_generation(db_path)
+        cursor = get_connection(db_path).cursor()
+        cursor.execute('SELECT COALESCE(MAX(id), 0) FROM memories')
+        last_id = cursor.fetchone()[0]
+        cursor.execute('''SELECT k.name, COUNT(mk.memory_id) FROM keywords k
+                          LEFT JOIN memory_keywords mk ON mk.keyword_id = k.id AND mk.memory_id <= ?
+                          GROUP BY k.id''', (last_id,))
+        vocabulary = _vocabularies[db_path] = {
+            "counts": Counter(dict(cursor.fetchall())), "generation": generation, "last_id": last_id
+        }
+    _vocabularies.move_to_end(db_path)
+    while len(_vocabularies) > int(os.getenv('MAX_LOADED_STORES', '64')):
+        _vocabularies.popitem(last=False)
+    return vocabulary
+
+def sync_vocabulary(generation, rewrite_generation, db_path="memories.db"):
+    """
+    Bring a loaded vocabulary up to date with the database, whichever process wrote to it.
+
+    The keywords of memories added since the vocabulary's generation are counted in.
+    Memories changed or deleted since, as logged in memory_changes, may have dropped
+    keywords, so the vocabulary is then reloaded on next use instead.
+
+    Args:
+        generation (int): The database's generation, see get_index_generation.
+        rewrite_generation (int): The database's rewrite generation.
+        db_path (str): The path to the SQLite database file.
+    """
+    with _vocabulary_lock:
+        vocabulary = _vocabularies.get(db_path)
+        if vocabulary is None or vocabulary["generation"] >= generation:
+            return
+        if rewrite_generation > vocabulary["generation"] and get_changes_since(vocabulary["generation"], db_path) != []:
+            _vocabularies.pop(db_path)
+            return
+        cursor = get_connection(db_path).cursor()
+        cursor.execute('''SELECT mk.memory_id, k.name FROM memory_keywords mk
+                          JOIN keywords k ON k.id = mk.keyword_id
+                          WHERE mk.memory_id > ?''', (vocabulary["last_id"],))
+        rows = cursor.fetchall()
+        vocabulary["counts"].update(name for _, name in rows)
+        vocabulary["last_id"] = max([vocabulary["last_id"]] + [memory_id for memory_id, _ in rows])
+        vocabulary["generation"] = generation
+
+def _reset_vocabulary(db_path):
+    """
+    Drop a loaded vocabulary after keywords were removed, it is reloaded on next use.
+    """
+    with _vocabulary_lock:
+        _vocabularies.pop(db_path, None)
+
+def release_vocabulary(db_path="memories.db"):
+    """
+    Drop the loaded vocabulary of a database to free memory, it is reloaded on next use.
+    """
+    _reset_vocabulary(db_path)
+
+def get_all_embeddings(db_path="memories.db", after_id=0):
+    """
+    Retrieve all stored embeddings in a single read, ordered by id.
+
+    Args:
+        db_path (str): The path to the SQLite database file.
+        after_id (int): Only return memories with an id greater than this.
+
+    Returns:
+        list: A list of tuples (id, embedding bytes).
+    """
+    conn = get_connection(db_path)
+    cursor = conn.cursor()
+    cursor.execute('''SELECT id, embedding FROM memories WHERE embedding IS NOT NULL AND id > ?
+                      ORDER BY id''', (after_id,))
     rows = cursor.fetchall()
-    conn.close()
-    return rows  # This will be a list of tuples (title, keywords)
+    return rows
 
-def get_all_keywords(db_path="memories.db"):
+def iter_memories(db_path="memories.db", batch_size=1000):
     """
-    Retrieve all unique keywords stored in the database.
+    Iterate over all memories in id order, reading batch_size rows at a time.
 
     Args:
         db_path (str): The path to the SQLite database file.
+        batch_size (int): The number of rows read per query.
+
+    Yields:
+        tuple: (id, title, content, embedding bytes or None)
+    """
+    cursor = get_connection(db_path).cursor()
+    last_id = 0
+    while True:
+        cursor.execute('''SELECT id, title, content, embedding FROM memories
+                          WHERE id > ? ORDER BY id LIMIT ?''', (last_id, batch_size))
+        rows = cursor.fetchall()
+        if not rows:
+            return
+        yield from rows
+        last_id = rows[-1][0]
+
+def get_memories_without_embedding(db_path="memories.db", dimension=None):
+    """
+    Retrieve the memories that have no stored embedding yet.
+
+    Args:
+        db_path (str): The path to the SQLite database file.
+        dimension (int, optional): Also retrieve memories whose stored float32
+            embedding has a different dimension.
 
     Returns:
-        set: A set of all unique keywords.
+        list: A list of tuples (id, content).
     """
-    conn = sqlite3.connect(db_path)
+    conn = get_connection(db_path)
     cursor = conn.cursor()
-    cursor.execute('SELECT keywords FROM memories')
+    if dimension is None:
+        cursor.execute('SELECT id, content FROM memories WHERE embedding IS NULL ORDER BY id')
+    else:
+        cursor.execute('SELECT id, content FROM memories WHERE embedding IS NULL OR length(embedding) != ? ORDER BY id',
+                       (dimension * 4,))
     rows = cursor.fetchall()
-    conn.close()
-
-    keywords_set = set()
-    for row in rows:
-        keywords_str = row[0]
-        if keywords_str:
-            # Split the comma-separated string into a list of keywords
-            keywords = [keyword.strip() for keyword in keywords_str.split(',')]
-            # Add the keywords to the set
-            keywords_set.update(keywords)
-    return keywords_set
\ No newline at end of file
+    return rows
+
+def set_embeddings(embeddings, db_path="memories.db"):
+    """
+    Store the embeddings of existing memories in a single transaction.
+
+    Args:
+        embeddings (list): (memory_id, embedding) pairs, each embedding being the raw
+            float32 bytes of the content embedding.
+        db_path (str): The path to the SQLite database file.
+    """
+    if not embeddings:
+        return
+    conn = get_connection(db_path)
+    cursor = conn.cursor()
+    with conn:
+        cursor.executemany('UPDATE memories SET embedding = ? WHERE id = ?',
+                           [(embedding, memory_id) for memory_id, embedding in embeddings])
+        _bump_generation(cursor, [memory_id for memory_id, _ in embeddings])
+
+def count_embeddings(db_path="memories.db"):
+    """
+    Count the memories that have a stored embedding.
+
+    Args:
+        db_path (str): The path to the SQLite database file.
+
+    Returns:
+        int: The number of stored embeddings.
+    """
+    conn = get_connection(db_path)
+    cursor = conn.cursor()
+    cursor.execute('SELECT COUNT(*) FROM memories WHERE embedding IS NOT NULL')
+    count = cursor.fetchone()[0]
+    return count
+
+def get_index_generation(db_path="memories.db"):
+    """
+    Retrieve the generation counters of the stored embeddings.
+
+    The generation grows on every write. The rewrite generation records the last
+    write that changed or removed an existing memory, after which appending newer
+    rows to an older index is no longer enough to bring it up to date.
+
+    Args:
+        db_path (str): The path to the SQLite database file.
+
+    Returns:
+        tuple: (generation, rewrite_generation)
+    """
+    conn = get_connection(db_path)
+    cursor = conn.cursor()
+    cursor.execute("SELECT key, value FROM metadata WHERE key IN ('generation', 'rewrite_generation')")
+    values = dict(cursor.fetchall())
+    return values.get('generation', 0), values.get('rewrite_generation', 0)
+
+def get_changes_since(generation, db_path="memories.db"):
+    """
+    Retrieve the memories changed or deleted after a generation.
+
+    Only the last MEMORY_CHANGES_KEPT changes are kept (default 10000).
+
+    Args:
+        generation (int): The generation the caller is up to date with.
+        db_path (str): The path to the SQLite database file.
+
+    Returns:
+        list: The ids of the changed memories, or None if some of the changes were
+        already pruned and the caller has to rebuild from scratch.
+    """
+    cursor = get_connection(db_path).cursor()
+    cursor.execute("SELECT value FROM metadata WHERE key = 'pruned_generation'")
+    row = cursor.fetchone()
+    if row is not None and row[0] > generation:
+        return None
+    cursor.execute('SELECT DISTINCT memory_id FROM memory_changes WHERE generation > ?', (generation,))
+    return [row[0] for row in cursor.fetchall()]
+
+def _bump_generation(cursor, changed_ids=None):
+    """
+    Increment the generation counter inside the caller's transaction.
+
+    Args:
+        cursor (sqlite3.Cursor): A cursor in the caller's transaction.
+        changed_ids (list, optional): Existing memories that were changed or deleted,
+            which also advances the rewrite generation and is logged in memory_changes.
+    """
+    cursor.execute("UPDATE metadata SET value = value + 1 WHERE key = 'generation'")
+    if not changed_ids:
+        return
+    cursor.execute('''UPDATE metadata SET value = (SELECT value FROM metadata WHERE key = 'generation')
+                      WHERE key = 'rewrite_generation' ''')
+    cursor.executemany('''INSERT INTO memory_changes (generation, memory_id)
+                          SELECT value, ? FROM metadata WHERE key = 'generation' ''',
+                       [(int(memory_id),) for memory_id in changed_ids])
+    # Forget the oldest changes, remembering up to which generation they are gone
+    cursor.execute('SELECT max(id) FROM memory_changes')
+    cutoff = cursor.fetchone()[0] - int(os.getenv('MEMORY_CHANGES_KEPT', '10000'))
+    if cutoff > 0:
+        cursor.execute('''UPDATE metadata SET value = max(value, (SELECT coalesce(max(generation), 0)
+                          FROM memory_changes WHERE id <= ?)) WHERE key = 'pruned_generation' ''', (cutoff,))
+        cursor.execute('DELETE FROM memory_changes WHERE id <= ?', (cutoff,))
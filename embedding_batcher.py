@@ -0,0 +1,74 @@
+import os
+import time
+import queue
+import logging
+import threading
+from concurrent.futures import Future
+
+# Pending (text, model, future) requests waiting for the batcher thread
+_requests = queue.Queue()
+_thread = None
+_embed_batch = None
+
+
+def start_batcher(embed_batch):
+    """
+    Start the background thread that merges concurrent embedding requests.
+
+    Requests arriving within EMBEDDING_BATCH_WINDOW_MS of the first one in a batch,
+    up to EMBEDDING_BATCH_MAX_ITEMS, are sent upstream in a single call.
+
+    Args:
+        embed_batch (callable): Called as embed_batch(texts, model) and returning one
+            embedding per text.
+    """
+    global _thread, _embed_batch
+    if _thread is not None:
+        return
+    _embed_batch = embed_batch
+    _thread = threading.Thread(target=_run, name="embedding-batcher", daemon=True)
+    _thread.start()
+
+def batcher_running():
+    return _thread is not None
+
+def submit(text, model):
+    """
+    Queue a text for embedding.
+
+    Returns:
+        Future: Resolves to the embedding, or to the exception raised upstream.
+    """
+    future = Future()
+    _requests.put((text, model, future))
+    return future
+
+def _run():
+    window = float(os.getenv("EMBEDDING_BATCH_WINDOW_MS", "5")) / 1000
+    max_items = int(os.getenv("EMBEDDING_BATCH_MAX_ITEMS", "256"))
+    while True:
+        batch = [_requests.get()]
+        deadline = time.monotonic() + window
+        while len(batch) < max_items:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(_requests.get(timeout=remaining))
+            except queue.Empty:
+                break
+
+        # One upstream call per model
+        by_model = {}
+        for text, model, future in batch:
+            by_model.setdefault(model, []).append((text, future))
+        for model, items in by_model.items():
+            try:
+                embeddings = _embed_batch([text for text, _ in items], model)
+            except Exception as e:
+                logging.error(f"Batched embedding request failed: {e}")
+                for _, future in items:
+                    future.set_exception(e)
+                continue
+            for (_, future), embedding in zip(items, embeddings):
+                future.set_result(embedding)
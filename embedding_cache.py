@@ -0,0 +1,115 @@
+import os
+import hashlib
+import threading
+from array import array
+from collections import OrderedDict
+
+from database import get_connection
+
+# In-process LRU tier, keyed by (model, sha256 of the text)
+_memory_cache = OrderedDict()
+_lock = threading.Lock()
+# Hit and miss counters, see get_cache_stats
+_stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0}
+
+
+def _cache_key(text, model):
+    return model, hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def _disk_path():
+    """
+    Return the path of the persistent cache database, or None if the disk tier is disabled.
+    """
+    return os.getenv("EMBEDDING_CACHE_DB") or None
+
+def initialize_embedding_cache():
+    """
+    Create the persistent cache table if EMBEDDING_CACHE_DB is set.
+    """
+    db_path = _disk_path()
+    if db_path is None:
+        return
+    conn = get_connection(db_path)
+    conn.execute('''CREATE TABLE IF NOT EXISTS embedding_cache (
+                        model TEXT,
+                        text_hash TEXT,
+                        embedding BLOB,
+                        PRIMARY KEY (model, text_hash)
+                     )''')
+    conn.commit()
+
+def _remember(key, vector):
+    """
+    Put a vector in the LRU tier, evicting the least recently used entries.
+    """
+    with _lock:
+        _memory_cache[key] = vector
+        _memory_cache.move_to_end(key)
+        while len(_memory_cache) > int(os.getenv("EMBEDDING_CACHE_SIZE", "10000")):
+            _memory_cache.popitem(last=False)
+
+def get_cached_embedding(text, model):
+    """
+    Look up the embedding of a text, first in memory and then on disk.
+
+    Args:
+        text (str): The text that was embedded.
+        model (str): The embedding model.
+
+    Returns:
+        list: The embedding, or None on a miss.
+    """
+    key = _cache_key(text, model)
+    with _lock:
+        vector = _memory_cache.get(key)
+        if vector is not None:
+            _memory_cache.move_to_end(key)
+            _stats["memory_hits"] += 1
+            return vector.tolist()
+
+    db_path = _disk_path()
+    if db_path is not None:
+        row = get_connection(db_path).execute(
+            'SELECT embedding FROM embedding_cache WHERE model = ? AND text_hash = ?', key
+        ).fetchone()
+        if row is not None:
+            vector = array('f')
+            vector.frombytes(row[0])
+            _remember(key, vector)
+            with _lock:
+                _stats["disk_hits"] += 1
+            return vector.tolist()
+
+    with _lock:
+        _stats["misses"] += 1
+    return None
+
+def cache_embedding(text, model, embedding):
+    """
+    Store the embedding of a text in both cache tiers.
+
+    Args:
+        text (str): The text that was embedded.
+        model (str): The embedding model.
+        embedding (list): The embedding vector.
+    """
+    key = _cache_key(text, model)
+    # Stored as float32, the precision FAISS uses anyway
+    vector = array('f', embedding)
+    _remember(key, vector)
+
+    db_path = _disk_path()
+    if db_path is not None:
+        conn = get_connection(db_path)
+        with conn:
+            conn.execute('INSERT OR REPLACE INTO embedding_cache (model, text_hash, embedding) VALUES (?, ?, ?)',
+                         key + (vector.tobytes(),))
+
+def get_cache_stats():
+    """
+    Return the cache hit and miss counters and the number of entries held in memory.
+    """
+    with _lock:
+        stats = dict(_stats)
+        stats["memory_entries"] = len(_memory_cache)
+    return stats
@@ -0,0 +1,254 @@
+import os
+import re
+import time
+import uuid
+import logging
+import threading
+from functools import lru_cache
+from collections import deque, OrderedDict
+
+from database import get_graph_info, get_index_generation
+from metrics import span
+
+_non_word = re.compile(r'\W+')
+_leading_underscores = re.compile(r'^_+')
+_leading_digit = re.compile(r'^(\d)')
+
+# Cached graph per database path, least recently used first, see _build_graph.
+# At most MAX_LOADED_STORES graphs are kept, like FAISS indexes
+_graphs = OrderedDict()
+# The last graph version handed out. Versions are unique across all graphs of the
+# process, so a graph rebuilt after it was dropped starts above any version clients
+# hold. They start at the startup time in milliseconds, above those of earlier processes
+_last_version = int(time.time() * 1000)
+_lock = threading.Lock()
+
+
+@lru_cache(maxsize=65536)
+def sanitize_id(s):
+    """
+    Sanitize a string to be used as an ID by:
+    - Converting to lowercase.
+    - Replacing non-alphanumeric characters with underscores.
+    - Removing leading digits.
+    - Ensuring the ID is not empty.
+    """
+    try:
+        s = s.lower().strip()
+        s = _non_word.sub('_', s)  # Replace non-word characters with '_'
+        s = _leading_underscores.sub('', s)   # Remove leading underscores
+        s = _leading_digit.sub(r'_\1', s)  # Prefix leading digits with '_'
+        if not s:
+            s = 'id_' + str(uuid.uuid4()).replace('-', '')  # Generate a random ID if empty
+        return s
+    except Exception as e:
+        logging.error(f"Error sanitizing ID for string '{s}': {e}", exc_info=True)
+        # Return a fallback ID
+        return 'id_' + str(uuid.uuid4()).replace('-', '')
+
+def _next_version():
+    """
+    Return a new graph version. Callers hold _lock.
+    """
+    global _last_version
+    _last_version += 1
+    return _last_version
+
+def _new_graph(version=0, generation=0):
+    return {
+        # Element id -> (element, version it was added in), in insertion order
+        "elements": {},
+        # Node id -> set of adjacent node ids
+        "adjacency": {},
+        # Note node ids in insertion order, for pagination
+        "notes": [],
+        "version": version,
+        # Deltas from versions before this one cannot be computed
+        "reset_version": version,
+        # The database generation the graph reflects and the highest memory id in it
+        "generation": generation,
+        "last_id": 0,
+        # Set to rebuild the graph on its next read, see invalidate_graph
+        "stale": False,
+    }
+
+def _add_note(graph, title, keywords):
+    """
+    Add a note, its keywords and the edges between them to a graph at its current version.
+    """
+    version = graph["version"]
+    elements = graph["elements"]
+    adjacency = graph["adjacency"]
+
+    # Ensure title is not empty
+    note_label = title.strip() if title and title.strip() else 'untitled'
+    note_id = f"note_{sanitize_id(note_label)}"
+    if note_id not in elements:
+        elements[note_id] = ({'data': {'id': note_id, 'label': note_label, 'type': 'note'}}, version)
+        adjacency[note_id] = set()
+        graph["notes"].append(note_id)
+
+    for keyword in keywords:
+        keyword_normalized = keyword.strip().lower()
+        if not keyword_normalized:
+            continue
+        keyword_id = f"keyword_{sanitize_id(keyword_normalized)}"
+        if keyword_id not in elements:
+            elements[keyword_id] = (
+                {'data': {'id': keyword_id, 'label': keyword_normalized.title(), 'type': 'keyword'}},
+                version
+            )
+            adjacency[keyword_id] = set()
+
+        edge_id = f"edge_{note_id}_{keyword_id}"
+        if edge_id not in elements:
+            elements[edge_id] = ({'data': {'id': edge_id, 'source': note_id, 'target': keyword_id}}, version)
+            adjacency[note_id].add(keyword_id)
+            adjacency[keyword_id].add(note_id)
+
+def _build_graph(db_path, generation=0):
+    """
+    Build the graph of a database from a full scan, done once per process or after
+    memories were changed or removed. Callers hold _lock.
+    """
+    with span("graph_build"):
+        rows = get_graph_info(db_path)
+        # A rebuilt graph starts a new history, all of it counts as one version
+        graph = _new_graph(_next_version(), generation)
+        for memory_id, title, keywords in rows:
+            _add_note(graph, title, keywords)
+            graph["last_id"] = memory_id
+    logging.info(f"Built graph with {len(graph['elements'])} elements from {len(rows)} notes")
+    return graph
+
+def _get_graph(db_path):
+    """
+    Return the cached graph of a database, building it on first use. Callers hold _lock.
+
+    The graph follows the database generation, so memories written by any process
+    show up: newly added memories are appended as one new version, and changed or
+    removed memories rebuild the graph.
+    """
+    graph = _graphs.get(db_path)
+    # Read the generation before the rows, so writes racing with this are picked up next time
+    generation, rewrite_generation = get_index_generation(db_path)
+    if graph is None or graph["stale"] or rewrite_generation > graph["generation"]:
+        graph = _graphs[db_path] = _build_graph(db_path, generation)
+    elif generation != graph["generation"]:
+        rows = get_graph_info(db_path, graph["last_id"])
+        if rows:
+            graph["version"] = _next_version()
+            for memory_id, title, keywords in rows:
+                _add_note(graph, title, keywords)
+                graph["last_id"] = memory_id
+        graph["generation"] = generation
+    _graphs.move_to_end(db_path)
+    while len(_graphs) > int(os.getenv('MAX_LOADED_STORES', '64')):
+        _graphs.popitem(last=False)
+    return graph
+
+def invalidate_graph(db_path="memories.db"):
+    """
+    Mark the cached graph for a rebuild on its next read.
+    Clients asking for a delta across the rebuild receive the whole graph.
+    """
+    with _lock:
+        graph = _graphs.get(db_path)
+        if graph is not None:
+            graph["stale"] = True
+
+def release_graph(db_path="memories.db"):
+    """
+    Drop the cached graph of a database to free memory. It is rebuilt at a newer
+    version, so clients asking for a delta after that receive the whole graph.
+    """
+    with _lock:
+        _graphs.pop(db_path, None)
+
+def get_graph_elements(db_path="memories.db"):
+    """
+    Return every node and edge of the graph.
+
+    Returns:
+        tuple: (version, list of elements)
+    """
+    with _lock:
+        graph = _get_graph(db_path)
+        return graph["version"], _nodes_first(element for element, _ in graph["elements"].values())
+
+def get_graph_delta(since, db_path="memories.db"):
+    """
+    Return the nodes and edges added after a version.
+
+    Returns:
+        tuple: (version, reset, list of elements). When reset is True the version is
+        too old to compute a delta from, or was not handed out by this process, and
+        the elements are the whole graph.
+    """
+    with _lock:
+        graph = _get_graph(db_path)
+        reset = since < graph["reset_version"] or since > graph["version"]
+        elements = [element for element, version in graph["elements"].values() if reset or version > since]
+        return graph["version"], reset, _nodes_first(elements)
+
+def get_graph_page(offset, limit, db_path="memories.db"):
+    """
+    Return a page of notes with their keywords and edges, in the order notes were added.
+
+    Returns:
+        tuple: (version, total number of notes, list of elements)
+    """
+    with _lock:
+        graph = _get_graph(db_path)
+        note_ids = graph["notes"][offset:offset + limit]
+        return graph["version"], len(graph["notes"]), _subgraph(graph, note_ids)
+
+def get_graph_neighbourhood(node_id, hops, db_path="memories.db"):
+    """
+    Return a node and everything within a number of hops of it.
+
+    Returns:
+        tuple: (version, list of elements), the list is empty if the node does not exist.
+    """
+    with _lock:
+        graph = _get_graph(db_path)
+        adjacency = graph["adjacency"]
+        if node_id not in adjacency:
+            return graph["version"], []
+        seen = {node_id}
+        queue = deque([(node_id, 0)])
+        while queue:
+            current, depth = queue.popleft()
+            if depth == hops:
+                continue
+            for neighbour in adjacency[current]:
+                if neighbour not in seen:
+                    seen.add(neighbour)
+                    queue.append((neighbour, depth + 1))
+        return graph["version"], _subgraph(graph, seen, expand=False)
+
+def _nodes_first(elements):
+    """
+    Order elements so every edge comes after the nodes it connects.
+    """
+    return sorted(elements, key=lambda element: 'source' in element['data'])
+
+def _subgraph(graph, node_ids, expand=True):
+    """
+    Collect the elements for a set of nodes. With expand, the neighbours of each node
+    are included too; edges are included when both of their ends are.
+    """
+    elements = graph["elements"]
+    adjacency = graph["adjacency"]
+    nodes = set(node_ids)
+    if expand:
+        for node_id in node_ids:
+            nodes.update(adjacency[node_id])
+    result = [elements[node_id][0] for node_id in nodes]
+    # Edges follow all the nodes
+    for node_id in nodes:
+        for neighbour in adjacency[node_id]:
+            # Edges always run from a note to a keyword
+            if neighbour in nodes and node_id.startswith('note_'):
+                result.append(elements[f"edge_{node_id}_{neighbour}"][0])
+    return result
@@ -0,0 +1,201 @@
+import os
+import json
+import time
+import logging
+import threading
+
+from database import get_connection
+
+# Set when a job is enqueued, so idle workers pick it up without waiting for the next poll
+_job_available = threading.Event()
+
+
+def initialize_job_queue(db_path="memories.db"):
+    """
+    Create the jobs table and requeue jobs whose lease expired, see _requeue_expired.
+    """
+    conn = get_connection(db_path)
+    with conn:
+        conn.execute('''CREATE TABLE IF NOT EXISTS jobs (
+                            id INTEGER PRIMARY KEY AUTOINCREMENT,
+                            kind TEXT,
+                            payload TEXT,
+                            status TEXT,
+                            attempts INTEGER DEFAULT 0,
+                            result TEXT,
+                            error TEXT,
+                            run_after REAL,
+                            created_at REAL,
+                            updated_at REAL
+                         )''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, kind, run_after)')
+        _requeue_expired(conn)
+        # Forget finished jobs after JOB_RETENTION_SECONDS
+        retention = float(os.getenv('JOB_RETENTION_SECONDS', '86400'))
+        conn.execute("DELETE FROM jobs WHERE status IN ('done', 'failed') AND updated_at < ?",
+                     (time.time() - retention,))
+
+def _requeue_expired(conn):
+    """
+    Send running jobs back to the queue once they were claimed more than
+    JOB_LEASE_SECONDS ago (default 600), as the worker holding them has likely stopped.
+    Jobs held by live workers, possibly in another process, are left alone.
+    """
+    lease = float(os.getenv('JOB_LEASE_SECONDS', '600'))
+    conn.execute("UPDATE jobs SET status = 'pending' WHERE status = 'running' AND updated_at < ?",
+                 (time.time() - lease,))
+
+def enqueue_job(kind, payload, db_path="memories.db"):
+    """
+    Add a job to the queue.
+
+    Args:
+        kind (str): The job kind, which selects the handler.
+        payload (dict): The JSON-serializable job arguments.
+        db_path (str): The path to the SQLite database file.
+
+    Returns:
+        int: The id of the job.
+    """
+    now = time.time()
+    conn = get_connection(db_path)
+    with conn:
+        cursor = conn.execute('''INSERT INTO jobs (kind, payload, status, run_after, created_at, updated_at)
+                                 VALUES (?, ?, 'pending', ?, ?, ?)''', (kind, json.dumps(payload), now, now, now))
+    _job_available.set()
+    return cursor.lastrowid
+
+def get_job(job_id, db_path="memories.db", owner=None):
+    """
+    Retrieve the status of a job.
+
+    Args:
+        job_id (int): The id of the job.
+        db_path (str): The path to the SQLite database file.
+        owner (str, optional): Only return the job if it was queued for this tenant
+            database, the db_path of its payload.
+
+    Returns:
+        dict: The job's id, kind, status, attempts, result and error, or None if it does not exist.
+    """
+    query = 'SELECT id, kind, status, attempts, result, error FROM jobs WHERE id = ?'
+    params = [job_id]
+    if owner is not None:
+        query += " AND json_extract(payload, '$.db_path') = ?"
+        params.append(owner)
+    row = get_connection(db_path).execute(query, params).fetchone()
+    if row is None:
+        return None
+    return {
+        "id": row[0],
+        "kind": row[1],
+        "status": row[2],
+        "attempts": row[3],
+        "result": json.loads(row[4]) if row[4] else None,
+        "error": row[5]
+    }
+
+def _claim_jobs(batch_size, db_path):
+    """
+    Mark up to batch_size due jobs of the oldest pending kind as running.
+
+    Returns:
+        tuple: (kind, [(id, payload, attempts), ...]), kind is None if nothing is due.
+    """
+    conn = get_connection(db_path)
+    # IMMEDIATE takes the write lock up front, so two workers never claim the same job
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        _requeue_expired(conn)
+        row = conn.execute("SELECT kind FROM jobs WHERE status = 'pending' AND run_after <= ? ORDER BY id LIMIT 1",
+                           (time.time(),)).fetchone()
+        if row is None:
+            conn.commit()
+            return None, []
+        kind = row[0]
+        rows = conn.execute('''SELECT id, payload, attempts FROM jobs
+                               WHERE status = 'pending' AND kind = ? AND run_after <= ?
+                               ORDER BY id LIMIT ?''', (kind, time.time(), batch_size)).fetchall()
+        conn.executemany("UPDATE jobs SET status = 'running', updated_at = ? WHERE id = ?",
+                         [(time.time(), row[0]) for row in rows])
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return kind, [(row[0], json.loads(row[1]), row[2]) for row in rows]
+
+def _finish_jobs(jobs, results, db_path):
+    """
+    Record the outcome of each job, retrying failed ones with exponential backoff.
+    """
+    max_attempts = int(os.getenv('JOB_MAX_ATTEMPTS', '5'))
+    now = time.time()
+    conn = get_connection(db_path)
+    with conn:
+        for (job_id, _, attempts), result in zip(jobs, results):
+            if not isinstance(result, Exception):
+                conn.execute("UPDATE jobs SET status = 'done', result = ?, error = NULL, updated_at = ? WHERE id = ?",
+                             (json.dumps(result), now, job_id))
+                continue
+            attempts += 1
+            status = 'failed' if attempts >= max_attempts else 'pending'
+            logging.error(f"Job {job_id} attempt {attempts} failed: {result}")
+            conn.execute('''UPDATE jobs SET status = ?, attempts = ?, error = ?, run_after = ?, updated_at = ?
+                            WHERE id = ?''', (status, attempts, str(result), now + 2 ** attempts, now, job_id))
+
+def _run_jobs(handlers, batch_size, db_path):
+    """
+    Claim one batch of due jobs, run it through its handler and record the outcome.
+
+    Returns:
+        bool: Whether any jobs were claimed.
+    """
+    kind, jobs = _claim_jobs(batch_size, db_path)
+    if not jobs:
+        return False
+    handler = handlers.get(kind)
+    try:
+        if handler is None:
+            raise ValueError(f"No handler for job kind '{kind}'")
+        results = handler([payload for _, payload, _ in jobs])
+    except Exception as e:
+        results = [e] * len(jobs)
+    _finish_jobs(jobs, results, db_path)
+    return True
+
+def _work(handlers, db_path):
+    batch_size = int(os.getenv('JOB_BATCH_SIZE', '16'))
+    failures = 0
+    while True:
+        try:
+            ran = _run_jobs(handlers, batch_size, db_path)
+            failures = 0
+        except Exception as e:
+            # Such as "database is locked": jobs left running are requeued when their lease expires
+            failures += 1
+            delay = min(2 ** failures, 60)
+            logging.error(f"Job worker failed, retrying in {delay}s: {e}", exc_info=True)
+            time.sleep(delay)
+            continue
+        if not ran:
+            # Sleep until a job is enqueued, polling for retries that become due
+            _job_available.wait(timeout=1.0)
+            _job_available.clear()
+
+def start_workers(handlers, db_path="memories.db", workers=None):
+    """
+    Start the background worker threads.
+
+    Each worker claims up to JOB_BATCH_SIZE due jobs of one kind and passes their
+    payloads to the handler for that kind. The handler returns one JSON-serializable
+    result per payload. An Exception in place of a result, or an exception raised by
+    the handler, sends the job back to the queue until JOB_MAX_ATTEMPTS is reached.
+
+    Args:
+        handlers (dict): Maps job kinds to handler(payloads) -> results.
+        db_path (str): The path to the SQLite database file.
+        workers (int, optional): The number of worker threads, defaults to INGEST_WORKERS.
+    """
+    workers = workers if workers is not None else int(os.getenv('INGEST_WORKERS', '2'))
+    for i in range(workers):
+        threading.Thread(target=_work, args=(handlers, db_path), name=f"ingest-worker-{i}", daemon=True).start()
@@ -0,0 +1,43 @@
+import re
+
+from tokenizer import count_tokens
+
+
+def select_keyword_hints(prompt, neighbour_keywords, top_keywords, is_keyword, token_budget, limit):
+    """
+    Choose the existing keywords worth showing the analyzer for a prompt.
+
+    Keywords are ranked in three tiers: keywords that appear in the prompt itself,
+    keywords of the prompt's nearest memories (closest memory first), then the most
+    used keywords overall. The ranked list is cut at `limit` keywords or when the
+    joined hint would exceed `token_budget` tokens.
+
+    Args:
+        prompt (str): The user's input.
+        neighbour_keywords (list): Keyword lists of the nearest memories, closest first.
+        top_keywords (list): (keyword, count) tuples of the most used keywords.
+        is_keyword (callable): Returns whether a word is a known keyword.
+        token_budget (int): The maximum number of tokens for the hint.
+        limit (int): The maximum number of keywords.
+
+    Returns:
+        tuple: (list of keywords, number of tokens of the joined hint)
+    """
+    words = set(re.findall(r"[\w-]+", prompt.lower()))
+    ranked = [keyword for keyword in sorted(words) if is_keyword(keyword)]
+    for keywords in neighbour_keywords:
+        ranked.extend(keywords)
+    ranked.extend(keyword for keyword, _ in top_keywords)
+
+    selected, seen, tokens = [], set(), 0
+    for keyword in ranked:
+        if keyword in seen:
+            continue
+        seen.add(keyword)
+        # Each keyword costs its own tokens plus the ", " separator
+        cost = count_tokens(keyword) + (1 if selected else 0)
+        if len(selected) >= limit or tokens + cost > token_budget:
+            break
+        selected.append(keyword)
+        tokens += cost
+    return selected, tokens
@@ -1,16 +1,17 @@
 # Standard library imports
 import os
+import io
 import json
-import sqlite3
 import logging
-import re
-import uuid
+import atexit
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
 # Third-party imports
 import numpy as np
-import faiss
 from dotenv import load_dotenv
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, Response, render_template, request, jsonify, stream_with_context
 import openai
 
 # Local imports
@@ -18,40 +19,119 @@ from langfuse import Langfuse
 from langfuse.decorators import observe
 from langfuse.openai import openai as langfuse_openai
 from prompts import get_prompt
+from embedding_cache import initialize_embedding_cache, get_cached_embedding, cache_embedding, get_cache_stats
+from answer_cache import (
+    answer_cache_enabled,
+    lookup_answer,
+    store_answer,
+    invalidate_memories,
+    invalidate_near,
+    release_answers,
+    get_answer_cache_stats
+)
+from embedding_batcher import start_batcher, batcher_running, submit as submit_embedding
+from tokenizer import count_tokens
+from context_packing import pack_context, pack_lexical_context
+from metrics import span, record_usage, register_collector, render_metrics
+from keyword_hints import select_keyword_hints
+from bulk import iter_records, import_records, export_records
+from graph_cache import (
+    release_graph,
+    get_graph_elements,
+    get_graph_delta,
+    get_graph_page,
+    get_graph_neighbourhood
+)
+from tenants import tenant_db_path
+from job_queue import initialize_job_queue, enqueue_job, get_job, start_workers
 from database import (
     initialize_db,
-    add_to_db,
-    get_entry_by_faiss_index,
-    get_graph_info,
-    get_all_keywords
+    get_entries_by_ids,
+    get_embeddings_by_ids,
+    lexical_search,
+    has_keyword,
+    has_title,
+    get_top_keywords,
+    get_keywords_for_memories,
+    get_all_embeddings,
+    get_memories_without_embedding,
+    set_embeddings,
+    count_embeddings,
+    get_index_generation,
+    get_changes_since,
+    release_vocabulary,
+    sync_vocabulary,
+    add_many_to_db,
+    get_memory,
+    update_in_db,
+    delete_from_db
+)
+from vector_index import (
+    save_index_snapshot,
+    load_index_snapshot,
+    index_description,
+    create_index,
+    apply_search_params,
+    min_training_vectors,
+    train_index,
+    supports_remove,
+    rerank_factor
 )
 
 app = Flask(__name__)
-faiss_index = None
+# Define the dimension of embeddings (OpenAI's embedding size), see embedding_dimension
+EMBEDDING_DIMENSION = 1536
+# Loaded FAISS indexes by database path, least recently used first, see get_store.
+# Each store holds:
+# - index: the FAISS index
+# - description: the index factory string it was created from
+# - mmapped: True while it is the read-only snapshot as loaded, whose IVF lists are memory-mapped
+# - writes: the number of index writes since the last snapshot was saved
+# - generation: the database generation the index reflects, see sync_store
+# - last_id: the highest memory id added to the index
+# - read_only: never save a snapshot, for tools that leave the store unchanged
+# - lock: serializes writes against searches, FAISS indexes are not thread-safe for writes
+stores = OrderedDict()
+stores_lock = threading.Lock()
+# Runs analyzer calls concurrently, both for /chat and for batches of ingest jobs
+pipeline_executor = ThreadPoolExecutor(max_workers=int(os.getenv('PIPELINE_WORKERS', '16')), thread_name_prefix='pipeline')
 
 
-def main():
+def main(workers=True):
     """
     Initialize the application by setting up the database and FAISS index.
+
+    Args:
+        workers (bool): Start the background job workers. Command-line tools that
+            only use the store pass False.
     """
-    global faiss_index
-    load_dotenv()
-    initialize_db()
-    
-    # Retrieve the OpenAI API key from environment variables
-    api_key = os.getenv('OPENAI_API_KEY')
-    if not api_key:
-        raise ValueError("OpenAI API key is not set in the environment variables.")
+    with span("startup"):
+        load_dotenv()
+        initialize_db()
+        initialize_embedding_cache()
+
+        # Retrieve the OpenAI API key from environment variables
+        api_key = os.getenv('OPENAI_API_KEY')
+        if not api_key:
+            raise ValueError("OpenAI API key is not set in the environment variables.")
 
-    # Set the OpenAI API key
-    openai.api_key = api_key
+        # Set the OpenAI API key
+        openai.api_key = api_key
 
-    # Define the dimension of embeddings (OpenAI's embedding size)
-    dimension = 1536
-    faiss_index = faiss.IndexFlatL2(dimension)
+        # Merge concurrent single-text embedding requests into batched API calls
+        if float(os.getenv('EMBEDDING_BATCH_WINDOW_MS', '5')) > 0:
+            start_batcher(fetch_embeddings)
 
-    # Rebuild the FAISS index from existing embeddings in the database
-    rebuild_faiss_index()
+        # Load the default FAISS index from its snapshot, or rebuild it from the database.
+        # Tenant indexes are loaded on first use.
+        get_store()
+        atexit.register(save_all_snapshots)
+
+        # Memory extraction runs off the request path on background workers
+        initialize_job_queue()
+        if workers:
+            start_workers({"analyze": handle_analyze_jobs})
+    register_collector(collect_metrics)
 
 def setup_logger():
     """
@@ -67,85 +147,459 @@ def setup_logger():
         ]
     )
 
-def rebuild_faiss_index(db_path="memories.db"):
+def get_store(db_path="memories.db", backfill=True, read_only=False):
     """
-    Rebuild the FAISS index from the embeddings stored in the SQLite database.
+    Return the loaded FAISS index of a database, loading it on first use.
+
+    At most MAX_LOADED_STORES indexes (default 64) stay loaded. Loading another one
+    evicts the least recently used, saving its snapshot first so it loads quickly
+    when it is needed again. A loaded index is first brought up to date with
+    writes made since, also by other processes, see sync_store.
 
     Args:
         db_path (str): The path to the SQLite database file.
+        backfill (bool): When the index is loaded, first embed memories without a
+            stored embedding, see backfill_embeddings. Read-only tools pass False.
+        read_only (bool): When the index is loaded, never save its snapshot.
+
+    Returns:
+        dict: The store, see stores. Hold its lock while using the index.
     """
-    global faiss_index
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-    
-    # Fetch all content entries from the database, ordered by their FAISS index
-    cursor.execute('SELECT content FROM memories ORDER BY faiss_index')
-    rows = cursor.fetchall()
-    conn.close()
-
-    embeddings = []
-    for row in rows:
-        content = row[0]
-        # Generate embedding for each content entry
-        embedding = get_embedding(content)
-        embeddings.append(embedding)
-    
-    if embeddings:
-        # Convert embeddings list to NumPy array of type float32
-        embeddings_np = np.array(embeddings).astype('float32')
-        # Add embeddings to the FAISS index
-        faiss_index.add(embeddings_np)
-
-def get_entry_by_faiss_index(faiss_idx, db_path="memories.db"):
-    """
-    Retrieve an entry from the database using the FAISS index.
-    """
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-    cursor.execute(
-        'SELECT title, content, keywords FROM memories WHERE faiss_index = ?',
-        (str(faiss_idx),)
-    )
-    result = cursor.fetchone()
-    conn.close()
-    return result 
+    with stores_lock:
+        store = stores.get(db_path)
+        if store is None:
+            store = stores[db_path] = {"index": None, "description": None, "mmapped": False, "writes": 0,
+                                       "generation": 0, "last_id": 0, "read_only": read_only,
+                                       "lock": threading.RLock()}
+            # Other threads asking for this store wait on its lock until it is loaded
+            store["lock"].acquire()
+            evicted = []
+            while len(stores) > int(os.getenv('MAX_LOADED_STORES', '64')):
+                evicted.append(stores.popitem(last=False))
+        else:
+            stores.move_to_end(db_path)
+            evicted = None
+
+    if evicted is None:
+        with store["lock"]:
+            sync_store(store, db_path)
+        return store
+    try:
+        for evicted_path, evicted_store in evicted:
+            logging.info(f"Evicting FAISS index of {evicted_path}")
+            with evicted_store["lock"]:
+                _save_snapshot(evicted_store, evicted_path)
+            release_graph(evicted_path)
+            release_answers(evicted_path)
+            release_vocabulary(evicted_path)
+        with span("index_load"):
+            load_faiss_index(store, embedding_dimension(), db_path, backfill)
+    except Exception:
+        with stores_lock:
+            stores.pop(db_path, None)
+        raise
+    finally:
+        store["lock"].release()
+    return store
+
+def load_faiss_index(store, dimension, db_path="memories.db", backfill=True):
+    """
+    Load a FAISS index into a store, preferring the on-disk snapshot over a rebuild.
+
+    A snapshot whose generation matches the database is memory-mapped as is.
+    A snapshot that is behind the database is caught up with sync_store.
+    Any other snapshot, or one built for a different FAISS_BACKEND, is discarded
+    and the index is rebuilt from stored embeddings.
+
+    Args:
+        store (dict): The store to load into, see stores.
+        dimension (int): The dimension of the embeddings.
+        db_path (str): The path to the SQLite database file.
+        backfill (bool): Embed memories without a stored embedding first.
+    """
+    # Embed any memories stored before embeddings were persisted
+    if backfill:
+        with span("backfill_embeddings"):
+            backfill_embeddings(db_path)
+
+    description = index_description()
+    generation, _ = get_index_generation(db_path)
+    stored = count_embeddings(db_path)
+    index, snapshot = load_index_snapshot(db_path)
+
+    if index is not None and index.d == dimension and snapshot.get("description") == description:
+        if snapshot["generation"] == generation and index.ntotal == stored:
+            logging.info(f"Loaded FAISS snapshot with {index.ntotal} vectors ({description})")
+            store.update(index=index, description=description, mmapped=True,
+                         generation=generation, last_id=snapshot["last_id"])
+            apply_search_params(store["index"])
+            return
+        if snapshot["generation"] < generation:
+            store.update(index=index, description=description, mmapped=True,
+                         generation=snapshot["generation"], last_id=snapshot["last_id"])
+            sync_store(store, db_path)
+            logging.info(f"Caught up FAISS snapshot to {store['index'].ntotal} vectors")
+            apply_search_params(store["index"])
+            _save_snapshot(store, db_path)
+            return
+
+    logging.info(f"FAISS snapshot missing or stale, rebuilding index ({description})")
+    store.update(index=create_index(dimension), description=description, mmapped=False, generation=generation)
+    rebuild_faiss_index(store, db_path)
+    apply_search_params(store["index"])
+    _save_snapshot(store, db_path)
+
+def save_faiss_snapshot(db_path="memories.db"):
+    """
+    Write the FAISS index of a database to disk, if it is loaded.
+
+    Args:
+        db_path (str): The path to the SQLite database file.
+    """
+    store = stores.get(db_path)
+    if store is not None:
+        with store["lock"]:
+            _save_snapshot(store, db_path)
+
+def save_all_snapshots():
+    """
+    Write every loaded FAISS index to disk.
+    """
+    with stores_lock:
+        loaded = list(stores.items())
+    for db_path, store in loaded:
+        with store["lock"]:
+            _save_snapshot(store, db_path)
+
+def _save_snapshot(store, db_path):
+    """
+    Write a store's index to disk, tagged with the database generation it reflects.
+    Callers hold the store's lock.
+    """
+    if store["index"] is None or store["read_only"] or (store["mmapped"] and store["writes"] == 0):
+        return
+    save_index_snapshot(store["index"], store["generation"], store["description"], db_path)
+    store["writes"] = 0
+
+def ensure_writable_index(store, db_path="memories.db"):
+    """
+    Read a memory-mapped index into memory before it is modified.
+
+    Memory-mapped inverted lists cannot be cloned, so the snapshot is read again
+    without mmap. It may have been saved again by another process in the meantime,
+    so the store takes over the generation and last id recorded with it. Without
+    a matching snapshot the index is emptied and refilled by sync_store.
+    Callers hold the store's lock.
+    """
+    if not store["mmapped"]:
+        return
+    index, snapshot = load_index_snapshot(db_path, mmap=False)
+    if index is not None and index.d == store["index"].d and snapshot.get("description") == store["description"]:
+        store.update(index=index, generation=snapshot["generation"], last_id=snapshot["last_id"])
+    else:
+        store.update(index=create_index(store["index"].d), description=index_description(), last_id=0)
+    store["mmapped"] = False
+    apply_search_params(store["index"])
+
+def index_changed(store, db_path="memories.db"):
+    """
+    Record a write to a store's index and snapshot it every FAISS_SNAPSHOT_EVERY writes.
+
+    Args:
+        store (dict): The store that was written to, see stores.
+        db_path (str): The path to the SQLite database file.
+    """
+    store["writes"] += 1
+    if store["writes"] >= int(os.getenv('FAISS_SNAPSHOT_EVERY', '100')):
+        _save_snapshot(store, db_path)
+
+def sync_store(store, db_path="memories.db"):
+    """
+    Bring a store's index and the database's cached answers up to date with the database.
+
+    Every process keeps its own index, while memories may be written by any of them,
+    such as the ingest workers of another server process. Rows added since the
+    store's generation are appended, and memories changed or deleted since are
+    replaced or removed, as logged in memory_changes. When that log no longer
+    reaches back far enough, or the index cannot remove vectors (HNSW), the index
+    is rebuilt from the stored embeddings instead. Callers hold the store's lock.
+
+    Cached answers that used a changed memory, or whose prompt is close to a new or
+    changed one, are dropped, whichever process wrote it. A rebuild drops them all.
+    The keyword vocabulary is caught up as well, see sync_vocabulary.
+
+    Args:
+        store (dict): The store to update, see stores.
+        db_path (str): The path to the SQLite database file.
+    """
+    if store["index"] is None:
+        return
+    # Read the generation before the rows, so writes racing with this are picked up next time
+    generation, rewrite_generation = get_index_generation(db_path)
+    sync_vocabulary(generation, rewrite_generation, db_path)
+    if generation == store["generation"]:
+        return
+    ensure_writable_index(store, db_path)
+    if rewrite_generation > store["generation"]:
+        changed = get_changes_since(store["generation"], db_path)
+        if changed is None or not supports_remove(store["index"]):
+            logging.info(f"Rebuilding {store['description']} to apply changed memories")
+            store.update(index=create_index(store["index"].d), description=index_description(), last_id=0)
+            apply_search_params(store["index"])
+            release_answers(db_path)
+        else:
+            invalidate_memories(changed, db_path)
+            replaced = replace_vectors(store, [memory_id for memory_id in changed if memory_id <= store["last_id"]], db_path)
+            invalidate_near(replaced, db_path)
+    added = rebuild_faiss_index(store, db_path, after_id=store["last_id"])
+    invalidate_near(added, db_path)
+    store["generation"] = generation
+    index_changed(store, db_path)
+
+def replace_vectors(store, memory_ids, db_path="memories.db"):
+    """
+    Replace the vectors of changed memories with their stored embeddings, dropping
+    those of deleted memories. Callers hold the store's lock.
+
+    Returns:
+        np.ndarray: The (n, dimension) matrix of the replacement vectors.
+    """
+    if not memory_ids:
+        return np.empty((0, store["index"].d), dtype='float32')
+    store["index"].remove_ids(np.array(memory_ids, dtype='int64'))
+    stored = get_embeddings_by_ids(memory_ids, db_path)
+    if not stored:
+        return np.empty((0, store["index"].d), dtype='float32')
+    ids_np = np.array(list(stored), dtype='int64')
+    vectors_np = np.stack([np.frombuffer(blob, dtype='float32') for blob in stored.values()])
+    store["index"].add_with_ids(vectors_np, ids_np)
+    return vectors_np
+
+def rebuild_faiss_index(store, db_path="memories.db", after_id=0):
+    """
+    Rebuild a store's FAISS index from the embeddings stored in the SQLite database.
+    Vectors are keyed by the id of their memory row.
+    Untrained indexes are trained on the stored embeddings first; if there are
+    too few of them yet, a flat index is used until the next rebuild.
+
+    Args:
+        store (dict): The store whose index is filled, see stores.
+        db_path (str): The path to the SQLite database file.
+        after_id (int): The highest memory id already in the index.
+
+    Returns:
+        np.ndarray: The (n, dimension) matrix of the vectors added.
+    """
+    with span("index_rebuild"):
+        index = store["index"]
+        # Fetch all stored embeddings in one read, ordered by id. Embeddings of another
+        # dimension are left out until backfill_embeddings redoes them
+        rows = [row for row in get_all_embeddings(db_path, after_id) if len(row[1]) == index.d * 4]
+
+        # Decode the float32 blobs into a single (n, dimension) matrix
+        embeddings_np = np.frombuffer(b''.join(row[1] for row in rows), dtype='float32')
+        embeddings_np = embeddings_np.reshape(len(rows), index.d)
+
+        required = min_training_vectors(index)
+        if required and len(embeddings_np) < required:
+            logging.warning(
+                f"{store['description']} needs {required} vectors to train, "
+                f"only {len(embeddings_np)} stored; using a flat index for now"
+            )
+            index = store["index"] = create_index(index.d, "flat")
+            store["description"] = index_description("flat")
+        elif required:
+            logging.info(f"Training {store['description']} on {len(embeddings_np)} vectors")
+            train_index(index, embeddings_np)
+
+        if rows:
+            # Add all embeddings to the FAISS index at once, keyed by memory id
+            ids_np = np.array([row[0] for row in rows], dtype='int64')
+            index.add_with_ids(embeddings_np, ids_np)
+            store["last_id"] = max(store["last_id"], rows[-1][0])
+        return embeddings_np
+
+def backfill_embeddings(db_path="memories.db"):
+    """
+    Generate and store embeddings for memories that do not have one yet.
+    This migrates databases created before embeddings were persisted, and
+    re-embeds memories stored with a different EMBEDDING_DIMENSIONS.
+
+    Args:
+        db_path (str): The path to the SQLite database file.
+    """
+    rows = get_memories_without_embedding(db_path, embedding_dimension())
+    if rows:
+        logging.info(f"Backfilling embeddings for {len(rows)} memories")
+    # Each chunk is embedded in as few API calls as possible and stored in one transaction
+    chunk_size = int(os.getenv('EMBEDDING_BATCH_SIZE', '2048'))
+    for start in range(0, len(rows), chunk_size):
+        chunk = rows[start:start + chunk_size]
+        embeddings = get_embeddings([content for _, content in chunk])
+        set_embeddings([
+            (memory_id, np.array(embedding, dtype='float32').tobytes())
+            for (memory_id, _), embedding in zip(chunk, embeddings)
+        ], db_path)
+
+def search_similar_entries(query_text, k=5, min_score=None, db_path="memories.db", mode=None):
+    """
+    Search for entries similar to the query_text.
+
+    The mode, SEARCH_MODE by default, selects the retrieval:
+    - vector: nearest neighbours in the FAISS index.
+    - lexical: BM25 over the FTS5 index, without calling the embeddings API.
+    - hybrid (default): both rankings combined with reciprocal rank fusion. Queries
+      that exactly name a memory title or a keyword are answered lexically only.
+
+    Args:
+        query_text (str): The text to search for similar entries.
+        k (int): The number of similar entries to retrieve.
+        min_score (float, optional): Drop entries scoring below this similarity.
+        db_path (str): The path to the SQLite database file.
+        mode (str, optional): vector, lexical or hybrid.
+
+    Returns:
+        list: A list of dictionaries containing similar entries, best first. Entries
+        found by vector search carry their squared L2 distance and a score, which is
+        the cosine similarity for the unit-length OpenAI embeddings; entries found
+        only lexically have None for both. Lexical matches carry their BM25 value.
+    """
+    mode = mode or os.getenv('SEARCH_MODE', 'hybrid')
+    if mode == 'vector':
+        return vector_search(query_text, k, min_score, db_path)
+
+    candidates = k * int(os.getenv('HYBRID_CANDIDATES', '4'))
+    with span("lexical_search"):
+        lexical_results = [
+            {"id": row[0], "title": row[1], "content": row[2], "keywords": row[3], "distance": None, "score": None, "bm25": row[4]}
+            for row in lexical_search(query_text, candidates, db_path)
+        ]
+    if mode == 'lexical' or (lexical_results and is_exact_lexical_match(query_text, db_path)):
+        logging.info("Answering search from the lexical index only")
+        return lexical_results[:k]
+
+    vector_results = vector_search(query_text, candidates, None, db_path)
+    fused = reciprocal_rank_fusion([vector_results, lexical_results])
+    results = []
+    for entry in fused:
+        if min_score is not None and entry["score"] is not None and entry["score"] < min_score:
+            continue
+        results.append(entry)
+        if len(results) == k:
+            break
+    return results
+
+def is_exact_lexical_match(query_text, db_path="memories.db"):
+    """
+    Return whether a query is exactly the title or a keyword of a stored memory,
+    in which case lexical search finds what it is about.
+    """
+    query = ' '.join(query_text.lower().split()).strip(' ?!.')
+    if not query:
+        return False
+    return has_keyword(query, db_path) or has_title(query, db_path)
+
+def reciprocal_rank_fusion(rankings, k=60):
+    """
+    Merge ranked result lists by reciprocal rank fusion: an entry scores the sum of
+    1 / (k + rank) over the lists it appears in.
+
+    Args:
+        rankings (list): Lists of result dictionaries with an "id", best first.
+        k (int): The RRF constant, dampening the weight of top ranks.
+
+    Returns:
+        list: The merged entries, best first, each with its "rrf_score". Fields of
+        the same entry from different lists are merged.
+    """
+    fused = {}
+    for ranking in rankings:
+        for rank, entry in enumerate(ranking, start=1):
+            merged = fused.setdefault(entry["id"], {"rrf_score": 0.0})
+            for key, value in entry.items():
+                if value is not None or key not in merged:
+                    merged[key] = value
+            merged["rrf_score"] += 1 / (k + rank)
+    return sorted(fused.values(), key=lambda entry: entry["rrf_score"], reverse=True)
 
-def search_similar_entries(query_text, k=5, db_path="memories.db"):
+def vector_search(query_text, k=5, min_score=None, db_path="memories.db"):
     """
     Search for entries similar to the query_text using the FAISS index.
 
     Args:
         query_text (str): The text to search for similar entries.
         k (int): The number of similar entries to retrieve.
+        min_score (float, optional): Drop entries scoring below this similarity.
         db_path (str): The path to the SQLite database file.
 
     Returns:
-        list: A list of dictionaries containing similar entries.
+        list: A list of dictionaries containing similar entries, most similar first.
+        Each entry carries its squared L2 distance and a score, which is the cosine
+        similarity for the unit-length OpenAI embeddings.
     """
     # Generate the embedding for the query text
-    query_embedding = get_embedding(query_text)
+    with span("query_embedding"):
+        query_embedding = get_embedding(query_text)
     query_embedding_np = np.array([query_embedding]).astype('float32')
 
     # Search for the k nearest neighbors in the FAISS index
-    distances, indices = faiss_index.search(query_embedding_np, k)
+    store = get_store(db_path)
+    with span("faiss_search"), store["lock"]:
+        # Compressed indexes only estimate distances, so fetch extra candidates to re-rank
+        factor = rerank_factor(store["index"])
+        distances, indices = store["index"].search(query_embedding_np, k * factor)
+
+    # Skip positions where no result was found
+    hits = [(int(memory_id), float(distance)) for memory_id, distance in zip(indices[0], distances[0]) if memory_id != -1]
+    if factor > 1:
+        with span("rerank"):
+            hits = rerank_exact(query_embedding_np[0], hits, db_path)[:k]
+    # Retrieve all hits from the database at once
+    with span("sqlite_lookup"):
+        entries = get_entries_by_ids([memory_id for memory_id, _ in hits], db_path)
 
     results = []
-    for faiss_idx in indices[0]:
-        if faiss_idx == -1:
-            continue  # Skip if no result found at this position
-        # Retrieve the entry corresponding to the FAISS index
-        entry = get_entry_by_faiss_index(faiss_idx, db_path)
-        if entry:
-            # Map the tuple to a dictionary for JSON format
-            result_dict = {
-                "title": entry[0],
-                "content": entry[1],
-                "keywords": entry[2]
-            }
-            results.append(result_dict)
-    
+    for memory_id, distance in hits:
+        entry = entries.get(memory_id)
+        score = 1 - distance / 2
+        if entry is None or (min_score is not None and score < min_score):
+            continue
+        # Map the tuple to a dictionary for JSON format, keeping FAISS rank order
+        results.append({
+            "id": memory_id,
+            "title": entry[0],
+            "content": entry[1],
+            "keywords": entry[2],
+            "distance": distance,
+            "score": score
+        })
+
     return results
 
+def rerank_exact(query_np, hits, db_path="memories.db"):
+    """
+    Re-rank index hits by their exact distance to the query.
+
+    Distances are recomputed from the full-precision embeddings stored in the
+    SQLite database, which are read through its memory map (SQLITE_MMAP_SIZE).
+
+    Args:
+        query_np (numpy.ndarray): The query embedding.
+        hits (list): (memory_id, distance) pairs from the index.
+        db_path (str): The path to the SQLite database file.
+
+    Returns:
+        list: (memory_id, squared L2 distance) pairs, nearest first. Hits without
+        a stored embedding are dropped.
+    """
+    stored = get_embeddings_by_ids([memory_id for memory_id, _ in hits], db_path)
+    memory_ids = [memory_id for memory_id, _ in hits if memory_id in stored]
+    if not memory_ids:
+        return []
+    vectors = np.stack([np.frombuffer(stored[memory_id], dtype='float32') for memory_id in memory_ids])
+    distances = ((vectors - query_np) ** 2).sum(axis=1)
+    return [(memory_ids[i], float(distances[i])) for i in np.argsort(distances, kind='stable')]
+
 def add_to_faiss_and_db(title, content, keywords, db_path="memories.db"):
     """
     Add a new entry to the FAISS index and the SQLite database.
@@ -155,31 +609,274 @@ def add_to_faiss_and_db(title, content, keywords, db_path="memories.db"):
         content (str): The content to be added.
         keywords (list): A list of keywords associated with the content.
         db_path (str): The path to the SQLite database file.
+
+    Returns:
+        int: The id of the new memory, or None if it could not be stored.
     """
-    # Embed the content using OpenAI's embedding API
-    content_embedding = get_embedding(content)
-    content_embedding_np = np.array([content_embedding]).astype('float32')
+    return add_memories_batch([(title, content, keywords)], db_path)[0]
 
-    # Get the next index position in FAISS
-    faiss_index_position = faiss_index.ntotal
-    # Add the embedding to the FAISS index
-    faiss_index.add(content_embedding_np)
+def add_memories_batch(entries, db_path="memories.db", embeddings=None):
+    """
+    Add several entries to the FAISS index and the SQLite database at once.
+    The contents are embedded together, the rows are written in one transaction
+    and the vectors are added to FAISS in one call.
 
-    # Store the new entry in the SQLite database
-    add_to_db(title, content, keywords, faiss_index_position, db_path)
+    Args:
+        entries (list): Tuples of (title, content, keywords).
+        db_path (str): The path to the SQLite database file.
+        embeddings (list, optional): Precomputed embeddings, one per entry or None
+            for entries that still need embedding.
 
-@observe()
-def send_question_to_openai(system_prompt, user_prompt, message_history=None):
+    Entries nearly identical to a stored memory are handled by DEDUP_POLICY, see
+    resolve_duplicate, and entries nearly identical to an earlier entry of the
+    same batch are skipped.
+
+    Returns:
+        list: The id of each new memory, the id of the memory a duplicate was merged
+        into or versioned, or None for entries that were skipped or could not be stored.
     """
-    Send a question to OpenAI's API and return the response.
+    if not entries:
+        return []
+    embeddings = list(embeddings) if embeddings is not None else [None] * len(entries)
+    # Embeddings of another dimension, say from an export made with other EMBEDDING_DIMENSIONS, are redone
+    dimension = embedding_dimension()
+    missing = [i for i, embedding in enumerate(embeddings) if embedding is None or len(embedding) != dimension]
+    # Embed the remaining contents using OpenAI's embedding API
+    for i, embedding in zip(missing, get_embeddings([entries[i][1] for i in missing]) if missing else []):
+        embeddings[i] = embedding
+    embeddings_np = np.array(embeddings).astype('float32')
+
+    memory_ids = [None] * len(entries)
+    fresh = list(range(len(entries)))
+    policy = os.getenv('DEDUP_POLICY', 'skip')
+    if policy != 'off':
+        threshold = dedup_similarity()
+        batch_similarity = embeddings_np @ embeddings_np.T
+        fresh = []
+        for i, matches in enumerate(find_near_duplicates(embeddings_np, 1, db_path)):
+            if matches:
+                memory_ids[i] = resolve_duplicate(matches[0][0], entries[i], policy, db_path)
+            elif fresh and (batch_similarity[i, fresh] >= threshold).any():
+                logging.info(f"Skipping near-duplicate within the batch: {entries[i][0]}")
+            else:
+                fresh.append(i)
+    if not fresh:
+        return memory_ids
+
+    # Store the new entries in the SQLite database along with their embeddings
+    for i, memory_id in zip(fresh, add_many_to_db(
+        [(entries[i][0], entries[i][1], entries[i][2], embeddings_np[i].tobytes()) for i in fresh],
+        db_path
+    )):
+        memory_ids[i] = memory_id
+    stored = [i for i in fresh if memory_ids[i] is not None]
+    if not stored:
+        return memory_ids
+
+    # Append the stored embeddings to the FAISS index and drop the cached answers
+    # they affect; the graph catches up on its next read
+    get_store(db_path)
+    return memory_ids
+
+def dedup_similarity():
+    """
+    Return the cosine similarity above which two memories count as duplicates.
+    """
+    return float(os.getenv('DEDUP_SIMILARITY', '0.9'))
+
+def find_near_duplicates(embeddings_np, k=1, db_path="memories.db"):
+    """
+    Find the stored memories nearly identical to each embedding.
+
+    The k nearest memories in the FAISS index, over-fetched by rerank_factor, are
+    confirmed with their stored embeddings, since approximate indexes only estimate
+    distances. For unit-length embeddings the squared L2 distance is 2 - 2 * cosine,
+    so a DEDUP_SIMILARITY cosine is a distance of 2 * (1 - DEDUP_SIMILARITY).
 
     Args:
-        system_prompt (str): The system prompt guiding the assistant's behavior.
-        user_prompt (str): The user's input or query.
-        message_history (list, optional): A list of message dictionaries representing the conversation history.
+        embeddings_np (numpy.ndarray): The embeddings to check, one per row.
+        k (int): The number of nearest memories to consider for each.
+        db_path (str): The path to the SQLite database file.
 
     Returns:
-        str: The assistant's response generated by OpenAI.
+        list: For each embedding, (memory_id, similarity) pairs at or above
+        DEDUP_SIMILARITY, most similar first.
+    """
+    threshold = dedup_similarity()
+    store = get_store(db_path)
+    with store["lock"]:
+        if store["index"].ntotal == 0:
+            return [[] for _ in embeddings_np]
+        distances, indices = store["index"].search(embeddings_np, k * rerank_factor(store["index"]))
+
+    # Leave room for estimation error before the exact check
+    max_distance = 4 * (1 - threshold)
+    candidates = {int(memory_id) for row_ids, row_distances in zip(indices, distances)
+                  for memory_id, distance in zip(row_ids, row_distances)
+                  if memory_id != -1 and distance <= max_distance}
+    stored = get_embeddings_by_ids(list(candidates), db_path)
+
+    results = []
+    for embedding, row_ids in zip(embeddings_np, indices):
+        matches = []
+        for memory_id in dict.fromkeys(int(memory_id) for memory_id in row_ids):
+            if memory_id in stored:
+                similarity = float(np.frombuffer(stored[memory_id], dtype='float32') @ embedding)
+                if similarity >= threshold:
+                    matches.append((memory_id, similarity))
+        matches.sort(key=lambda match: match[1], reverse=True)
+        results.append(matches[:k])
+    return results
+
+def resolve_duplicate(memory_id, entry, policy, db_path="memories.db"):
+    """
+    Apply the DEDUP_POLICY to a new entry that nearly repeats a stored memory.
+
+    - skip (default): the entry is dropped.
+    - merge: the merger prompt folds the entry's content into the memory.
+    - version: the entry's content replaces the memory's, whose previous
+      content is archived in memory_versions.
+
+    The memory keeps its title and gains the entry's keywords.
+
+    Args:
+        memory_id (int): The id of the stored memory.
+        entry (tuple): The new (title, content, keywords).
+        policy (str): skip, merge or version.
+        db_path (str): The path to the SQLite database file.
+
+    Returns:
+        int: The id of the memory, or None if the entry was skipped.
+    """
+    title, content, keywords = entry
+    existing = get_memory(memory_id, db_path)
+    if existing is None or policy not in ('merge', 'version'):
+        logging.info(f"Skipping near-duplicate of memory {memory_id}: {title}")
+        return None
+
+    keywords = list(dict.fromkeys([k for k in (existing[2] or '').split(',') if k] + list(keywords)))
+    if policy == 'merge':
+        content = merge_contents(existing[1], content)
+        if content is None:
+            return None
+    logging.info(f"Applying {policy} to near-duplicate of memory {memory_id}: {title}")
+    if not update_memory(memory_id, content=content, keywords=keywords, db_path=db_path, keep_version=policy == 'version'):
+        return None
+    return memory_id
+
+def merge_contents(existing_content, new_content):
+    """
+    Merge new information into a stored memory's content using the merger prompt.
+
+    Returns:
+        str: The merged content, or None if the merger call failed.
+    """
+    merged = send_question_to_openai(
+        get_prompt("merger"),
+        f"<existing_entry>{existing_content}</existing_entry>\n<new_content>{new_content}</new_content>"
+    )
+    if not merged:
+        return None
+    return merged.strip().strip('"')
+
+def consolidate_duplicates(memory_id, duplicate_ids, policy, db_path="memories.db"):
+    """
+    Fold duplicates of a memory into it and delete them, used by compaction.
+
+    Under the merge policy their contents are merged into the memory's, under the
+    version policy they are archived as versions of the memory, and under skip they
+    are simply deleted. The memory gains their keywords in every case.
+
+    Args:
+        memory_id (int): The id of the memory that is kept.
+        duplicate_ids (list): The ids of its duplicates.
+        policy (str): skip, merge or version.
+        db_path (str): The path to the SQLite database file.
+
+    Returns:
+        list: The ids of the duplicates that were deleted.
+    """
+    existing = get_memory(memory_id, db_path)
+    if existing is None:
+        return []
+    content = existing[1]
+    keywords = [k for k in (existing[2] or '').split(',') if k]
+    folded = []
+    for duplicate_id in duplicate_ids:
+        duplicate = get_memory(duplicate_id, db_path)
+        if duplicate is None:
+            continue
+        if policy == 'merge':
+            merged = merge_contents(content, duplicate[1])
+            if merged is None:
+                continue
+            content = merged
+        keywords += [k for k in (duplicate[2] or '').split(',') if k]
+        folded.append(duplicate_id)
+    if not folded:
+        return []
+
+    update_memory(memory_id, content=content, keywords=list(dict.fromkeys(keywords)), db_path=db_path)
+    version_of = memory_id if policy == 'version' else None
+    return [duplicate_id for duplicate_id in folded if delete_memory(duplicate_id, db_path, version_of=version_of)]
+
+def update_memory(memory_id, title=None, content=None, keywords=None, db_path="memories.db", keep_version=False):
+    """
+    Update a memory in place, replacing its vector if the content changed.
+
+    Args:
+        memory_id (int): The id of the memory to update.
+        title (str, optional): The new title.
+        content (str, optional): The new content.
+        keywords (list, optional): The new keywords.
+        db_path (str): The path to the SQLite database file.
+        keep_version (bool): Archive the memory's current row in memory_versions.
+
+    Returns:
+        bool: True if the memory was updated, None if it does not exist.
+    """
+    entry = get_memory(memory_id, db_path)
+    if entry is None:
+        return None
+    current_title, current_content, current_keywords = entry
+    title = title if title is not None else current_title
+    keywords = keywords if keywords is not None else [k for k in (current_keywords or '').split(',') if k]
+
+    content_embedding_np = None
+    if content is not None and content != current_content:
+        content_embedding = get_embedding(content)
+        content_embedding_np = np.array([content_embedding]).astype('float32')
+    else:
+        content = current_content
+
+    embedding = content_embedding_np.tobytes() if content_embedding_np is not None else None
+    if not update_in_db(memory_id, title, content, keywords, db_path, embedding=embedding, keep_version=keep_version):
+        return False
+    # Replace the memory's vector and drop the cached answers it affects, see sync_store
+    get_store(db_path)
+    return True
+
+def delete_memory(memory_id, db_path="memories.db", version_of=None):
+    """
+    Delete a memory from the SQLite database and remove its vector from FAISS.
+
+    Args:
+        memory_id (int): The id of the memory to delete.
+        db_path (str): The path to the SQLite database file.
+        version_of (int, optional): Archive the memory as a version of this one.
+
+    Returns:
+        bool: True if the memory existed and was deleted.
+    """
+    if not delete_from_db(memory_id, db_path, version_of=version_of):
+        return False
+    # Remove the memory's vector and the cached answers that used it, see sync_store
+    get_store(db_path)
+    return True
+
+def build_messages(system_prompt, user_prompt, message_history=None):
+    """
+    Build the chat messages for a question, with the system prompt first.
     """
     if message_history is None:
         # Start a new conversation with the system prompt and user prompt
@@ -195,6 +892,22 @@ def send_question_to_openai(system_prompt, user_prompt, message_history=None):
             messages.insert(0, {"role": "system", "content": system_prompt})
         # Append the new user message
         messages.append({"role": "user", "content": user_prompt})
+    return messages
+
+@observe()
+def send_question_to_openai(system_prompt, user_prompt, message_history=None):
+    """
+    Send a question to OpenAI's API and return the response.
+
+    Args:
+        system_prompt (str): The system prompt guiding the assistant's behavior.
+        user_prompt (str): The user's input or query.
+        message_history (list, optional): A list of message dictionaries representing the conversation history.
+
+    Returns:
+        str: The assistant's response generated by OpenAI.
+    """
+    messages = build_messages(system_prompt, user_prompt, message_history)
 
     try:
         # Send the messages to OpenAI's API to get a response
@@ -202,6 +915,7 @@ def send_question_to_openai(system_prompt, user_prompt, message_history=None):
             model="gpt-4o-mini",
             messages=messages
         )
+        record_usage("chat", response.usage)
         # Extract and return the assistant's reply
         assistant_reply = response.choices[0].message.content
         return assistant_reply
@@ -209,9 +923,61 @@ def send_question_to_openai(system_prompt, user_prompt, message_history=None):
         logging.error(f"An error occurred while communicating with OpenAI: {e}")
         return None
 
+@observe()
+def stream_question_to_openai(system_prompt, user_prompt, message_history=None):
+    """
+    Send a question to OpenAI's API and yield the response as it is generated.
+
+    Args:
+        system_prompt (str): The system prompt guiding the assistant's behavior.
+        user_prompt (str): The user's input or query.
+        message_history (list, optional): A list of message dictionaries representing the conversation history.
+
+    Yields:
+        str: Pieces of the assistant's response, in order.
+
+    Raises:
+        Exception: The error from the API, after it is logged, so the caller can tell
+            the client instead of ending the answer early.
+    """
+    messages = build_messages(system_prompt, user_prompt, message_history)
+
+    try:
+        stream = openai.chat.completions.create(
+            model="gpt-4o-mini",
+            messages=messages,
+            stream=True,
+            stream_options={"include_usage": True}
+        )
+        for chunk in stream:
+            # The last chunk carries the token usage and no choices
+            if chunk.usage is not None:
+                record_usage("chat", chunk.usage)
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+    except Exception as e:
+        logging.error(f"An error occurred while communicating with OpenAI: {e}")
+        raise
+
+def embedding_dimension():
+    """
+    Return the dimension of the embeddings, EMBEDDING_DIMENSIONS or the model's full EMBEDDING_DIMENSION.
+    """
+    return int(os.getenv('EMBEDDING_DIMENSIONS') or EMBEDDING_DIMENSION)
+
+def _cache_model(model):
+    """
+    Return the model name embeddings are cached under, so shortened embeddings
+    are kept apart from full-length ones.
+    """
+    dimensions = os.getenv('EMBEDDING_DIMENSIONS')
+    return f"{model}@{dimensions}" if dimensions else model
+
 def get_embedding(text, model="text-embedding-3-small"):
     """
     Get the embedding of a text using OpenAI's embedding API.
+    Embeddings are cached by content hash, so repeated texts skip the API call.
+    When the micro-batcher is running, concurrent calls share one API request.
 
     Args:
         text (str): The text to be embedded.
@@ -220,77 +986,305 @@ def get_embedding(text, model="text-embedding-3-small"):
     Returns:
         list: A list representing the embedding vector.
     """
-    # Replace newlines to avoid issues with the API
-    text = text.replace("\n", " ")
-    # Generate and return the embedding
-    return openai.embeddings.create(input=[text], model=model).data[0].embedding
+    # Collapse newlines and repeated whitespace, which also lets near-identical texts share a cache entry
+    text = ' '.join(text.split())
+    embedding = get_cached_embedding(text, _cache_model(model))
+    if embedding is not None:
+        return embedding
+    # Already looked up in the cache, so go straight to the API
+    if batcher_running():
+        return submit_embedding(text, model).result()
+    return fetch_embeddings([text], model)[0]
+
+def get_embeddings(texts, model="text-embedding-3-small"):
+    """
+    Get the embeddings of many texts, sending the uncached ones in as few API calls as possible.
 
-def process_input(prompt):
+    Args:
+        texts (list): The texts to be embedded.
+        model (str): The name of the embedding model to use.
+
+    Returns:
+        list: One embedding vector per text, in the same order.
     """
-    Process user input by searching for similar entries, analyzing the input,
-    updating the database and FAISS index if necessary, and generating a response.
+    cache_model = _cache_model(model)
+    texts = [' '.join(text.split()) for text in texts]
+    embeddings = {}
+    for text in texts:
+        if text not in embeddings:
+            embeddings[text] = get_cached_embedding(text, cache_model)
+    missing = [text for text, embedding in embeddings.items() if embedding is None]
+    if missing:
+        embeddings.update(zip(missing, fetch_embeddings(missing, model)))
+    return [embeddings[text] for text in texts]
+
+def fetch_embeddings(texts, model="text-embedding-3-small"):
     """
-    logging.info("Processing input")
-    keywords = get_all_keywords()
-    # Analyze the user's input
+    Embed texts with the API without looking them up in the cache first, and cache
+    the results. Used for texts whose cache lookup already missed.
+
+    Requests are split so each stays under EMBEDDING_BATCH_TOKENS tokens and
+    EMBEDDING_BATCH_SIZE inputs. With EMBEDDING_DIMENSIONS set, the API is asked
+    for embeddings shortened to that many dimensions.
+
+    Args:
+        texts (list): The whitespace-normalized texts to be embedded.
+        model (str): The name of the embedding model to use.
+
+    Returns:
+        list: One embedding vector per text, in the same order.
+    """
+    max_tokens = int(os.getenv('EMBEDDING_BATCH_TOKENS', '100000'))
+    max_inputs = int(os.getenv('EMBEDDING_BATCH_SIZE', '2048'))
+    dimensions = os.getenv('EMBEDDING_DIMENSIONS')
+    options = {"dimensions": int(dimensions)} if dimensions else {}
+    cache_model = _cache_model(model)
+
+    # Concurrent batched calls may carry the same text more than once
+    embeddings = dict.fromkeys(texts)
+    # Group the texts into requests within the token and input budgets
+    chunks = []
+    chunk, chunk_tokens = [], 0
+    for text in embeddings:
+        tokens = count_tokens(text)
+        if chunk and (chunk_tokens + tokens > max_tokens or len(chunk) >= max_inputs):
+            chunks.append(chunk)
+            chunk, chunk_tokens = [], 0
+        chunk.append(text)
+        chunk_tokens += tokens
+    if chunk:
+        chunks.append(chunk)
+
+    for chunk in chunks:
+        with span("embedding_api"):
+            response = openai.embeddings.create(input=chunk, model=model, **options)
+        record_usage("embeddings", response.usage)
+        for item in response.data:
+            text = chunk[item.index]
+            embeddings[text] = item.embedding
+            cache_embedding(text, cache_model, item.embedding)
+
+    return [embeddings[text] for text in texts]
+
+def analyze_input(prompt, db_path="memories.db"):
+    """
+    Ask the analyzer which memory, if any, should be learned from the user's input.
+
+    Rather than every stored keyword, the analyzer is shown the existing keywords
+    most relevant to the prompt, limited to ANALYZER_KEYWORD_LIMIT keywords and
+    ANALYZER_KEYWORD_TOKENS tokens.
+
+    Returns:
+        str: The analyzer's JSON reply, or None if the call failed.
+    """
+    with span("keyword_loading"):
+        keywords = select_analyzer_keywords(prompt, db_path)
+    system_prompt = get_prompt("analyzer") + "<keywords>" + ', '.join(keywords) + "</keywords>"
     logging.info("Starting user input analysis")
-    analysis = send_question_to_openai(get_prompt("analyzer") + "<keywords>" + str(keywords) + "</keywords>", prompt)
+    logging.info(f"Analyzer system prompt uses {count_tokens(system_prompt)} tokens")
+    with span("analyzer_call"):
+        analysis = send_question_to_openai(system_prompt, prompt)
     logging.info("Analysis completed. Result: " + str(analysis))
+    return analysis
 
-    memory_added = False
+def select_analyzer_keywords(prompt, db_path="memories.db"):
+    """
+    Select the existing keywords to offer the analyzer for a prompt: keywords named in
+    the prompt, then those of its nearest memories, then the most used ones.
 
-    if analysis:
-        try:
-            analysis_data = json.loads(analysis)
-            keywords = analysis_data.get("keywords", [])
-            content = analysis_data.get("content")
-            title = analysis_data.get("title")
-            
-            if content:
-                logging.info("Adding information to DB")
-                add_to_faiss_and_db(title, content, keywords)
-                memory_added = True
-
-        except json.JSONDecodeError:
-            logging.error("Failed to decode JSON from analysis.")
-
-    # Search for similar information
+    Returns:
+        list: The selected keywords.
+    """
+    limit = int(os.getenv('ANALYZER_KEYWORD_LIMIT', '50'))
+    token_budget = int(os.getenv('ANALYZER_KEYWORD_TOKENS', '200'))
+
+    # The prompt's embedding is usually cached already by the retrieval path
+    neighbours = search_similar_entries(prompt, int(os.getenv('ANALYZER_KEYWORD_NEIGHBOURS', '10')), db_path=db_path)
+    keywords_by_memory = get_keywords_for_memories([entry["id"] for entry in neighbours], db_path)
+    neighbour_keywords = [keywords_by_memory.get(entry["id"], []) for entry in neighbours]
+
+    keywords, tokens = select_keyword_hints(
+        prompt,
+        neighbour_keywords,
+        get_top_keywords(limit, db_path),
+        lambda keyword: has_keyword(keyword, db_path),
+        token_budget,
+        limit
+    )
+    logging.info(f"Selected {len(keywords)} keyword hints using {tokens} of {token_budget} tokens")
+    return keywords
+
+def parse_analysis(analysis):
+    """
+    Extract the memory described by an analyzer reply.
+
+    Returns:
+        tuple: (title, content, keywords), or None if there is nothing to learn.
+    """
+    try:
+        analysis_data = json.loads(analysis)
+        keywords = analysis_data.get("keywords", [])
+        content = analysis_data.get("content")
+        title = analysis_data.get("title")
+
+        if content:
+            return title, content, keywords
+
+    except json.JSONDecodeError:
+        logging.error("Failed to decode JSON from analysis.")
+    return None
+
+def handle_analyze_jobs(payloads):
+    """
+    Run a batch of analyze jobs: ask the analyzer about each prompt concurrently,
+    then store all resulting memories in one batch.
+
+    Args:
+        payloads (list): Job payloads, each with the user's "prompt" and the
+            "db_path" of the tenant's database (memories.db if missing).
+
+    Returns:
+        list: One result per job, with "memory_added" and "memory_id", or an
+        exception for jobs whose analyzer call failed and should be retried.
+    """
+    db_paths = [payload.get("db_path", "memories.db") for payload in payloads]
+    analyses = list(pipeline_executor.map(analyze_input, [payload["prompt"] for payload in payloads], db_paths))
+
+    results = [None] * len(payloads)
+    # Memories to store per database, with the position of their job
+    batches = {}
+    for i, analysis in enumerate(analyses):
+        if analysis is None:
+            results[i] = RuntimeError("Analyzer call failed")
+            continue
+        memory = parse_analysis(analysis)
+        if memory is None:
+            results[i] = {"memory_added": False, "memory_id": None}
+        else:
+            logging.info("Adding information to DB")
+            batches.setdefault(db_paths[i], []).append((i, memory))
+
+    for db_path, batch in batches.items():
+        with span("memory_write"):
+            memory_ids = add_memories_batch([memory for _, memory in batch], db_path)
+        for (i, _), memory_id in zip(batch, memory_ids):
+            results[i] = {"memory_added": memory_id is not None, "memory_id": memory_id}
+    return results
+
+def answer_input(prompt, k=5, min_score=None, db_path="memories.db"):
+    """
+    Answer the user's input using the most similar memories as context.
+    Answers to near-identical earlier prompts are served from the answer cache,
+    before searching for context.
+
+    Returns:
+        str: The assistant's response.
+    """
+    lexical = is_lexical_prompt(prompt, db_path)
+    prompt_embedding = answer_cache_embedding(prompt, lexical)
+    if prompt_embedding is not None:
+        cached = lookup_answer(prompt_embedding, k, min_score, db_path)
+        if cached is not None:
+            logging.info("Answering from the answer cache")
+            return cached
+
+    candidates = search_context_candidates(prompt, k, min_score, db_path, lexical)
+    system_prompt, memory_ids = build_answer_prompt(prompt, candidates, k, min_score, prompt_embedding, db_path, lexical)
+    with span("assistant_call"):
+        answer = send_question_to_openai(system_prompt, prompt)
+    if prompt_embedding is not None:
+        store_answer(prompt_embedding, memory_ids, answer, k, min_score, db_path)
+    return answer
+
+def is_lexical_prompt(prompt, db_path="memories.db"):
+    """
+    Return whether a prompt is answered from the lexical index alone, so answering
+    it needs no prompt embedding: with SEARCH_MODE=lexical, or in hybrid mode when
+    the prompt is exactly a memory title or a keyword.
+    """
+    mode = os.getenv('SEARCH_MODE', 'hybrid')
+    return mode == 'lexical' or (mode == 'hybrid' and is_exact_lexical_match(prompt, db_path))
+
+def answer_cache_embedding(prompt, lexical=False):
+    """
+    Return the prompt embedding to look up and store answers with, or None when the
+    answer cache is disabled or the prompt is answered lexically, which skips the
+    embeddings API and so the answer cache.
+    """
+    if not answer_cache_enabled() or lexical:
+        return None
+    return get_embedding(prompt)
+
+def search_context_candidates(prompt, k=5, min_score=None, db_path="memories.db", lexical=False):
+    """
+    Search the candidates for the assistant's context, k times CONTEXT_CANDIDATES (default 2) of them.
+    Lexical prompts, see is_lexical_prompt, are only searched in the lexical index.
+
+    Returns:
+        list: The search results, best first.
+    """
     logging.info("Searching for similar entries")
-    similar_entries = search_similar_entries(prompt)
-    logging.info(f"Found {len(similar_entries)} similar entries")
+    with span("search"):
+        candidates = search_similar_entries(prompt, k * int(os.getenv('CONTEXT_CANDIDATES', '2')), min_score, db_path,
+                                            mode='lexical' if lexical else None)
+    logging.info(f"Found {len(candidates)} similar entries")
+    return candidates
+
+def build_answer_prompt(prompt, candidates, k=5, min_score=None, prompt_embedding=None, db_path="memories.db", lexical=False):
+    """
+    Build the assistant's system prompt, with the memories most relevant to the input as context.
+
+    pack_context keeps up to k relevant, non-duplicate candidates within the context
+    token budget. The candidates of lexical prompts are packed in BM25 order by
+    pack_lexical_context instead, without embedding the prompt.
+
+    Returns:
+        tuple: (system_prompt, memory_ids) where memory_ids are the memories used as context.
+    """
+    if not candidates:
+        # If no similar entries are found, proceed with the user's prompt
+        logging.info("Context tokens: 0")
+        return get_prompt("asistant"), []
+
+    with span("context_packing"):
+        if lexical:
+            similar_entries, context_tokens = pack_lexical_context(candidates, k)
+        else:
+            if prompt_embedding is None:
+                prompt_embedding = get_embedding(prompt)
+            embeddings = get_embeddings_by_ids([item['id'] for item in candidates], db_path)
+            similar_entries, context_tokens = pack_context(candidates, prompt_embedding, embeddings, k, min_score=min_score)
+    logging.info(f"Context tokens: {context_tokens} ({len(similar_entries)} of {len(candidates)} entries)")
 
     if similar_entries:
         logging.info("Gathering similar entries")
         combined_content = ' '.join(item['content'] for item in similar_entries)
-        system_prompt = f"{get_prompt('asistant')}<context>{combined_content}</context>"
-        assistant_response = send_question_to_openai(system_prompt, prompt)
-    else:
-        # If no similar entries are found, proceed with the user's prompt
-        assistant_response = send_question_to_openai(get_prompt("asistant"), prompt)
+        return f"{get_prompt('asistant')}<context>{combined_content}</context>", [item['id'] for item in similar_entries]
+    return get_prompt("asistant"), []
 
-    return assistant_response, memory_added
-
-def sanitize_id(s):
-    """
-    Sanitize a string to be used as an ID by:
-    - Converting to lowercase.
-    - Replacing non-alphanumeric characters with underscores.
-    - Removing leading digits.
-    - Ensuring the ID is not empty.
+def process_input(prompt, k=5, min_score=None, db_path="memories.db"):
     """
-    try:
-        s = s.lower().strip()
-        s = re.sub(r'\W+', '_', s)  # Replace non-word characters with '_'
-        s = re.sub(r'^_+', '', s)   # Remove leading underscores
-        s = re.sub(r'^(\d)', r'_\1', s)  # Prefix leading digits with '_'
-        if not s:
-            s = 'id_' + str(uuid.uuid4()).replace('-', '')  # Generate a random ID if empty
-        return s
-    except Exception as e:
-        app.logger.error(f"Error sanitizing ID for string '{s}': {e}", exc_info=True)
-        # Return a fallback ID
-        return 'id_' + str(uuid.uuid4()).replace('-', '')
+    Process user input by searching for similar entries and generating a response.
+
+    Analyzing the input and updating the database and FAISS index is a side effect
+    the response does not need, so it is queued as an analyze job for the background
+    workers instead of being waited on.
+
+    Args:
+        prompt (str): The user's input.
+        k (int): The number of similar entries to use as context.
+        min_score (float, optional): The minimum similarity of entries used as context.
+        db_path (str): The path to the tenant's SQLite database file.
 
+    Returns:
+        tuple: (assistant_response, job_id) where job_id identifies the analyze job.
+    """
+    logging.info("Processing input")
+    with span("process_input"):
+        with span("enqueue_job"):
+            job_id = enqueue_job("analyze", {"prompt": prompt, "db_path": db_path})
+        assistant_response = answer_input(prompt, k, min_score, db_path)
+    return assistant_response, job_id
 
 # Route to serve the main page
 @app.route('/')
@@ -306,81 +1300,308 @@ def chat():
     """
     Handle incoming chat messages and return the assistant's response.
     """
-    data = request.get_json()
+    # Validate the request before creating a new tenant's store for it
+    try:
+        prompt, k, min_score = parse_chat_request(request.get_json(silent=True))
+        db_path = request_db_path(create=True)
+    except ValueError as e:
+        return jsonify({"response": str(e)}), 400
+    logging.info("User input: " + prompt)
+    response, job_id = process_input(prompt, k, min_score, db_path)
+    logging.info("Chat output: " + str(response))
+    return jsonify({"response": response, "graph_updated": "pending", "job_id": job_id})
+
+# Route to stream the assistant's response as Server-Sent Events
+@app.route('/chat/stream', methods=['POST'])
+def chat_stream():
+    """
+    Handle an incoming chat message and stream the assistant's response.
+
+    Each piece of the response is sent as a message event with a JSON "token".
+    A final "done" event carries graph_updated and the id of the analyze job, or an
+    "error" event with a JSON "error" message ends the stream when answering failed.
+    """
+    # Validate the request before creating a new tenant's store for it
+    try:
+        prompt, k, min_score = parse_chat_request(request.get_json(silent=True))
+        db_path = request_db_path(create=True)
+    except ValueError as e:
+        return jsonify({"response": str(e)}), 400
+    logging.info("User input: " + prompt)
+    job_id = enqueue_job("analyze", {"prompt": prompt, "db_path": db_path})
+    lexical = is_lexical_prompt(prompt, db_path)
+    prompt_embedding = answer_cache_embedding(prompt, lexical)
+    cached = lookup_answer(prompt_embedding, k, min_score, db_path) if prompt_embedding is not None else None
+
+    def generate():
+        if cached is not None:
+            logging.info("Answering from the answer cache")
+            yield f"data: {json.dumps({'token': cached})}\n\n"
+            answer = cached
+        else:
+            parts = []
+            try:
+                candidates = search_context_candidates(prompt, k, min_score, db_path, lexical)
+                system_prompt, memory_ids = build_answer_prompt(prompt, candidates, k, min_score, prompt_embedding, db_path, lexical)
+                with span("assistant_stream"):
+                    for token in stream_question_to_openai(system_prompt, prompt):
+                        parts.append(token)
+                        yield f"data: {json.dumps({'token': token})}\n\n"
+            except Exception as e:
+                # The status line is already sent, so report the failure in the stream
+                logging.error(f"Streaming the answer failed: {e}", exc_info=True)
+                yield f"event: error\ndata: {json.dumps({'error': 'The assistant could not answer, please try again.'})}\n\n"
+                return
+            answer = ''.join(parts)
+            if prompt_embedding is not None:
+                store_answer(prompt_embedding, memory_ids, answer, k, min_score, db_path)
+        logging.info("Chat output: " + answer)
+        yield f"event: done\ndata: {json.dumps({'graph_updated': 'pending', 'job_id': job_id})}\n\n"
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+def request_db_path(create=False):
+    """
+    Return the database of the tenant named by the request's X-Tenant-ID header or
+    tenant parameter, in the query string or JSON body. Requests without one use
+    memories.db. Only write paths pass create, to create a new tenant's database.
+
+    Raises:
+        ValueError: If the tenant id is invalid, or the tenant does not exist and is not created.
+    """
+    tenant = request.headers.get('X-Tenant-ID') or request.args.get('tenant')
+    if not tenant and request.is_json:
+        data = request.get_json(silent=True)
+        tenant = data.get('tenant') if isinstance(data, dict) else None
+    return tenant_db_path(tenant, create)
+
+def parse_chat_request(data):
+    """
+    Read the prompt, k and min_score of a chat request.
+
+    Returns:
+        tuple: (prompt, k, min_score).
+
+    Raises:
+        ValueError: If the body is not a JSON object, the prompt is not a non-empty
+            string, k or min_score is not a number, or k is not between 1 and MAX_K
+            (default 50). The message is the response to send.
+    """
+    if not isinstance(data, dict):
+        raise ValueError("Invalid input")
     prompt = data.get("prompt")
-    if prompt:
-        logging.info("User input: " + prompt)
-        response, memory_added = process_input(prompt)
-        logging.info("Chat output: " + response)
-        return jsonify({"response": response, "graph_updated": memory_added})
-    return jsonify({"response": "Invalid input"}), 400
+    if not isinstance(prompt, str) or not prompt.strip():
+        raise ValueError("Invalid input")
+    try:
+        k = int(data.get("k", 5))
+        min_score = float(data["min_score"]) if data.get("min_score") is not None else None
+    except (TypeError, ValueError):
+        raise ValueError("Invalid k or min_score")
+    if k <= 0:
+        raise ValueError("Invalid input")
+    # k sizes the FAISS and FTS5 searches and the batched row lookup, so it is bounded
+    max_k = int(os.getenv('MAX_K', '50'))
+    if k > max_k:
+        raise ValueError(f"k is above {max_k}")
+    return prompt, k, min_score
+
+# Route to report the embedding and answer cache counters
+@app.route('/cache-stats', methods=['GET'])
+def cache_stats():
+    """
+    Return the hit and miss counters of the embedding and answer caches.
+    """
+    return jsonify({"embeddings": get_cache_stats(), "answers": get_answer_cache_stats()})
+
+# Route to expose metrics to Prometheus
+@app.route('/metrics', methods=['GET'])
+def metrics_route():
+    """
+    Return the stage timings, counters and index sizes in the Prometheus text format.
+    """
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+def collect_metrics():
+    """
+    Report the index sizes and cache counters, read when /metrics is scraped.
+
+    Returns:
+        list: (name, labels, value) samples, see metrics.register_collector.
+    """
+    with stores_lock:
+        loaded = list(stores.values())
+    embedding_stats = get_cache_stats()
+    answer_stats = get_answer_cache_stats()
+    return [
+        ("memorymaker_index_vectors", {}, sum(store["index"].ntotal for store in loaded if store["index"] is not None)),
+        ("memorymaker_loaded_stores", {}, len(loaded)),
+        ("memorymaker_embedding_cache_hits_total", {"tier": "memory"}, embedding_stats["memory_hits"]),
+        ("memorymaker_embedding_cache_hits_total", {"tier": "disk"}, embedding_stats["disk_hits"]),
+        ("memorymaker_embedding_cache_misses_total", {}, embedding_stats["misses"]),
+        ("memorymaker_answer_cache_hits_total", {}, answer_stats["hits"]),
+        ("memorymaker_answer_cache_misses_total", {}, answer_stats["misses"]),
+        ("memorymaker_answer_cache_entries", {}, answer_stats["entries"]),
+    ]
+
+# Route to report the progress of a background job
+@app.route('/jobs/<int:job_id>', methods=['GET'])
+def job_status(job_id):
+    """
+    Return the status of a background job: pending, running, done or failed.
+    Jobs queued for another tenant are reported as not found.
+    """
+    try:
+        db_path = request_db_path()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    job = get_job(job_id, owner=db_path)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job)
+
+# Route to update a memory in place
+@app.route('/memories/<int:memory_id>', methods=['PUT'])
+def update_memory_route(memory_id):
+    """
+    Update the title, content or keywords of a memory.
+    """
+    try:
+        db_path = request_db_path()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    data = request.get_json(silent=True) or {}
+    if not isinstance(data, dict):
+        return jsonify({"error": "Expected a JSON object"}), 400
+    for field in ("title", "content"):
+        if data.get(field) is not None and not isinstance(data[field], str):
+            return jsonify({"error": f"{field} must be a string"}), 400
+    keywords = data.get("keywords")
+    if isinstance(keywords, str):
+        keywords = [keyword.strip() for keyword in keywords.split(',') if keyword.strip()]
+    elif keywords is not None and not (isinstance(keywords, list) and all(isinstance(keyword, str) for keyword in keywords)):
+        return jsonify({"error": "keywords must be a string or a list of strings"}), 400
+    updated = update_memory(memory_id, data.get("title"), data.get("content"), keywords, db_path)
+    if updated is None:
+        return jsonify({"error": "Memory not found"}), 404
+    if not updated:
+        return jsonify({"error": "Memory could not be updated"}), 409
+    return jsonify({"updated": True})
+
+# Route to delete a memory
+@app.route('/memories/<int:memory_id>', methods=['DELETE'])
+def delete_memory_route(memory_id):
+    """
+    Delete a memory and its vector.
+    """
+    try:
+        db_path = request_db_path()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if not delete_memory(memory_id, db_path):
+        return jsonify({"error": "Memory not found"}), 404
+    return jsonify({"deleted": True})
+
+# Route to bulk-import memories
+@app.route('/memories/import', methods=['POST'])
+def import_memories_route():
+    """
+    Import memories from the request body and stream progress as JSON lines.
+
+    Query parameters: format (jsonl, csv or text, default jsonl), name (title prefix
+    for text chunks), batch_size (default 1000) and chunk_tokens (default 300).
+    """
+    lines = io.TextIOWrapper(request.stream, encoding='utf-8', newline='')
+    try:
+        records = iter_records(
+            lines,
+            request.args.get('format', 'jsonl'),
+            request.args.get('name', 'document'),
+            request.args.get('chunk_tokens', type=int, default=300)
+        )
+        db_path = request_db_path(create=True)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    batch_size = request.args.get('batch_size', type=int, default=1000)
+
+    def generate():
+        add_batch = lambda entries, embeddings: add_memories_batch(entries, db_path, embeddings=embeddings)
+        try:
+            for progress in import_records(records, add_batch, batch_size):
+                logging.info(f"Import progress: {progress}")
+                yield json.dumps(progress) + "\n"
+        except Exception as e:
+            # The status line is already sent, so report the failure in the stream
+            logging.error(f"Import failed: {e}", exc_info=True)
+            yield json.dumps({"error": f"Import failed: {e}"}) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+# Route to bulk-export memories
+@app.route('/memories/export', methods=['GET'])
+def export_memories_route():
+    """
+    Stream every memory as JSON lines, with its embedding unless embeddings=0.
+    """
+    try:
+        db_path = request_db_path()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    include_embeddings = request.args.get('embeddings', '1') != '0'
+    return Response(export_records(db_path, include_embeddings), mimetype='application/x-ndjson')
 
 
 @app.route('/graph-data', methods=['GET'])
 def graph_data():
-    logging.info("Graph retrieval started")
-    rows = get_graph_info()
-    logging.info("Db returned: " + str(len(rows)) + " rows, for graph")
-    try:
-        nodes = []
-        edges = []
-        keyword_set = set()
+    """
+    Return the memory graph from the cached graph model.
 
-        for row in rows:
-            title = row[0]
-            keywords_str = row[1]
+    Without parameters the whole graph is returned as a list of elements, with its
+    version in the X-Graph-Version header. Parameters select part of it instead:
+    - since=<version>: only elements added after that version, with "reset" set when
+      the version is too old and the whole graph is returned.
+    - node=<id>&hops=<n>: a node and everything within n hops (default 1).
+    - offset=<n>&limit=<n>: a page of notes with their keywords and edges.
+    The tenant is chosen like for /chat, with the X-Tenant-ID header or tenant parameter.
+    """
+    try:
+        db_path = request_db_path()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    with span("graph_data"):
+        try:
+            if 'since' in request.args:
+                version, reset, elements = get_graph_delta(request.args.get('since', type=int, default=0), db_path)
+                return jsonify({"version": version, "reset": reset, "elements": elements})
+            if 'node' in request.args:
+                version, elements = get_graph_neighbourhood(request.args['node'], request.args.get('hops', type=int, default=1), db_path)
+                return jsonify({"version": version, "elements": elements})
+            if 'limit' in request.args or 'offset' in request.args:
+                version, total, elements = get_graph_page(
+                    request.args.get('offset', type=int, default=0),
+                    request.args.get('limit', type=int, default=100),
+                    db_path
+                )
+                return jsonify({"version": version, "total_notes": total, "elements": elements})
 
-            # Ensure title is not empty
-            if title and title.strip():
-                note_label = title.strip()
-            else:
-                note_label = 'untitled'
-
-            # Normalize and sanitize the note title for ID
-            note_id = f"note_{sanitize_id(note_label)}"
-            app.logger.info(f"Creating note node with ID: {note_id}, Label: {note_label}")
-
-            # Add note node
-            nodes.append({
-                'data': {'id': note_id, 'label': note_label, 'type': 'note'}
-            })
-
-            # Check if keywords_str is not None or empty
-            if keywords_str:
-                # Split the comma-separated string into a list and normalize keywords
-                keywords = [keyword.strip().lower() for keyword in keywords_str.split(',') if keyword.strip()]
-                app.logger.info(f"Title: {title}, Parsed Keywords: {keywords}")
-            else:
-                keywords = []
-                app.logger.info(f"Title: {title} has no keywords.")
-
-            # Add keyword nodes and edges
-            for keyword in keywords:
-                keyword_normalized = keyword.lower()
-                keyword_id = f"keyword_{sanitize_id(keyword_normalized)}"
-                keyword_label = keyword.title()
-                app.logger.info(f"Creating keyword node with ID: {keyword_id}, Label: {keyword_label}")
-
-                if keyword_normalized not in keyword_set:
-                    nodes.append({
-                        'data': {'id': keyword_id, 'label': keyword_label, 'type': 'keyword'}
-                    })
-                    keyword_set.add(keyword_normalized)
-
-                edge_id = f"edge_{note_id}_{keyword_id}"
-                edges.append({
-                    'data': {'id': edge_id, 'source': note_id, 'target': keyword_id}
-                })
-                app.logger.info(f"Creating edge with ID: {edge_id}, Source: {note_id}, Target: {keyword_id}")
-
-        app.logger.info(f"Total nodes: {len(nodes)}, Total edges: {len(edges)}")
-        return jsonify(nodes + edges)
-    except Exception as e:
-        app.logger.error(f"An error occurred in /graph-data: {e}", exc_info=True)
-        return jsonify({'error': 'An error occurred while fetching graph data'}), 500
+            version, elements = get_graph_elements(db_path)
+            app.logger.debug(f"Returning graph version {version} with {len(elements)} elements")
+            response = jsonify(elements)
+            response.headers['X-Graph-Version'] = str(version)
+            return response
+        except Exception as e:
+            app.logger.error(f"An error occurred in /graph-data: {e}", exc_info=True)
+            return jsonify({'error': 'An error occurred while fetching graph data'}), 500
        
         
 if __name__ == '__main__':
     setup_logger()
-    main()
-    app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
+    debug = True
+    # The debug reloader runs this module in a watching parent and a serving child,
+    # only the child serves requests, so only it loads the index and runs job workers
+    if not debug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        main()
+    app.run(host='0.0.0.0', port=5000, debug=debug)
\ No newline at end of file
@@ -0,0 +1,144 @@
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+
+# Upper bounds of the histogram buckets, in seconds
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Type and help text of every metric, in the order they are rendered
+_metrics = {
+    "memorymaker_stage_seconds": ("histogram", "Time spent in each stage of request handling and startup."),
+    "memorymaker_openai_requests_total": ("counter", "Requests sent to the OpenAI API, by endpoint."),
+    "memorymaker_openai_tokens_total": ("counter", "Tokens used by OpenAI API requests, by endpoint and kind."),
+    "memorymaker_index_vectors": ("gauge", "Vectors in the loaded FAISS indexes."),
+    "memorymaker_loaded_stores": ("gauge", "FAISS indexes currently loaded."),
+    "memorymaker_embedding_cache_hits_total": ("counter", "Embedding cache hits, by tier."),
+    "memorymaker_embedding_cache_misses_total": ("counter", "Embedding cache misses."),
+    "memorymaker_answer_cache_hits_total": ("counter", "Answers served from the answer cache."),
+    "memorymaker_answer_cache_misses_total": ("counter", "Answer cache lookups that missed."),
+    "memorymaker_answer_cache_entries": ("gauge", "Answers held in the answer cache."),
+}
+# Histograms: (name, labels) -> [bucket counts, sum, count]
+_histograms = {}
+# Counters: (name, labels) -> value
+_counters = {}
+# Called at scrape time, each returning (name, labels, value) samples of current state
+_collectors = []
+_lock = threading.Lock()
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+def observe_duration(stage, seconds):
+    """
+    Record how long a stage took in the stage histogram.
+
+    Args:
+        stage (str): The stage name, used as the "stage" label.
+        seconds (float): The duration.
+    """
+    key = _key("memorymaker_stage_seconds", {"stage": stage})
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = [[0] * len(BUCKETS), 0.0, 0]
+        index = bisect.bisect_left(BUCKETS, seconds)
+        if index < len(BUCKETS):
+            histogram[0][index] += 1
+        histogram[1] += seconds
+        histogram[2] += 1
+
+@contextmanager
+def span(stage):
+    """
+    Time the enclosed block as a stage, also when it raises.
+
+        with span("faiss_search"):
+            ...
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_duration(stage, time.perf_counter() - start)
+
+def increment(name, value=1, **labels):
+    """
+    Add to a counter.
+
+    Args:
+        name (str): The counter, one of the names in _metrics.
+        value (float): The amount to add.
+        **labels: The counter's labels.
+    """
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+def record_usage(endpoint, usage):
+    """
+    Count an OpenAI request and the tokens its response reports.
+
+    Args:
+        endpoint (str): "chat" or "embeddings".
+        usage: The response's usage object, or None when it was not reported.
+    """
+    increment("memorymaker_openai_requests_total", endpoint=endpoint)
+    if usage is None:
+        return
+    for kind in ("prompt_tokens", "completion_tokens"):
+        tokens = getattr(usage, kind, None)
+        if tokens:
+            increment("memorymaker_openai_tokens_total", tokens, endpoint=endpoint, kind=kind.split('_')[0])
+
+def register_collector(collector):
+    """
+    Register a function reporting current state at scrape time, such as index sizes.
+
+    Args:
+        collector (callable): Returns a list of (name, labels, value) samples.
+    """
+    _collectors.append(collector)
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in labels) + "}"
+
+def render_metrics():
+    """
+    Render every metric in the Prometheus text exposition format.
+
+    Returns:
+        str: The metrics page.
+    """
+    samples = {}
+    for collector in _collectors:
+        for name, labels, value in collector():
+            samples.setdefault(name, []).append((tuple(sorted(labels.items())), value))
+    with _lock:
+        for (name, labels), value in _counters.items():
+            samples.setdefault(name, []).append((labels, value))
+        histograms = [(key, (list(counts), total, count)) for key, (counts, total, count) in _histograms.items()]
+
+    lines = []
+    for name, (kind, help_text) in _metrics.items():
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        if kind == "histogram":
+            for (histogram_name, labels), (counts, total, count) in histograms:
+                if histogram_name != name:
+                    continue
+                cumulative = 0
+                for bound, bucket_count in zip(BUCKETS, counts):
+                    cumulative += bucket_count
+                    lines.append(f"{name}_bucket{_format_labels(labels + (('le', str(bound)),))} {cumulative}")
+                lines.append(f"{name}_bucket{_format_labels(labels + (('le', '+Inf'),))} {count}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {total}")
+                lines.append(f"{name}_count{_format_labels(labels)} {count}")
+        else:
+            for labels, value in samples.get(name, []):
+                lines.append(f"{name}{_format_labels(labels)} {value}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,66 @@
+import os
+import re
+import threading
+from collections import OrderedDict
+
+from database import initialize_db
+
+DEFAULT_DB_PATH = "memories.db"
+# Tenant ids become file names, so only letters, digits, '_' and '-' are allowed
+_tenant_pattern = re.compile(r'[A-Za-z0-9_-]{1,64}')
+# Tenant databases initialized by this process, least recently used first. At most
+# MAX_LOADED_STORES are remembered, others are initialized again on their next use
+_initialized = OrderedDict()
+_lock = threading.Lock()
+
+
+def tenant_path(tenant=None):
+    """
+    Return the path of a tenant's SQLite database without opening or creating it.
+
+    Raises:
+        ValueError: If the tenant id is not 1 to 64 letters, digits, '_' or '-'.
+    """
+    if not tenant:
+        return DEFAULT_DB_PATH
+    if not _tenant_pattern.fullmatch(tenant):
+        raise ValueError(f"Invalid tenant id: {tenant!r}")
+    return os.path.join(os.getenv("TENANT_DIR", "tenants"), f"{tenant}.db")
+
+def tenant_db_path(tenant=None, create=False):
+    """
+    Return the path of a tenant's SQLite database.
+
+    Each tenant has its own database file in TENANT_DIR (default "tenants"), next
+    to which its FAISS snapshot is kept. Without a tenant the default memories.db
+    is used. A missing database is only created when create is set, and then only
+    for tenants in TENANT_ALLOWLIST when that comma-separated list is set, so reads
+    naming unknown tenants do not leave files behind.
+
+    Args:
+        tenant (str, optional): The tenant id.
+        create (bool): Whether to create the tenant's database if it does not exist.
+
+    Returns:
+        str: The path to the tenant's SQLite database file.
+
+    Raises:
+        ValueError: If the tenant id is not 1 to 64 letters, digits, '_' or '-', or
+            the tenant does not exist and may not be created.
+    """
+    db_path = tenant_path(tenant)
+    if not tenant:
+        return db_path
+    with _lock:
+        if db_path not in _initialized:
+            if not os.path.exists(db_path):
+                allowlist = os.getenv("TENANT_ALLOWLIST")
+                if not create or (allowlist and tenant not in allowlist.split(',')):
+                    raise ValueError(f"Unknown tenant: {tenant!r}")
+                os.makedirs(os.path.dirname(db_path), exist_ok=True)
+            initialize_db(db_path)
+            _initialized[db_path] = True
+        _initialized.move_to_end(db_path)
+        while len(_initialized) > int(os.getenv('MAX_LOADED_STORES', '64')):
+            _initialized.popitem(last=False)
+    return db_path
@@ -0,0 +1,108 @@
+"""
+Bulk import parsers and batching.
+
+    python -m pytest tests
+"""
+import io
+import unittest
+from unittest import mock
+
+from bulk import iter_jsonl, iter_csv, iter_text_chunks, iter_records, import_records
+
+
+def _words(text):
+    # One token per word, so chunk sizes do not depend on tiktoken being installed
+    return len(text.split())
+
+
+class ParserTest(unittest.TestCase):
+    def test_jsonl_records_and_errors(self):
+        lines = [
+            '{"title": "A", "content": "first", "keywords": ["x", "y"], "embedding": [0.5, 1]}\n',
+            '\n',
+            '{"title": "B", "content": "second", "keywords": "x, z,"}\n',
+            'not json\n',
+            '[1, 2]\n',
+            '{"title": 5, "content": "third"}\n',
+            '{"content": "fourth", "embedding": ["a"]}\n',
+        ]
+        records = list(iter_jsonl(lines))
+
+        self.assertEqual(records[0], {"title": "A", "content": "first", "keywords": ["x", "y"],
+                                      "embedding": [0.5, 1], "line": 1})
+        self.assertEqual(records[1]["keywords"], ["x", "z"])
+        self.assertEqual(records[1]["line"], 3)
+        self.assertEqual([record["line"] for record in records[2:]], [4, 5, 6, 7])
+        self.assertTrue(all("error" in record for record in records[2:]))
+        self.assertIn("title must be a string", records[4]["error"])
+
+    def test_csv_records(self):
+        text = 'title,content,keywords\nA,"first, with a comma","x,y"\nB,second,\n'
+        records = list(iter_csv(io.StringIO(text, newline='')))
+
+        self.assertEqual([(r["title"], r["content"], r["keywords"], r["line"]) for r in records], [
+            ("A", "first, with a comma", ["x", "y"], 2),
+            ("B", "second", [], 3),
+        ])
+
+    def test_unknown_format(self):
+        with self.assertRaises(ValueError):
+            iter_records([], "xml")
+
+
+@mock.patch("bulk.count_tokens", _words)
+class TextChunkTest(unittest.TestCase):
+    def test_paragraphs_are_packed_into_chunks(self):
+        lines = ["one two\n", "three\n", "\n", "four five\n", "\n", "\n", "six seven eight\n"]
+        records = list(iter_text_chunks(lines, "notes", chunk_tokens=5))
+
+        self.assertEqual([record["content"] for record in records], ["one two three\n\nfour five", "six seven eight"])
+        self.assertEqual([record["title"].rsplit('-', 1)[0] for record in records], ["notes-1", "notes-2"])
+
+    def test_long_paragraphs_are_split_on_words(self):
+        records = list(iter_text_chunks(["a b c d e f g\n"], "notes", chunk_tokens=3))
+        self.assertEqual([record["content"] for record in records], ["a b c", "d e f", "g"])
+
+    def test_titles_depend_on_content(self):
+        first = list(iter_text_chunks(["same text\n"], "notes"))
+        again = list(iter_text_chunks(["same text\n"], "notes"))
+        other = list(iter_text_chunks(["other text\n"], "notes"))
+
+        self.assertEqual(first[0]["title"], again[0]["title"])
+        self.assertNotEqual(first[0]["title"], other[0]["title"])
+        self.assertTrue(other[0]["title"].startswith("notes-1-"))
+
+
+class ImportRecordsTest(unittest.TestCase):
+    def test_batches_progress_and_errors(self):
+        batches = []
+
+        def add_batch(entries, embeddings):
+            batches.append((entries, embeddings))
+            # The second entry of each batch is a duplicate
+            return [i if i % 2 == 0 else None for i in range(len(entries))]
+
+        records = [
+            {"title": "A", "content": "a", "keywords": [], "embedding": [1.0], "line": 1},
+            {"line": 2, "error": "bad"},
+            {"title": "B", "content": "b", "keywords": ["k"], "embedding": None, "line": 3},
+            {"title": "C", "content": "", "keywords": [], "embedding": None, "line": 4},
+            {"title": "D", "content": "d", "keywords": [], "embedding": None, "line": 5},
+        ]
+        progress = list(import_records(records, add_batch, batch_size=2))
+
+        self.assertEqual(batches[0], ([("A", "a", []), ("B", "b", ["k"])], [[1.0], None]))
+        self.assertEqual(batches[1], ([("D", "d", [])], [None]))
+        self.assertEqual(len(progress), 2)
+        self.assertEqual(progress[0]["errors_in_batch"], [{"line": 2, "error": "bad"}])
+        self.assertNotIn("errors_in_batch", progress[1])
+        last = progress[-1]
+        self.assertEqual((last["imported"], last["skipped"], last["errors"]), (2, 2, 1))
+
+    def test_errors_alone_are_reported(self):
+        progress = list(import_records([{"line": 1, "error": "bad"}], lambda entries, embeddings: []))
+        self.assertEqual(progress[0]["errors"], 1)
+        self.assertEqual(progress[0]["errors_in_batch"], [{"line": 1, "error": "bad"}])
+
+if __name__ == "__main__":
+    unittest.main()
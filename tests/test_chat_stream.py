@@ -0,0 +1,97 @@
+"""
+POST /chat/stream against the local fake OpenAI server.
+
+    python -m pytest tests
+"""
+import os
+import json
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import httpx
+import openai
+from openai.resources.chat.completions import Completions
+
+import main as app_main
+from database import initialize_db, close_connections
+from job_queue import initialize_job_queue
+from benchmarks import fake_openai
+
+
+def _events(response):
+    """
+    Parse a Server-Sent Events body into (event, data) pairs.
+    """
+    events = []
+    for message in response.get_data(as_text=True).split("\n\n"):
+        event, data = "message", ""
+        for line in message.split("\n"):
+            if line.startswith("event: "):
+                event = line[len("event: "):]
+            elif line.startswith("data: "):
+                data += line[len("data: "):]
+        if data:
+            events.append((event, json.loads(data)))
+    return events
+
+
+class ChatStreamTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = fake_openai.start_fake_server()
+        cls.base_url = f"http://127.0.0.1:{cls.server.server_port}/v1/"
+        openai.api_key = "fake"
+        openai.base_url = cls.base_url
+        cls.env = mock.patch.dict(os.environ, {
+            "EMBEDDING_CACHE_DB": "", "EMBEDDING_DIMENSIONS": "", "ANSWER_CACHE_SIZE": "0"
+        })
+        cls.env.start()
+        # The app keeps memories.db and its snapshot in the working directory
+        cls.cwd = os.getcwd()
+        cls.workdir = tempfile.mkdtemp()
+        os.chdir(cls.workdir)
+        initialize_db()
+        initialize_job_queue()
+        cls.client = app_main.app.test_client()
+
+    @classmethod
+    def tearDownClass(cls):
+        close_connections()
+        os.chdir(cls.cwd)
+        shutil.rmtree(cls.workdir)
+        cls.env.stop()
+        cls.server.shutdown()
+
+    def test_streams_tokens_then_done(self):
+        response = self.client.post("/chat/stream", json={"prompt": "What is the capital of Poland?"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, "text/event-stream")
+        events = _events(response)
+
+        tokens = [data["token"] for event, data in events[:-1] if event == "message"]
+        self.assertEqual(len(tokens), len(events) - 1)
+        self.assertGreater(len(tokens), 1)
+        self.assertEqual(''.join(tokens), "Fake answer to: What is the capital of Poland?")
+        event, data = events[-1]
+        self.assertEqual(event, "done")
+        self.assertEqual(data["graph_updated"], "pending")
+        self.assertIsInstance(data["job_id"], int)
+
+    def test_upstream_failure_ends_with_an_error_event(self):
+        failure = openai.APIConnectionError(request=httpx.Request("POST", self.base_url + "chat/completions"))
+        with mock.patch.object(Completions, "create", side_effect=failure):
+            response = self.client.post("/chat/stream", json={"prompt": "Hello"})
+        events = _events(response)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([event for event, _ in events], ["error"])
+        self.assertTrue(events[0][1]["error"])
+
+    def test_invalid_request_is_rejected(self):
+        response = self.client.post("/chat/stream", json={"prompt": 5})
+        self.assertEqual(response.status_code, 400)
+
+if __name__ == "__main__":
+    unittest.main()
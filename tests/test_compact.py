@@ -0,0 +1,68 @@
+"""
+Compaction of near-duplicate memories, with fake neighbour search and consolidation.
+
+    python -m pytest tests
+"""
+import unittest
+
+import numpy as np
+
+from compact import compact_memories
+
+
+def _rows(ids, without_embedding=()):
+    # Each embedding holds its memory's id, so the fake search can look it up
+    return [(memory_id, f"title {memory_id}", f"content {memory_id}",
+             None if memory_id in without_embedding else np.array([memory_id], dtype='float32').tobytes())
+            for memory_id in ids]
+
+def _find_duplicates(neighbours):
+    def find(embeddings_np):
+        return [[(memory_id, 0.99) for memory_id in neighbours.get(int(embedding[0]), [])] + [(int(embedding[0]), 1.0)]
+                for embedding in embeddings_np]
+    return find
+
+
+class CompactTest(unittest.TestCase):
+    # 1, 3 and 4 are one cluster, 2 and 5 another, 6 is unique
+    neighbours = {1: [3, 4], 3: [1, 4], 4: [1, 3], 2: [5], 5: [2]}
+
+    def test_clusters_are_consolidated_into_their_oldest_memory(self):
+        calls = []
+
+        def consolidate(memory_id, duplicate_ids):
+            calls.append((memory_id, duplicate_ids))
+            return duplicate_ids
+
+        progress = list(compact_memories(_rows(range(1, 7)), _find_duplicates(self.neighbours), consolidate, batch_size=2))
+
+        self.assertEqual(calls, [(1, [3, 4]), (2, [5])])
+        last = progress[-1]
+        # 3, 4 and 5 were removed by the first batch, so they are never scanned
+        self.assertEqual((last["scanned"], last["clusters"], last["removed"]), (3, 2, 3))
+        self.assertNotIn("clusters_in_batch", last)
+
+    def test_duplicates_that_were_kept_are_not_counted_as_removed(self):
+        progress = list(compact_memories(_rows(range(1, 7)), _find_duplicates(self.neighbours),
+                                         lambda memory_id, duplicate_ids: duplicate_ids[:1], batch_size=10))
+        last = progress[-1]
+        # 4 was kept by the first cluster, and its neighbours are older or removed, so it starts none
+        self.assertEqual((last["clusters"], last["removed"]), (2, 2))
+
+    def test_dry_run_reports_clusters_per_batch(self):
+        progress = list(compact_memories(_rows(range(1, 7)), _find_duplicates(self.neighbours), None, batch_size=3))
+
+        self.assertEqual([batch["clusters_in_batch"] for batch in progress], [[[1, 3, 4], [2, 5]], []])
+        self.assertEqual((progress[-1]["clusters"], progress[-1]["removed"]), (2, 0))
+
+    def test_memories_without_embedding_are_skipped(self):
+        progress = list(compact_memories(_rows(range(1, 4), without_embedding={3}),
+                                         _find_duplicates({1: [2], 2: [1]}), None))
+        self.assertEqual(progress[-1]["scanned"], 2)
+        self.assertEqual(progress[-1]["clusters_in_batch"], [[1, 2]])
+
+    def test_no_memories(self):
+        self.assertEqual(list(compact_memories([], _find_duplicates({}), None)), [])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,61 @@
+"""
+Choosing answer context by relevance, diversity and token budget.
+
+    python -m pytest tests
+"""
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from context_packing import pack_context, pack_lexical_context
+
+
+def _unit(*values):
+    vector = np.array(values, dtype='float32')
+    return vector / np.linalg.norm(vector)
+
+def _words(text):
+    # One token per word, so budgets do not depend on tiktoken being installed
+    return len(text.split())
+
+
+@mock.patch("context_packing.count_tokens", _words)
+class PackContextTest(unittest.TestCase):
+    query = _unit(1, 0, 0)
+
+    def _pack(self, vectors, contents=None, **kwargs):
+        entries = [{"id": i, "content": (contents or {}).get(i, "a b")} for i in vectors]
+        embeddings = {i: vector.tobytes() for i, vector in vectors.items()}
+        kwargs.setdefault("token_budget", 100)
+        kwargs.setdefault("min_score", 0.25)
+        picked, tokens = pack_context(entries, self.query, embeddings, **kwargs)
+        return [entry["id"] for entry in picked], tokens
+
+    def test_picks_by_relevance_within_k(self):
+        vectors = {1: _unit(0.8, 0.6, 0), 2: _unit(1, 0, 0.1), 3: _unit(0.5, 0, 1)}
+        self.assertEqual(self._pack(vectors, k=2), ([2, 1], 4))
+
+    def test_drops_entries_below_min_score_or_without_embedding(self):
+        vectors = {1: _unit(1, 0, 0), 2: _unit(0, 1, 0)}
+        entries = [{"id": 3, "content": "no embedding"}]
+        self.assertEqual(self._pack(vectors, k=5), ([1], 2))
+        self.assertEqual(pack_context(entries, self.query, {}, 5, 100, 0.25), ([], 0))
+
+    def test_skips_near_duplicates_for_diverse_entries(self):
+        vectors = {1: _unit(1, 0.3, 0), 2: _unit(1, 0.3, 0.01), 3: _unit(1, -0.6, 0)}
+        self.assertEqual(self._pack(vectors, k=2)[0], [1, 3])
+
+    def test_keeps_to_the_token_budget(self):
+        vectors = {1: _unit(1, 0, 0), 2: _unit(1, 0.5, 0), 3: _unit(1, -0.5, 0)}
+        contents = {1: "a b c", 2: "a b c d e f", 3: "a b"}
+        self.assertEqual(self._pack(vectors, contents, k=3, token_budget=6), ([1, 3], 5))
+
+    def test_lexical_context_keeps_bm25_order_within_budget(self):
+        entries = [{"id": 1, "content": "a b c d"}, {"id": 2, "content": "a b c"},
+                   {"id": 3, "content": "a"}, {"id": 4, "content": "a"}]
+        picked, tokens = pack_lexical_context(entries, 2, token_budget=5)
+        self.assertEqual(([entry["id"] for entry in picked], tokens), ([1, 3], 5))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,85 @@
+"""
+Embedding batching and caching, against the local fake OpenAI server.
+
+    python -m pytest tests
+"""
+import os
+import uuid
+import unittest
+from unittest import mock
+from concurrent.futures import ThreadPoolExecutor
+
+import openai
+
+import main as app_main
+from embedding_batcher import start_batcher
+from embedding_cache import get_cache_stats
+from benchmarks import fake_openai
+
+
+def _texts(count):
+    # Fresh texts per test, so the in-memory cache never answers them
+    return [f"text {uuid.uuid4()}" for _ in range(count)]
+
+def _server_stats():
+    with fake_openai._stats_lock:
+        return dict(fake_openai.stats)
+
+
+class EmbeddingTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = fake_openai.start_fake_server()
+        openai.api_key = "fake"
+        openai.base_url = f"http://127.0.0.1:{cls.server.server_port}/v1/"
+        # The batcher thread reads its window once, when it starts
+        cls.env = mock.patch.dict(os.environ, {
+            "EMBEDDING_CACHE_DB": "", "EMBEDDING_DIMENSIONS": "", "EMBEDDING_BATCH_WINDOW_MS": "200"
+        })
+        cls.env.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.env.stop()
+        cls.server.shutdown()
+
+    def test_get_embeddings_splits_requests_by_batch_size(self):
+        texts = _texts(5)
+        before = _server_stats()
+        with mock.patch.dict(os.environ, {"EMBEDDING_BATCH_SIZE": "2"}):
+            embeddings = app_main.get_embeddings(texts + texts[:1])
+        after = _server_stats()
+
+        self.assertEqual(after["embedding_requests"] - before["embedding_requests"], 3)
+        self.assertEqual(after["embedding_inputs"] - before["embedding_inputs"], 5)
+        self.assertEqual(embeddings[:5], [fake_openai.fake_embedding(text) for text in texts])
+        self.assertEqual(embeddings[5], embeddings[0])
+
+    def test_get_embeddings_uses_the_cache(self):
+        texts = _texts(3)
+        app_main.get_embeddings(texts)
+        before = _server_stats()
+        app_main.get_embeddings(texts)
+        self.assertEqual(_server_stats()["embedding_requests"], before["embedding_requests"])
+
+    def test_single_miss_is_counted_once(self):
+        before = get_cache_stats()["misses"]
+        app_main.get_embedding(_texts(1)[0])
+        self.assertEqual(get_cache_stats()["misses"] - before, 1)
+
+    def test_batcher_merges_concurrent_requests(self):
+        start_batcher(app_main.fetch_embeddings)
+        texts = _texts(8)
+        before = _server_stats()
+        misses = get_cache_stats()["misses"]
+        with ThreadPoolExecutor(max_workers=len(texts)) as executor:
+            embeddings = list(executor.map(app_main.get_embedding, texts))
+        after = _server_stats()
+
+        self.assertEqual(after["embedding_requests"] - before["embedding_requests"], 1)
+        self.assertEqual(after["embedding_inputs"] - before["embedding_inputs"], len(texts))
+        self.assertEqual(get_cache_stats()["misses"] - misses, len(texts))
+        self.assertEqual(embeddings, [fake_openai.fake_embedding(text) for text in texts])
+
+if __name__ == "__main__":
+    unittest.main()
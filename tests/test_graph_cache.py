@@ -0,0 +1,113 @@
+"""
+Graph versions, deltas and resets.
+
+    python -m pytest tests
+"""
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from database import initialize_db, add_many_to_db, update_in_db, close_connections
+from graph_cache import (
+    get_graph_elements,
+    get_graph_delta,
+    get_graph_page,
+    get_graph_neighbourhood,
+    invalidate_graph,
+    release_graph
+)
+
+
+def _ids(elements):
+    return {element["data"]["id"] for element in elements}
+
+
+class GraphCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.workdir, "graph.db")
+        initialize_db(self.db_path)
+        add_many_to_db([("Warsaw", "Capital of Poland", ["poland", "city"], None)], self.db_path)
+
+    def tearDown(self):
+        release_graph(self.db_path)
+        close_connections()
+        shutil.rmtree(self.workdir)
+
+    def test_full_graph_lists_nodes_before_edges(self):
+        _, elements = get_graph_elements(self.db_path)
+        self.assertEqual(_ids(elements), {
+            "note_warsaw", "keyword_poland", "keyword_city",
+            "edge_note_warsaw_keyword_poland", "edge_note_warsaw_keyword_city"
+        })
+        kinds = ['source' in element["data"] for element in elements]
+        self.assertEqual(kinds, sorted(kinds))
+
+    def test_delta_holds_only_what_was_added(self):
+        version, _ = get_graph_elements(self.db_path)
+        self.assertEqual(get_graph_delta(version, self.db_path), (version, False, []))
+
+        add_many_to_db([("Krakow", "Old capital of Poland", ["poland"], None)], self.db_path)
+        new_version, reset, elements = get_graph_delta(version, self.db_path)
+        self.assertGreater(new_version, version)
+        self.assertFalse(reset)
+        self.assertEqual(_ids(elements), {"note_krakow", "edge_note_krakow_keyword_poland"})
+
+    def test_changed_memory_resets_the_delta(self):
+        version, _ = get_graph_elements(self.db_path)
+        update_in_db(1, "Warsaw", "Capital of Poland", ["capital"], self.db_path)
+
+        new_version, reset, elements = get_graph_delta(version, self.db_path)
+        self.assertGreater(new_version, version)
+        self.assertTrue(reset)
+        self.assertEqual(_ids(elements), {"note_warsaw", "keyword_capital", "edge_note_warsaw_keyword_capital"})
+
+    def test_unknown_version_resets_the_delta(self):
+        version, _ = get_graph_elements(self.db_path)
+        _, reset, elements = get_graph_delta(version + 1000, self.db_path)
+        self.assertTrue(reset)
+        self.assertEqual(len(elements), 5)
+
+    def test_released_graph_comes_back_at_a_newer_version(self):
+        version, _ = get_graph_elements(self.db_path)
+        release_graph(self.db_path)
+
+        new_version, reset, _ = get_graph_delta(version, self.db_path)
+        self.assertGreater(new_version, version)
+        self.assertTrue(reset)
+
+    def test_invalidated_graph_is_rebuilt(self):
+        version, _ = get_graph_elements(self.db_path)
+        invalidate_graph(self.db_path)
+        _, reset, _ = get_graph_delta(version, self.db_path)
+        self.assertTrue(reset)
+
+    def test_graphs_are_bounded(self):
+        other_path = os.path.join(self.workdir, "other.db")
+        initialize_db(other_path)
+        version, _ = get_graph_elements(self.db_path)
+        with mock.patch.dict(os.environ, {"MAX_LOADED_STORES": "1"}):
+            get_graph_elements(other_path)
+            # The first graph was evicted, so its old version cannot be continued
+            _, reset, _ = get_graph_delta(version, self.db_path)
+        release_graph(other_path)
+        self.assertTrue(reset)
+
+    def test_page_and_neighbourhood(self):
+        add_many_to_db([("Krakow", "Old capital of Poland", ["poland"], None)], self.db_path)
+
+        _, total, elements = get_graph_page(1, 1, self.db_path)
+        self.assertEqual(total, 2)
+        self.assertEqual(_ids(elements), {"note_krakow", "keyword_poland", "edge_note_krakow_keyword_poland"})
+
+        _, elements = get_graph_neighbourhood("keyword_poland", 1, self.db_path)
+        self.assertEqual(_ids(elements), {
+            "keyword_poland", "note_warsaw", "note_krakow",
+            "edge_note_warsaw_keyword_poland", "edge_note_krakow_keyword_poland"
+        })
+        self.assertEqual(get_graph_neighbourhood("note_missing", 1, self.db_path)[1], [])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,107 @@
+"""
+Job queue leases, retries and backoff.
+
+    python -m pytest tests
+"""
+import os
+import time
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from database import get_connection, close_connections
+from job_queue import initialize_job_queue, enqueue_job, get_job, _claim_jobs, _run_jobs
+
+
+class JobQueueTest(unittest.TestCase):
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.workdir, "jobs.db")
+        initialize_job_queue(self.db_path)
+
+    def tearDown(self):
+        close_connections()
+        shutil.rmtree(self.workdir)
+
+    def _run_after(self, job_id):
+        return get_connection(self.db_path).execute('SELECT run_after FROM jobs WHERE id = ?', (job_id,)).fetchone()[0]
+
+    def _make_due(self):
+        conn = get_connection(self.db_path)
+        with conn:
+            conn.execute('UPDATE jobs SET run_after = 0')
+
+    def test_claimed_job_is_not_claimed_again_while_leased(self):
+        job_id = enqueue_job("ingest", {"n": 1}, self.db_path)
+        kind, jobs = _claim_jobs(16, self.db_path)
+
+        self.assertEqual(kind, "ingest")
+        self.assertEqual(jobs, [(job_id, {"n": 1}, 0)])
+        self.assertEqual(get_job(job_id, self.db_path)["status"], "running")
+        self.assertEqual(_claim_jobs(16, self.db_path), (None, []))
+
+    def test_expired_lease_is_requeued(self):
+        job_id = enqueue_job("ingest", {"n": 1}, self.db_path)
+        _claim_jobs(16, self.db_path)
+        time.sleep(0.01)
+
+        with mock.patch.dict(os.environ, {"JOB_LEASE_SECONDS": "0"}):
+            kind, jobs = _claim_jobs(16, self.db_path)
+        self.assertEqual([job[0] for job in jobs], [job_id])
+
+    def test_claims_one_kind_per_batch(self):
+        first = enqueue_job("ingest", {}, self.db_path)
+        enqueue_job("analyze", {}, self.db_path)
+        third = enqueue_job("ingest", {}, self.db_path)
+
+        kind, jobs = _claim_jobs(16, self.db_path)
+        self.assertEqual(kind, "ingest")
+        self.assertEqual([job[0] for job in jobs], [first, third])
+
+    def test_successful_job_records_its_result(self):
+        job_id = enqueue_job("double", {"n": 2}, self.db_path)
+        handlers = {"double": lambda payloads: [payload["n"] * 2 for payload in payloads]}
+
+        self.assertTrue(_run_jobs(handlers, 16, self.db_path))
+        job = get_job(job_id, self.db_path)
+        self.assertEqual((job["status"], job["result"], job["error"]), ("done", 4, None))
+        self.assertFalse(_run_jobs(handlers, 16, self.db_path))
+
+    def test_failed_job_is_retried_with_backoff(self):
+        job_id = enqueue_job("flaky", {}, self.db_path)
+        handlers = {"flaky": lambda payloads: [RuntimeError("upstream down") for _ in payloads]}
+
+        before = time.time()
+        _run_jobs(handlers, 16, self.db_path)
+        job = get_job(job_id, self.db_path)
+        self.assertEqual((job["status"], job["attempts"], job["error"]), ("pending", 1, "upstream down"))
+        self.assertGreaterEqual(self._run_after(job_id), before + 2)
+        # Not due again until its backoff has passed
+        self.assertFalse(_run_jobs(handlers, 16, self.db_path))
+
+    def test_job_fails_after_max_attempts(self):
+        job_id = enqueue_job("flaky", {}, self.db_path)
+
+        def handler(payloads):
+            raise RuntimeError("upstream down")
+
+        with mock.patch.dict(os.environ, {"JOB_MAX_ATTEMPTS": "2"}):
+            for _ in range(2):
+                self._make_due()
+                _run_jobs({"flaky": handler}, 16, self.db_path)
+        job = get_job(job_id, self.db_path)
+        self.assertEqual((job["status"], job["attempts"]), ("failed", 2))
+
+    def test_unknown_kind_is_an_error(self):
+        job_id = enqueue_job("unknown", {}, self.db_path)
+        _run_jobs({}, 16, self.db_path)
+        self.assertIn("No handler", get_job(job_id, self.db_path)["error"])
+
+    def test_get_job_checks_the_owner(self):
+        job_id = enqueue_job("ingest", {"db_path": "tenants/a.db"}, self.db_path)
+        self.assertIsNotNone(get_job(job_id, self.db_path, owner="tenants/a.db"))
+        self.assertIsNone(get_job(job_id, self.db_path, owner="tenants/b.db"))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,47 @@
+"""
+Choosing the keyword hints shown to the analyzer.
+
+    python -m pytest tests
+"""
+import unittest
+from unittest import mock
+
+from keyword_hints import select_keyword_hints
+
+
+def _words(text):
+    # One token per word, so budgets do not depend on tiktoken being installed
+    return len(text.split())
+
+
+@mock.patch("keyword_hints.count_tokens", _words)
+class KeywordHintsTest(unittest.TestCase):
+    known = {"poland", "warsaw", "city", "history", "food"}
+
+    def _select(self, prompt, neighbour_keywords=(), top_keywords=(), token_budget=100, limit=50):
+        return select_keyword_hints(prompt, list(neighbour_keywords), list(top_keywords),
+                                    lambda keyword: keyword in self.known, token_budget, limit)
+
+    def test_prompt_keywords_then_neighbours_then_most_used(self):
+        keywords, tokens = self._select(
+            "Tell me about Warsaw, Poland!",
+            neighbour_keywords=[["city", "poland"], ["history"]],
+            top_keywords=[("food", 9), ("city", 5)]
+        )
+        self.assertEqual(keywords, ["poland", "warsaw", "city", "history", "food"])
+        # One token per keyword and one per separator
+        self.assertEqual(tokens, 9)
+
+    def test_unknown_prompt_words_are_not_hints(self):
+        self.assertEqual(self._select("tell me about krakow")[0], [])
+
+    def test_limit(self):
+        keywords, _ = self._select("warsaw", top_keywords=[("food", 9), ("city", 5)], limit=2)
+        self.assertEqual(keywords, ["warsaw", "food"])
+
+    def test_token_budget(self):
+        keywords, tokens = self._select("warsaw", neighbour_keywords=[["city", "history"]], token_budget=4)
+        self.assertEqual((keywords, tokens), (["warsaw", "city"], 3))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,75 @@
+"""
+The Prometheus metrics page.
+
+    python -m pytest tests
+"""
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+import metrics
+from metrics import span, increment, record_usage, register_collector, render_metrics
+
+
+class MetricsTest(unittest.TestCase):
+    def setUp(self):
+        # Other tests in the process record metrics too, so start from empty registries
+        patches = [mock.patch.object(metrics, name, value) for name, value in
+                   (("_histograms", {}), ("_counters", {}), ("_collectors", []))]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def _lines(self):
+        return render_metrics().splitlines()
+
+    def test_every_metric_has_help_and_type(self):
+        lines = self._lines()
+        for name, (kind, _) in metrics._metrics.items():
+            self.assertIn(f"# TYPE {name} {kind}", lines)
+            self.assertTrue(any(line.startswith(f"# HELP {name} ") for line in lines))
+
+    def test_stage_histogram_buckets_are_cumulative(self):
+        metrics.observe_duration("faiss_search", 0.003)
+        metrics.observe_duration("faiss_search", 0.2)
+        metrics.observe_duration("faiss_search", 60)
+        lines = self._lines()
+
+        name = "memorymaker_stage_seconds"
+        self.assertIn(f'{name}_bucket{{stage="faiss_search",le="0.001"}} 0', lines)
+        self.assertIn(f'{name}_bucket{{stage="faiss_search",le="0.005"}} 1', lines)
+        self.assertIn(f'{name}_bucket{{stage="faiss_search",le="30.0"}} 2', lines)
+        self.assertIn(f'{name}_bucket{{stage="faiss_search",le="+Inf"}} 3', lines)
+        self.assertIn(f'{name}_count{{stage="faiss_search"}} 3', lines)
+        total = next(line for line in lines if line.startswith(f'{name}_sum{{stage="faiss_search"}}'))
+        self.assertAlmostEqual(float(total.split()[-1]), 60.203)
+
+    def test_span_times_blocks_that_raise(self):
+        with self.assertRaises(RuntimeError):
+            with span("analyzer_call"):
+                raise RuntimeError("upstream down")
+        self.assertIn('memorymaker_stage_seconds_count{stage="analyzer_call"} 1', self._lines())
+
+    def test_counters_and_usage(self):
+        increment("memorymaker_answer_cache_hits_total")
+        increment("memorymaker_answer_cache_hits_total")
+        record_usage("chat", SimpleNamespace(prompt_tokens=12, completion_tokens=3))
+        record_usage("embeddings", None)
+        lines = self._lines()
+
+        self.assertIn("memorymaker_answer_cache_hits_total 2", lines)
+        self.assertIn('memorymaker_openai_requests_total{endpoint="chat"} 1', lines)
+        self.assertIn('memorymaker_openai_requests_total{endpoint="embeddings"} 1', lines)
+        self.assertIn('memorymaker_openai_tokens_total{endpoint="chat",kind="prompt"} 12', lines)
+        self.assertIn('memorymaker_openai_tokens_total{endpoint="chat",kind="completion"} 3', lines)
+
+    def test_collectors_report_at_render_time(self):
+        stores = {"memories.db": 10}
+        register_collector(lambda: [("memorymaker_index_vectors", {"db": path}, count)
+                                    for path, count in stores.items()])
+        self.assertIn('memorymaker_index_vectors{db="memories.db"} 10', self._lines())
+        stores["memories.db"] = 11
+        self.assertIn('memorymaker_index_vectors{db="memories.db"} 11', self._lines())
+
+if __name__ == "__main__":
+    unittest.main()
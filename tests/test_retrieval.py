@@ -0,0 +1,36 @@
+"""
+Merging lexical and vector rankings with reciprocal rank fusion.
+
+    python -m pytest tests
+"""
+import unittest
+
+from main import reciprocal_rank_fusion
+
+
+class ReciprocalRankFusionTest(unittest.TestCase):
+    def test_entries_in_both_rankings_come_first(self):
+        vector = [{"id": 1}, {"id": 2}, {"id": 3}]
+        lexical = [{"id": 3}, {"id": 4}]
+
+        fused = reciprocal_rank_fusion([vector, lexical], k=60)
+        self.assertEqual([entry["id"] for entry in fused], [3, 1, 2, 4])
+        self.assertAlmostEqual(fused[0]["rrf_score"], 1 / 63 + 1 / 61)
+        self.assertAlmostEqual(fused[1]["rrf_score"], 1 / 61)
+
+    def test_fields_are_merged_without_overwriting_with_none(self):
+        vector = [{"id": 1, "title": "Poland", "similarity": 0.9, "bm25": None}]
+        lexical = [{"id": 1, "title": "Poland", "similarity": None, "bm25": 3.5}]
+
+        (entry,) = reciprocal_rank_fusion([vector, lexical])
+        self.assertEqual((entry["similarity"], entry["bm25"]), (0.9, 3.5))
+
+    def test_smaller_k_weighs_top_ranks_more(self):
+        rankings = [[{"id": 1}, {"id": 2}], [{"id": 2}]]
+        self.assertAlmostEqual(reciprocal_rank_fusion(rankings, k=1)[0]["rrf_score"], 1 / 3 + 1 / 2)
+
+    def test_empty_rankings(self):
+        self.assertEqual(reciprocal_rank_fusion([[], []]), [])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,72 @@
+"""
+Tenant id validation and tenant database creation.
+
+    python -m pytest tests
+"""
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import tenants
+from database import close_connections
+from tenants import tenant_path, tenant_db_path
+
+
+class TenantTest(unittest.TestCase):
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.env = mock.patch.dict(os.environ, {"TENANT_DIR": self.workdir})
+        self.env.start()
+        os.environ.pop("TENANT_ALLOWLIST", None)
+
+    def tearDown(self):
+        close_connections()
+        with tenants._lock:
+            tenants._initialized.clear()
+        self.env.stop()
+        shutil.rmtree(self.workdir)
+
+    def test_no_tenant_uses_the_default_database(self):
+        self.assertEqual(tenant_path(None), "memories.db")
+        self.assertEqual(tenant_db_path(""), "memories.db")
+
+    def test_valid_ids_map_to_files_in_the_tenant_dir(self):
+        for tenant in ("acme", "ACME_2", "a-b", "x" * 64):
+            self.assertEqual(tenant_path(tenant), os.path.join(self.workdir, f"{tenant}.db"))
+
+    def test_invalid_ids_are_rejected(self):
+        for tenant in ("../etc/passwd", "a/b", "a.b", "a b", "x" * 65, "tenant\n"):
+            with self.assertRaises(ValueError):
+                tenant_path(tenant)
+            with self.assertRaises(ValueError):
+                tenant_db_path(tenant, create=True)
+        self.assertEqual(os.listdir(self.workdir), [])
+
+    def test_unknown_tenant_is_only_created_on_write(self):
+        with self.assertRaises(ValueError):
+            tenant_db_path("acme")
+        self.assertFalse(os.path.exists(tenant_path("acme")))
+
+        db_path = tenant_db_path("acme", create=True)
+        self.assertTrue(os.path.exists(db_path))
+        self.assertEqual(tenant_db_path("acme"), db_path)
+
+    def test_allowlist_limits_new_tenants(self):
+        with mock.patch.dict(os.environ, {"TENANT_ALLOWLIST": "acme,globex"}):
+            self.assertTrue(os.path.exists(tenant_db_path("globex", create=True)))
+            with self.assertRaises(ValueError):
+                tenant_db_path("initech", create=True)
+        self.assertFalse(os.path.exists(tenant_path("initech")))
+
+    def test_initialized_tenants_are_bounded(self):
+        with mock.patch.dict(os.environ, {"MAX_LOADED_STORES": "2"}):
+            for tenant in ("a", "b", "c"):
+                tenant_db_path(tenant, create=True)
+            self.assertEqual(list(tenants._initialized), [tenant_path("b"), tenant_path("c")])
+            # An evicted tenant that still exists is opened again without create
+            self.assertEqual(tenant_db_path("a"), tenant_path("a"))
+
+if __name__ == "__main__":
+    unittest.main()
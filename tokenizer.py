@@ -0,0 +1,39 @@
+import logging
+
+# tiktoken is optional; without it token counts are estimated from the text length
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+_encoding = None
+
+
+def _get_encoding():
+    """
+    Load the cl100k_base encoding on first use, or return None if it is unavailable.
+    """
+    global _encoding, tiktoken
+    if _encoding is None and tiktoken is not None:
+        try:
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception as e:
+            # The encoding file is downloaded on first use and may be unreachable
+            logging.warning(f"tiktoken encoding unavailable, estimating token counts: {e}")
+            tiktoken = None
+    return _encoding
+
+def count_tokens(text):
+    """
+    Count the tokens of a text for the OpenAI embedding and chat models.
+
+    Args:
+        text (str): The text to count.
+
+    Returns:
+        int: The number of tokens, estimated as one per four characters without tiktoken.
+    """
+    encoding = _get_encoding()
+    if encoding is None:
+        return len(text) // 4 + 1
+    return len(encoding.encode(text, disallowed_special=()))
@@ -0,0 +1,248 @@
+import os
+import json
+import logging
+import tempfile
+
+import numpy as np
+import faiss
+
+# Supported index backends and the environment variables that tune them:
+#   flat      exact brute-force search (default)
+#   ivf_flat  inverted lists over full vectors, FAISS_NLIST / FAISS_NPROBE
+#   hnsw      graph search, FAISS_HNSW_M / FAISS_EF_CONSTRUCTION / FAISS_EF_SEARCH
+#   ivf_pq    inverted lists over product-quantized vectors, FAISS_NLIST / FAISS_NPROBE /
+#             FAISS_PQ_M / FAISS_PQ_NBITS
+#   fp16      exact search over vectors stored as float16, half the memory of flat
+#   sq8       exact search over vectors scalar-quantized to int8, a quarter of the memory
+# Results of the compressed backends are re-ranked against the full-precision stored
+# embeddings, see rerank_factor.
+BACKENDS = ("flat", "ivf_flat", "hnsw", "ivf_pq", "fp16", "sq8")
+
+# Upper bound on the number of vectors used to train IVF, PQ and SQ backends
+MAX_TRAINING_VECTORS = 100000
+# Vectors needed to train the per-dimension ranges of the sq8 backend
+MIN_SQ_TRAINING_VECTORS = 1000
+
+
+def index_description(backend=None):
+    """
+    Return the FAISS index factory string for a backend.
+    Every backend is wrapped in an IDMap2 so vectors are keyed by memory id.
+
+    Args:
+        backend (str, optional): The backend name, defaults to FAISS_BACKEND.
+
+    Returns:
+        str: The index factory string.
+    """
+    backend = backend or os.getenv("FAISS_BACKEND", "flat")
+    nlist = int(os.getenv("FAISS_NLIST", "1024"))
+    if backend == "flat":
+        return "IDMap2,Flat"
+    if backend == "ivf_flat":
+        return f"IDMap2,IVF{nlist},Flat"
+    if backend == "hnsw":
+        return f"IDMap2,HNSW{int(os.getenv('FAISS_HNSW_M', '32'))}"
+    if backend == "ivf_pq":
+        pq_m = int(os.getenv("FAISS_PQ_M", "64"))
+        pq_nbits = int(os.getenv("FAISS_PQ_NBITS", "8"))
+        return f"IDMap2,IVF{nlist},PQ{pq_m}x{pq_nbits}"
+    if backend == "fp16":
+        return "IDMap2,SQfp16"
+    if backend == "sq8":
+        return "IDMap2,SQ8"
+    raise ValueError(f"Unknown FAISS backend '{backend}', expected one of {', '.join(BACKENDS)}")
+
+def create_index(dimension, backend=None):
+    """
+    Create an empty FAISS index for a backend.
+
+    Args:
+        dimension (int): The dimension of the embeddings.
+        backend (str, optional): The backend name, defaults to FAISS_BACKEND.
+
+    Returns:
+        faiss.Index: The new index. IVF, PQ and sq8 indexes still need training.
+    """
+    index = faiss.index_factory(dimension, index_description(backend), faiss.METRIC_L2)
+    inner = base_index(index)
+    if isinstance(inner, faiss.IndexHNSW):
+        inner.hnsw.efConstruction = int(os.getenv("FAISS_EF_CONSTRUCTION", "200"))
+    return index
+
+def base_index(index):
+    """
+    Return the index wrapped by an IDMap, downcast to its concrete type.
+    """
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexIDMap):
+        index = faiss.downcast_index(index.index)
+    return index
+
+def index_ids(index):
+    """
+    Return the memory ids stored in an IDMap index as an int64 array.
+    """
+    return faiss.vector_to_array(faiss.downcast_index(index).id_map)
+
+def supports_remove(index):
+    """
+    Return whether vectors can be removed from the index in place. HNSW graphs cannot.
+    """
+    return not isinstance(base_index(index), faiss.IndexHNSW)
+
+def apply_search_params(index):
+    """
+    Apply the FAISS_NPROBE and FAISS_EF_SEARCH tuning knobs to an index.
+    Knobs that do not apply to the index type are ignored.
+    """
+    params = faiss.ParameterSpace()
+    for name, env in (("nprobe", "FAISS_NPROBE"), ("efSearch", "FAISS_EF_SEARCH")):
+        value = os.getenv(env, "16" if name == "nprobe" else "64")
+        try:
+            params.set_index_parameter(index, name, int(value))
+        except RuntimeError:
+            pass
+
+def min_training_vectors(index):
+    """
+    Return the number of vectors needed to train an index, 0 if it needs no training.
+    """
+    inner = base_index(index)
+    if index.is_trained:
+        return 0
+    if isinstance(inner, faiss.IndexScalarQuantizer):
+        return MIN_SQ_TRAINING_VECTORS
+    if not isinstance(inner, faiss.IndexIVF):
+        return 0
+    required = inner.nlist
+    if isinstance(inner, faiss.IndexIVFPQ):
+        required = max(required, 2 ** inner.pq.nbits)
+    return required
+
+def is_compressed(index):
+    """
+    Return whether an index stores lossy copies of the vectors, so its distances are approximate.
+    """
+    inner = base_index(index)
+    return isinstance(inner, (faiss.IndexScalarQuantizer, faiss.IndexIVFPQ, faiss.IndexPQ))
+
+def rerank_factor(index):
+    """
+    Return how many candidates per wanted result to fetch from an index before
+    re-ranking them exactly: FAISS_RERANK (default 4) for compressed indexes, 1 otherwise.
+    """
+    if not is_compressed(index):
+        return 1
+    return max(1, int(os.getenv("FAISS_RERANK", "4")))
+
+def train_index(index, vectors):
+    """
+    Train an index on a random sample of at most MAX_TRAINING_VECTORS vectors.
+
+    Args:
+        index (faiss.Index): The untrained index.
+        vectors (np.ndarray): The (n, dimension) float32 training matrix.
+    """
+    if len(vectors) > MAX_TRAINING_VECTORS:
+        sample = np.random.default_rng(0).choice(len(vectors), MAX_TRAINING_VECTORS, replace=False)
+        vectors = vectors[np.sort(sample)]
+    index.train(np.ascontiguousarray(vectors))
+
+
+def snapshot_path(db_path="memories.db"):
+    """
+    Return the path of the FAISS snapshot that belongs to a database.
+    """
+    return os.path.splitext(db_path)[0] + ".faiss"
+
+def _file_signature(path):
+    """
+    Return what identifies one written version of a file: its inode, size and
+    modification time, which moving it into place keeps.
+    """
+    stat = os.stat(path)
+    return [stat.st_ino, stat.st_size, stat.st_mtime_ns]
+
+def _temporary_path(path):
+    """
+    Create an empty temporary file next to path, unique to this writer, and return its name.
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", prefix=os.path.basename(path) + ".", suffix=".tmp")
+    os.close(fd)
+    return tmp_path
+
+def save_index_snapshot(index, generation, description, db_path="memories.db"):
+    """
+    Write a FAISS index to disk together with the generation it was built from.
+
+    The index and its metadata are each written to a temporary file of their own and
+    moved into place, so readers never see a partially written file and concurrent
+    writers do not share temporary files. The metadata records the signature of the
+    index file it belongs to, so a reader that finds the index of one save next to
+    the metadata of another ignores the pair.
+
+    Args:
+        index (faiss.Index): The index to write.
+        generation (int): The database generation the index reflects.
+        description (str): The index factory string the index was created from.
+        db_path (str): The path to the SQLite database file.
+    """
+    path = snapshot_path(db_path)
+    index_tmp = _temporary_path(path)
+    meta_tmp = _temporary_path(path + ".json")
+    try:
+        faiss.write_index(index, index_tmp)
+        ids = index_ids(index)
+        meta = {
+            "generation": generation,
+            "ntotal": index.ntotal,
+            "last_id": int(ids.max()) if len(ids) else 0,
+            "dimension": index.d,
+            "description": description,
+            "signature": _file_signature(index_tmp)
+        }
+        with open(meta_tmp, "w") as f:
+            json.dump(meta, f)
+        os.replace(index_tmp, path)
+        os.replace(meta_tmp, path + ".json")
+    finally:
+        for tmp_path in (index_tmp, meta_tmp):
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+def load_index_snapshot(db_path="memories.db", mmap=True):
+    """
+    Load the FAISS snapshot of a database.
+
+    With mmap enabled the inverted lists of IVF indexes are memory-mapped read-only,
+    so worker processes share those pages instead of each holding a private copy.
+    FAISS reads every other index type (flat, HNSW, fp16, sq8) fully into memory.
+    The index is read-only either way, see main.ensure_writable_index.
+
+    Args:
+        db_path (str): The path to the SQLite database file.
+        mmap (bool): Whether to memory-map the snapshot.
+
+    Returns:
+        tuple: (index, meta), or (None, None) if there is no usable snapshot, including
+        an unreadable one or an index and metadata written by different saves.
+    """
+    path = snapshot_path(db_path)
+    if not os.path.exists(path) or not os.path.exists(path + ".json"):
+        return None, None
+
+    try:
+        with open(path + ".json") as f:
+            meta = json.load(f)
+        if meta.get("signature") != _file_signature(path):
+            # The index and its metadata were not written together
+            return None, None
+        flags = faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY if mmap else 0
+        index = faiss.read_index(path, flags)
+    except (OSError, ValueError, RuntimeError) as e:
+        logging.warning(f"Ignoring unreadable FAISS snapshot {path}: {e}")
+        return None, None
+    if index.ntotal != meta.get("ntotal"):
+        return None, None
+    return index, meta